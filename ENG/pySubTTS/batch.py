@@ -0,0 +1,272 @@
+# pySubTTS - batch queue, dubs many SRT/video pairs (e.g. a whole season) in one run
+# By MoonDragon (https://github.com/MoonDragon-MD/pySubTTS)
+# Used by pySubTTS_cli.py (batch command) and pySubTTS_bench.py
+# Every job works in its own folder, so the next episode is synthesized while the previous one is mixed
+
+import os
+import re
+import json
+import time
+import queue
+import threading
+import pipeline
+import tracing
+
+# Originals paired with the SRT files of a folder, a video is preferred to an audio file with the same name
+MEDIA_EXTENSIONS = ('.mp4', '.mkv', '.avi', '.mov', '.m4v', '.webm', '.ts', '.mpg', '.mpeg', '.wmv', '.flv',
+                    '.wav', '.mp3', '.m4a', '.aac', '.flac', '.ogg', '.opus')
+
+class BatchJob:
+    """An SRT of a batch with its original video/audio (None for Phase I only) and the folder of its files."""
+
+    def __init__(self, name, srt_file, original=None, work_dir=None):
+        self.name = name
+        self.srt_file = srt_file
+        self.original = original
+        self.work_dir = work_dir
+        self.status = 'queued'  # queued, convert, mixmerge, done, failed or cancelled
+        self.error = None
+        self.outputs = {}
+        self.notices = []  # Notices of convert_srt for the user, e.g. how the SRT was repaired
+        self.timings = {}  # Seconds spent in each stage
+
+    def to_dict(self):
+        return {
+            'name': self.name, 'srt': self.srt_file, 'original': self.original, 'work_dir': self.work_dir,
+            'status': self.status, 'error': self.error, 'outputs': self.outputs, 'notices': self.notices,
+            'timings': {stage: round(seconds, 3) for stage, seconds in self.timings.items()},
+        }
+
+def natural_key(name):
+    """Sort key that puts episode 2 before episode 10."""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', name)]
+
+def pair_folder(folder):
+    """Returns [(name, srt_file, original)] of the SRT files of folder, each with the video/audio file of the same name.
+
+    A subtitle with a language suffix (episode01.it.srt) also matches episode01.mp4, an SRT without a match has
+    no original and gets only Phase I.
+    """
+    media = {}
+    srt_files = []
+    for name in sorted(os.listdir(folder), key=natural_key):
+        path = os.path.join(folder, name)
+        stem, extension = os.path.splitext(name)
+        extension = extension.lower()
+        if not os.path.isfile(path):
+            continue
+        if extension == '.srt':
+            srt_files.append((stem, path))
+        elif extension in MEDIA_EXTENSIONS:
+            current = media.get(stem.lower())
+            if current is None or MEDIA_EXTENSIONS.index(extension) < MEDIA_EXTENSIONS.index(current[0]):
+                media[stem.lower()] = (extension, path)
+    pairs = []
+    for stem, srt_file in srt_files:
+        key = stem.lower()
+        while key not in media and '.' in key:
+            key = key.rsplit('.', 1)[0]
+        pairs.append((stem, srt_file, media[key][1] if key in media else None))
+    return pairs
+
+def read_manifest(path):
+    """Returns [(name, srt_file, original)] of a JSON manifest, a list of {"srt": ..., "original": ..., "name": ...}.
+
+    The list can also be the "jobs" of an object. "original" and "name" are optional, the relative paths
+    are relative to the folder of the manifest.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+    except (OSError, ValueError) as e:
+        raise pipeline.PipelineError(f"Error in reading the batch manifest: {str(e)}")
+    entries = data.get('jobs') if isinstance(data, dict) else data
+    if not isinstance(entries, list):
+        raise pipeline.PipelineError("The batch manifest must be a list of jobs or an object with a \"jobs\" list.")
+    base = os.path.dirname(os.path.abspath(path))
+    pairs = []
+    for n, entry in enumerate(entries, 1):
+        if not isinstance(entry, dict) or not entry.get('srt'):
+            raise pipeline.PipelineError(f"Job {n} of the batch manifest has no \"srt\".")
+        srt_file = os.path.join(base, entry['srt'])
+        original = os.path.join(base, entry['original']) if entry.get('original') else None
+        name = entry.get('name') or os.path.splitext(os.path.basename(srt_file))[0]
+        pairs.append((name, srt_file, original))
+    return pairs
+
+def default_output_dir(source):
+    """Folder of the jobs of a batch when none is given: dubbed, next to the SRT files or to the manifest."""
+    base = source if os.path.isdir(source) else os.path.dirname(os.path.abspath(source))
+    return os.path.join(base, 'dubbed')
+
+def load_jobs(source, output_dir=None):
+    """Returns the BatchJobs of a folder of SRT/video pairs or of a JSON manifest (see read_manifest()).
+
+    Each job works in output_dir/<name>, output_dir defaults to default_output_dir(source).
+    """
+    if os.path.isdir(source):
+        pairs = pair_folder(source)
+    elif os.path.isfile(source):
+        pairs = read_manifest(source)
+    else:
+        raise pipeline.PipelineError(f"Batch folder or manifest not found: {source}")
+    if not pairs:
+        raise pipeline.PipelineError(f"No SRT file found in {source}")
+    output_dir = output_dir or default_output_dir(source)
+    jobs = []
+    used = set()
+    for name, srt_file, original in pairs:
+        # The name is the folder of the job, two jobs never share one
+        name = re.sub(r'[\\/:*?"<>|]+', '_', name).strip() or 'job'
+        unique = name
+        n = 2
+        while unique.lower() in used:
+            unique = f'{name}_{n}'
+            n += 1
+        used.add(unique.lower())
+        jobs.append(BatchJob(unique, srt_file, original, os.path.join(output_dir, unique)))
+    return jobs
+
+def write_report(path, jobs):
+    """Writes the state of the jobs in path as JSON, replaced in one step so that it is never half written."""
+    temp_file = f'{path}.{os.urandom(8).hex()}.tmp'
+    try:
+        with open(temp_file, 'w', encoding='utf-8') as file:
+            json.dump({'jobs': [job.to_dict() for job in jobs]}, file, indent=1, ensure_ascii=False)
+        os.replace(temp_file, path)
+    except OSError as e:
+        pipeline.log(f"Warning: Could not save the batch report: {e}")
+
+def mix_job(job, one_pass, mix_options, cancel_event=None):
+    """Phase II and III of a job: the video is mixed and merged, an audio original is only mixed."""
+    if not os.path.exists(job.original) or not pipeline.has_video_stream(job.original):
+        # A missing original is reported by mix_original_audio
+        job.outputs['mix'] = pipeline.mix_original_audio(job.original, work_dir=job.work_dir, cancel_event=cancel_event, **mix_options)
+    elif one_pass:
+        job.outputs['video'] = pipeline.mix_and_merge(job.original, work_dir=job.work_dir, cancel_event=cancel_event, **mix_options)
+    else:
+        job.outputs['mix'] = pipeline.mix_original_audio(job.original, work_dir=job.work_dir, cancel_event=cancel_event, **mix_options)
+        job.outputs['video'] = pipeline.merge_audio_video(job.original, work_dir=job.work_dir, cancel_event=cancel_event)
+
+def run_batch(jobs, convert_options, mix_options=None, one_pass=True, progress=None, cancel_event=None,
+              report_file=None):
+    """Dubs the jobs with a pool of threads for Phase I and one for Phase II and III, returns the jobs.
+
+    A job goes to the mix as soon as its Phase I is done, so while an episode is mixed and merged by FFmpeg
+    the next one is already being synthesized. The stages run at most batch_convert_jobs and batch_mix_jobs
+    jobs at a time. convert_options are the keyword arguments of convert_srt (voice_id, use_edge_tts, ...)
+    and mix_options those of mix_original_audio (volumes and balance). With one_pass a video is mixed and
+    merged by mix_and_merge, otherwise through final_mix.mp3. A job that fails does not stop the others.
+    progress(job, stage, done, total) gets the stages of convert_srt and the "convert" and "mixmerge" stages of
+    the batch (0 of 1 when they start, 1 of 1 when they end). The state of the jobs is written in report_file.
+    When cancel_event is set the stages running are stopped like convert_srt and the queued jobs are cancelled.
+    """
+    if progress is None:
+        progress = lambda job, stage, done, total: None
+    mix_options = mix_options or {}
+    cancel_event = cancel_event or threading.Event()
+    # pyttsx3 already synthesizes on one process for each core (pyttsx3_workers), and with a single worker each job
+    # runs its engine in this process, where two engines are not safe: the eSpeak driver sets one synthesis callback
+    # for the whole process and SAPI needs COM on each thread
+    convert_workers = max(1, pipeline.batch_convert_jobs) if convert_options.get('use_edge_tts') else 1
+    mix_workers = max(1, pipeline.batch_mix_jobs)
+    convert_queue = queue.Queue()
+    mix_queue = queue.Queue()
+    report_lock = threading.Lock()
+
+    def finish(job, status=None):
+        if status is not None:
+            job.status = status
+        if report_file is not None:
+            with report_lock:
+                write_report(report_file, jobs)
+
+    def run_stage(job, stage, function):
+        """Runs a stage of a job, returns False when it failed or was cancelled."""
+        finish(job, stage)
+        progress(job, stage, 0, 1)
+        start = time.perf_counter()
+        try:
+            with tracing.span(job.name, 'job', stage=stage):
+                function()
+            return True
+        except pipeline.PipelineCancelled:
+            job.status = 'cancelled'
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e) or type(e).__name__
+            pipeline.log(f"Batch job {job.name} failed in the {stage} stage: {job.error}")
+        finally:
+            job.timings[stage] = time.perf_counter() - start
+            progress(job, stage, 1, 1)
+        finish(job)
+        return False
+
+    def convert_worker():
+        while True:
+            job = convert_queue.get()
+            if job is None:
+                return
+            if cancel_event.is_set():
+                finish(job, 'cancelled')
+                continue
+            os.makedirs(job.work_dir, exist_ok=True)
+
+            def convert():
+                job.outputs['wav'] = pipeline.convert_srt(
+                    job.srt_file, progress=lambda stage, done, total: progress(job, stage, done, total),
+                    cancel_event=cancel_event, work_dir=job.work_dir, notify=job.notices.append, **convert_options)
+                job.outputs['mp3'] = os.path.join(job.work_dir, 'final_output.mp3')
+
+            if run_stage(job, 'convert', convert):
+                if job.original:
+                    mix_queue.put(job)
+                else:
+                    finish(job, 'done')
+
+    def mix_worker():
+        while True:
+            job = mix_queue.get()
+            if job is None:
+                return
+            if cancel_event.is_set():
+                finish(job, 'cancelled')
+            elif run_stage(job, 'mixmerge', lambda: mix_job(job, one_pass, mix_options, cancel_event)):
+                finish(job, 'done')
+
+    def join(threads):
+        """Waits for the threads, returns True when Ctrl+C cancelled the batch meanwhile."""
+        try:
+            for thread in threads:
+                thread.join()
+            return False
+        except KeyboardInterrupt:
+            # The stages running stop after their current cue, the queued jobs are cancelled
+            cancel_event.set()
+            for thread in threads:
+                thread.join()
+            return True
+
+    tracer = tracing.start() if pipeline.trace.lower() == "on" and not tracing.enabled() else None
+    convert_threads = [threading.Thread(target=convert_worker, name=f'batch convert {n + 1}') for n in range(convert_workers)]
+    mix_threads = [threading.Thread(target=mix_worker, name=f'batch mix {n + 1}') for n in range(mix_workers)]
+    for job in jobs:
+        convert_queue.put(job)
+    for _ in convert_threads:
+        convert_queue.put(None)
+    pipeline.log(f"Batch of {len(jobs)} jobs, {convert_workers} in Phase I and {mix_workers} in the mix at a time")
+    for thread in convert_threads + mix_threads:
+        thread.start()
+    try:
+        interrupted = join(convert_threads)
+        # The mix threads end after the jobs converted, the last one is queued before them
+        for _ in mix_threads:
+            mix_queue.put(None)
+        interrupted = join(mix_threads) or interrupted
+    finally:
+        if tracer is not None:
+            tracing.stop()
+            pipeline.save_trace(tracer, 'batch')
+    if interrupted:
+        raise KeyboardInterrupt
+    return jobs
@@ -0,0 +1,115 @@
+# pySubTTS - pronunciation dictionary (word=pronunciation) applied to each subtitle in a single pass
+# By MoonDragon (https://github.com/MoonDragon-MD/pySubTTS)
+# Used by pipeline.py
+
+import os
+import re
+import json
+import hashlib
+
+CACHE_VERSION = 1  # Change it when the format of the compiled dictionary changes
+
+def read_entries(dictionary_file):
+    """Reads the word=pronunciation lines, a later line wins over an earlier one with the same word."""
+    entries = {}
+    with open(dictionary_file, 'r', encoding='utf-8') as file:
+        for line in file:
+            if '=' not in line:
+                continue
+            word, pronunciation = line.strip().split('=', 1)
+            if word:
+                entries[word] = pronunciation
+    return entries
+
+def build_pattern(words):
+    """Builds a regular expression from the trie of the words, it always matches the longest word."""
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}  # End of a word
+
+    def build(node):
+        alternatives = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not alternatives:
+            return ''
+        if '' in node:
+            # The greedy ? tries the longer words first
+            return '(?:' + '|'.join(alternatives) + ')?'
+        if len(alternatives) == 1:
+            return alternatives[0]
+        return '(?:' + '|'.join(alternatives) + ')'
+
+    return build(trie)
+
+class Dictionary:
+    """Pronunciation dictionary compiled into a single regular expression.
+
+    Each subtitle is rewritten in one pass: at each position the longest word wins and the
+    replaced text is not searched again, so the result does not depend on the order of the lines.
+    """
+
+    def __init__(self, entries, whole_words=False, ignore_case=False, pattern=None):
+        self.whole_words = whole_words
+        self.ignore_case = ignore_case
+        if ignore_case:
+            entries = {word.lower(): pronunciation for word, pronunciation in entries.items()}
+            # re.IGNORECASE also matches characters that lower() keeps apart (s and long s), they are found by casefold()
+            self.folded = {word.casefold(): pronunciation for word, pronunciation in entries.items()}
+        self.entries = entries
+        self.regex = None
+        if entries:
+            if pattern is None:
+                pattern = build_pattern(entries)
+            self.pattern = pattern
+            if whole_words:
+                pattern = r'(?<!\w)(?:' + pattern + r')(?!\w)'
+            self.regex = re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def apply(self, text):
+        """Returns text with every word of the dictionary replaced by its pronunciation."""
+        if self.regex is None:
+            return text
+        if self.ignore_case:
+            return self.regex.sub(self.replacement, text)
+        return self.regex.sub(lambda match: self.entries[match.group(0)], text)
+
+    def replacement(self, match):
+        """Pronunciation of a word matched ignoring case, a match with no entry is left as it is."""
+        word = match.group(0)
+        pronunciation = self.entries.get(word.lower())
+        if pronunciation is None:
+            pronunciation = self.folded.get(word.casefold(), word)
+        return pronunciation
+
+    @classmethod
+    def load(cls, dictionary_file, whole_words=False, ignore_case=False, cache_dir=None):
+        """Loads a dictionary file, reusing the compiled form saved in cache_dir for the same file content."""
+        if cache_dir is None:
+            return cls(read_entries(dictionary_file), whole_words, ignore_case)
+
+        with open(dictionary_file, 'rb') as file:
+            digest = hashlib.sha256(file.read()).hexdigest()
+        cache_file = os.path.join(cache_dir, f'{digest}_{int(ignore_case)}_v{CACHE_VERSION}.json')
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as file:
+                cached = json.load(file)
+            return cls(cached['entries'], whole_words, ignore_case, pattern=cached['pattern'])
+        except (OSError, ValueError, KeyError):
+            pass
+
+        dictionary = cls(read_entries(dictionary_file), whole_words, ignore_case)
+        if dictionary.regex is not None:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                temp_file = f'{cache_file}.{os.urandom(8).hex()}.tmp'
+                with open(temp_file, 'w', encoding='utf-8') as file:
+                    json.dump({'entries': dictionary.entries, 'pattern': dictionary.pattern}, file, ensure_ascii=False)
+                os.replace(temp_file, cache_file)
+            except OSError:
+                pass
+        return dictionary
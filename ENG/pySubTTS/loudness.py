@@ -0,0 +1,198 @@
+# pySubTTS - EBU R128 / ITU-R BS.1770 loudness meter with NumPy (integrated loudness, true peak, LRA)
+# By MoonDragon (https://github.com/MoonDragon-MD/pySubTTS)
+# Used by pipeline.py, replaces the measuring pass of FFmpeg loudnorm
+
+import math
+import numpy as np
+
+ABSOLUTE_GATE = -70.0  # LUFS
+RELATIVE_GATE = -10.0  # LU, integrated loudness
+LRA_RELATIVE_GATE = -20.0  # LU, loudness range
+FFT_SIZE = 1 << 20  # Size of the FFT used for the K-weighting filter
+PEAK_BLOCK = 1024  # Samples, the true peak is interpolated only in the blocks that can exceed the current peak
+
+def k_weighting_coefficients(sample_rate):
+    """Returns the two (b, a) biquads of the K-weighting filter for sample_rate (same design as libebur128)."""
+    # High shelf, models the acoustic effect of the head
+    f0 = 1681.974450955533
+    gain = 3.999843853973347
+    q = 0.7071752369554196
+    k = math.tan(math.pi * f0 / sample_rate)
+    vh = 10 ** (gain / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = ([(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0],
+             [1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0])
+    # High pass (RLB weighting)
+    f0 = 38.13547087602444
+    q = 0.5003270373238773
+    k = math.tan(math.pi * f0 / sample_rate)
+    a0 = 1 + k / q + k * k
+    highpass = ([1.0, -2.0, 1.0], [1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0])
+    return shelf, highpass
+
+def k_weighting_impulse_response(sample_rate, seconds=0.5):
+    """Impulse response of the K-weighting filter, its tail is below -200 dB after half a second."""
+    length = int(sample_rate * seconds)
+    response = np.zeros(length)
+    response[0] = 1.0
+    for b, a in k_weighting_coefficients(sample_rate):
+        x1 = x2 = y1 = y2 = 0.0
+        out = np.empty(length)
+        for n in range(length):
+            x0 = response[n]
+            y0 = b[0] * x0 + b[1] * x1 + b[2] * x2 - a[1] * y1 - a[2] * y2
+            out[n] = y0
+            x2, x1, y2, y1 = x1, x0, y1, y0
+        response = out
+    return response
+
+def true_peak_phases(factor=4, taps=49):
+    """Polyphase windowed-sinc interpolator used for the true peak (same filter as libebur128)."""
+    j = np.arange(taps)
+    m = j - (taps - 1) / 2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        h = np.where(np.abs(m) > 1e-6, np.sin(m * np.pi / factor) / (m * np.pi / factor), 1.0)
+    h *= 0.5 * (1 - np.cos(2 * np.pi * j / (taps - 1)))
+    return [h[phase::factor] for phase in range(factor)]
+
+class LoudnessMeter:
+    """Measures integrated loudness, true peak and loudness range of audio added in chunks.
+
+    add() accepts float samples in [-1, 1], shaped (n,) for mono or (n, channels). Only the 100 ms
+    energies are kept, so the memory does not grow with the length of the audio.
+    """
+
+    def __init__(self, sample_rate, channels=1):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.subblock = int(round(sample_rate / 10))  # 100 ms
+        impulse = k_weighting_impulse_response(sample_rate)
+        self.fft_size = max(FFT_SIZE, 1 << int(math.ceil(math.log2(4 * len(impulse)))))
+        self.chunk_size = self.fft_size - len(impulse) + 1
+        self.filter_spectrum = np.fft.rfft(impulse, self.fft_size)
+        self.filter_history = np.zeros((len(impulse) - 1, channels))
+        # Oversampling only up to 4x below 96 kHz, as in BS.1770
+        factor = 4 if sample_rate < 96000 else 2 if sample_rate < 192000 else 1
+        self.phases = true_peak_phases(factor) if factor > 1 else []
+        self.taps = max((len(phase) for phase in self.phases), default=1)
+        # An interpolated sample can not exceed the largest input sample of its window times this gain
+        self.peak_gain = max((float(np.abs(phase).sum()) for phase in self.phases), default=1.0)
+        self.peak_history = np.zeros((self.taps - 1, channels))
+        self.pending = np.zeros((0, channels))
+        self.energies = []
+        self.peak = 0.0
+
+    def add(self, samples):
+        samples = np.asarray(samples, dtype=np.float64)
+        if samples.ndim == 1:
+            samples = samples[:, np.newaxis]
+        for start in range(0, len(samples), self.chunk_size):
+            chunk = samples[start:start + self.chunk_size]
+            self._add_true_peak(chunk)
+            self._add_energy(self._k_filter(chunk))
+
+    def _k_filter(self, chunk):
+        """FFT convolution with the K-weighting response, the history makes it continuous between chunks."""
+        extended = np.concatenate([self.filter_history, chunk])
+        spectrum = np.fft.rfft(extended, self.fft_size, axis=0) * self.filter_spectrum[:, np.newaxis]
+        filtered = np.fft.irfft(spectrum, self.fft_size, axis=0)
+        history = len(self.filter_history)
+        self.filter_history = extended[len(extended) - history:]
+        return filtered[history:history + len(chunk)]
+
+    def _add_energy(self, filtered):
+        # All the channels have weight 1.0 (mono and stereo)
+        squares = np.concatenate([self.pending, filtered ** 2])
+        complete = len(squares) // self.subblock * self.subblock
+        if complete:
+            blocks = squares[:complete].reshape(-1, self.subblock, self.channels)
+            self.energies.append(blocks.sum(axis=(1, 2)))
+        self.pending = squares[complete:]
+
+    def _add_true_peak(self, chunk):
+        self.peak = max(self.peak, float(np.max(np.abs(chunk), initial=0.0)))
+        if not self.phases:
+            return
+        extended = np.concatenate([self.peak_history, chunk])
+        self.peak_history = extended[len(extended) - len(self.peak_history):]
+        blocks = -(-len(extended) // PEAK_BLOCK)
+        for channel in range(self.channels):
+            x = extended[:, channel]
+            block_max = np.zeros(blocks + 1)
+            padded = np.zeros(blocks * PEAK_BLOCK)
+            padded[:len(x)] = np.abs(x)
+            block_max[:blocks] = padded.reshape(blocks, PEAK_BLOCK).max(axis=1)
+            # The windows starting in a block end at most in the next one
+            candidates = np.flatnonzero(np.maximum(block_max[:-1], block_max[1:]) * self.peak_gain > self.peak)
+            if len(candidates) == 0:
+                continue
+            # Consecutive candidate blocks are interpolated with a single convolution
+            breaks = np.flatnonzero(np.diff(candidates) > 1)
+            for first, last in zip(np.r_[candidates[0], candidates[breaks + 1]], np.r_[candidates[breaks], candidates[-1]]):
+                segment = x[first * PEAK_BLOCK:(last + 1) * PEAK_BLOCK + self.taps - 1]
+                if len(segment) < self.taps:
+                    continue
+                for phase in self.phases:
+                    interpolated = np.convolve(segment, phase, mode='valid')
+                    self.peak = max(self.peak, float(np.max(np.abs(interpolated))))
+
+    def result(self):
+        """Returns {'integrated', 'true_peak', 'lra', 'threshold'} in LUFS, dBTP and LU like FFmpeg loudnorm."""
+        energies = np.concatenate(self.energies) if self.energies else np.zeros(0)
+        block_energy = self._window(energies, 4)
+        integrated, threshold = self._gated_loudness(block_energy)
+        short_term = self._window(energies, 30)
+        lra = self._loudness_range(short_term)
+        true_peak = 20 * math.log10(self.peak) if self.peak > 0 else float('-inf')
+        return {'integrated': integrated, 'true_peak': true_peak, 'lra': lra, 'threshold': threshold}
+
+    def _window(self, energies, subblocks):
+        """Mean square of the windows of subblocks x 100 ms, with a 100 ms step."""
+        if len(energies) < subblocks:
+            return np.zeros(0)
+        cumulative = np.concatenate([[0.0], np.cumsum(energies)])
+        return (cumulative[subblocks:] - cumulative[:-subblocks]) / (subblocks * self.subblock)
+
+    @staticmethod
+    def _loudness(mean_square):
+        with np.errstate(divide='ignore'):
+            return -0.691 + 10 * np.log10(mean_square)
+
+    def _gated_loudness(self, block_energy):
+        loudness = self._loudness(block_energy)
+        gated = block_energy[loudness > ABSOLUTE_GATE]
+        if len(gated) == 0:
+            return float('-inf'), ABSOLUTE_GATE
+        threshold = float(self._loudness(gated.mean())) + RELATIVE_GATE
+        gated = block_energy[loudness > threshold]
+        if len(gated) == 0:
+            return float('-inf'), threshold
+        return float(self._loudness(gated.mean())), threshold
+
+    def _loudness_range(self, short_term):
+        loudness = self._loudness(short_term)
+        loudness = loudness[loudness > ABSOLUTE_GATE]
+        if len(loudness) == 0:
+            return 0.0
+        threshold = float(self._loudness(np.power(10, (loudness + 0.691) / 10).mean())) + LRA_RELATIVE_GATE
+        loudness = loudness[loudness > threshold]
+        if len(loudness) == 0:
+            return 0.0
+        low, high = np.percentile(loudness, [10, 95])
+        return float(high - low)
+
+def measure_loudness(samples, sample_rate, channels=1):
+    """Measures a whole buffer, see LoudnessMeter.result()."""
+    meter = LoudnessMeter(sample_rate, channels)
+    meter.add(samples)
+    return meter.result()
+
+def normalization_gain(stats, target_i=-23.0, target_tp=-1.5):
+    """Gain in dB that brings the audio to target_i LUFS without the true peak going above target_tp dBTP."""
+    if not math.isfinite(stats['integrated']):
+        return 0.0
+    gain = target_i - stats['integrated']
+    if math.isfinite(stats['true_peak']):
+        gain = min(gain, target_tp - stats['true_peak'])
+    return gain
@@ -0,0 +1,2241 @@
+# pySubTTS - processing pipeline (Phase I, II and III) without GUI
+# By MoonDragon (https://github.com/MoonDragon-MD/pySubTTS)
+# Used by pySubTTS.py (GUI) and pySubTTS_cli.py (command line)
+
+import os
+import re
+import platform
+from pydub import AudioSegment
+from pydub.effects import compress_dynamic_range
+import asyncio
+import subprocess
+import json
+import shutil
+import hashlib
+import struct
+import wave
+import math
+import time
+import functools
+import tempfile
+import threading
+import zlib
+import numpy as np
+import tracing
+from dictionary import Dictionary
+from subtitles import Subtitles, format_changes
+from loudness import LoudnessMeter, measure_loudness, normalization_gain
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Configuration FFmpeg portable, logging e loudnorm
+ffmpegportable = "no"  # Change in "no/yes" to use FFmpeg global or FFmpeg portable
+logging = "off"  # Use "On" for debug
+use_loudnorm = True  # Use loudnorm for the final file (avoid the constant increase in volume)
+loudness_engine = "numpy"  # "numpy" measures the loudness in memory and applies one gain, "ffmpeg" uses the two passes of loudnorm
+use_dynaudnorm_for_batches = False if use_loudnorm else True  # Skip Dynaudnorm for Batch if Loudnorm is active
+edge_tts_max_in_flight = 8  # Number of edge-tts requests sent at the same time
+use_tts_cache = True  # Reuse the TTS audio already generated for the same text and voice
+tts_cache_max_mb = 1024  # Maximum size of the TTS cache, the least recently used files are deleted first
+mixer_engine = "numpy"  # "numpy" mixes the segments in memory, "ffmpeg" uses the adelay/amix batches
+stretch_engine = "ffmpeg"  # "ffmpeg" changes the speed of each segment with atempo/rubberband, "wsola" stretches it in memory (much faster)
+use_speech_model = True  # Predict the length of each cue from its text and synthesize it at the rate that fits, most cues skip the stretch
+speech_model_min_samples = 20  # Cues measured for a voice before its rate is predicted, a new voice is calibrated on the first cues of the job
+speech_rate_step = 0.05  # Step of the predicted rates (5%), so the TTS cache still finds the cues generated before
+timing_scheduler = True  # Each cue can use the silence up to the next cue before its speed is changed, False stretches it to its duration + 0.5s as before
+schedule_min_gap = 0.1  # Seconds left after a segment that runs past the start of the next cue, which is then moved later
+stretch_tolerance = 0.05  # With the timing scheduler or the speech model a segment is not stretched when it is within 5% of its target duration
+segment_workers = 0  # Processes used to adjust the speed of the segments, 0 = one for each CPU core
+segment_store = True  # Keep the segments of a job in one memory-mapped file (audio_segments/segments.pcm), False writes an adjusted_*.wav for each as before
+pyttsx3_workers = 0  # Processes used by the offline TTS (pyttsx3), each with its own engine, 0 = one for each CPU core
+pyttsx3_chunk_size = 32  # Cues queued before each runAndWait of pyttsx3, 1 = one event loop for each cue
+use_dictionary_cache = True  # Save the compiled dictionary, it is rebuilt only when the file changes
+auto_repair_srt = True  # Sort the cues and fix the overlaps of an invalid SRT instead of rejecting it (see EXTRA/fix_srt_timestamps.py)
+trace = "off"  # Use "on" to save a Chrome/Perfetto trace and a summary table of each phase in traces/
+mixmerge_kbps_per_channel = 96  # AAC bitrate of the audio written by mix_and_merge for each channel
+batch_convert_jobs = 1  # Episodes of a batch in Phase I at the same time, more than 1 only helps edge-tts (pyttsx3 always uses 1)
+batch_mix_jobs = 1  # Episodes of a batch mixed and merged at the same time, while the next ones are in Phase I
+phase2_chunk_seconds = 20  # Seconds of audio mixed at a time by Phase II, the memory used does not depend on the length of the video
+phase2_spill = True  # Phase II decodes the original once into a raw file in pytemp (about 11 MB per minute at 48 kHz, twice with the numpy loudnorm), False decodes it again in each pass
+MAX_INPUTS = 100  # Maximum number of inputs for each FFmpeg batch
+WSOLA_FRAME = 768  # Samples of each WSOLA frame at 24000 Hz (32 ms), half of it is the output hop
+WSOLA_TOLERANCE = 192  # Samples the WSOLA frames can move to stay in phase (8 ms, half the period of an 62 Hz voice)
+SPEECH_RATE_MIN = 0.5  # Slowest rate set on the TTS engines, relative to the normal rate of the voice
+SPEECH_RATE_MAX = 2.0  # Fastest rate set on the TTS engines, relative to the normal rate of the voice
+
+# Directory of script
+script_dir = os.path.dirname(os.path.abspath(__file__))
+pytemp_dir = os.path.join(script_dir, 'pytemp')
+os.makedirs(pytemp_dir, exist_ok=True)
+tts_cache_dir = os.path.join(script_dir, 'tts_cache')
+dictionary_cache_dir = os.path.join(script_dir, 'dictionary_cache')
+speech_model_file = os.path.join(script_dir, 'speech_model.json')
+traces_dir = os.path.join(script_dir, 'traces')
+
+def log(*args, **kwargs):
+    """Print Log messages only if logging is enabled."""
+    if logging.lower() == "on":
+        print(*args, **kwargs)
+
+def cleanup_pytemp(temp_dir=None):
+    """Clean the pytemp folder, or the temp_dir of a job."""
+    temp_dir = temp_dir or pytemp_dir
+    if os.path.exists(temp_dir):
+        for temp_file in os.listdir(temp_dir):
+            try:
+                os.remove(os.path.join(temp_dir, temp_file))
+            except Exception as e:
+                log(f"Warning: Could not delete {temp_file}: {e}")
+
+def job_temp_dir(work_dir=None):
+    """Folder of the temporary files of a job, pytemp inside work_dir or the shared pytemp without a work_dir."""
+    if work_dir is None:
+        return pytemp_dir
+    temp_dir = os.path.join(work_dir, 'pytemp')
+    os.makedirs(temp_dir, exist_ok=True)
+    return temp_dir
+
+def get_ffmpeg_path():
+    """Returns the path of FFmpeg based on the operating system and the flag ffmpegportabile."""
+    log(f"Script directory: {script_dir}")
+    
+    if ffmpegportable.lower() == "yes":
+        if platform.system() == "Windows":
+            ffmpeg_path = os.path.join(script_dir, "ffmpeg", "windows", "ffmpeg.exe")
+        else:  # Linux/Ubuntu
+            ffmpeg_path = os.path.join(script_dir, "ffmpeg", "ubuntu", "ffmpeg")
+        
+        ffmpeg_path = os.path.normpath(ffmpeg_path)
+        log(f"FFmpeg path: {ffmpeg_path}")
+        
+        if not os.path.isfile(ffmpeg_path):
+            error_msg = (
+                f"FFmpeg portable not found in {ffmpeg_path}. "
+                "Make sure the file exists in the correct or set directory ffmpegportabile = 'no'."
+            )
+            log(error_msg)
+            raise FileNotFoundError(error_msg)
+        
+        if platform.system() != "Windows":
+            try:
+                os.chmod(ffmpeg_path, 0o755)
+                log(f"Set executable permissions for {ffmpeg_path}")
+            except Exception as e:
+                log(f"Warning: Could not set permissions for {ffmpeg_path}: {e}")
+        
+        return ffmpeg_path
+    else:
+        log("Using global FFmpeg")
+        return "ffmpeg"
+
+def run_subprocess(ffmpeg_cmd, capture_output=True, text=True, check=True, input=None, cancel_event=None):
+    """Performs a subprocess command compatible with Python 3.6, input is sent to its stdin.
+
+    When cancel_event is set the command is stopped and PipelineCancelled is raised.
+    """
+    log(f"Executing FFmpeg command: {' '.join(ffmpeg_cmd)}")
+    with tracing.span('ffmpeg', 'subprocess', command=' '.join(ffmpeg_cmd)[:300]) as span:
+        try:
+            if capture_output:
+                process = subprocess.Popen(
+                    ffmpeg_cmd,
+                    stdin=subprocess.PIPE if input is not None else None,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    universal_newlines=text,
+                    encoding='utf-8' if text else None
+                )
+                stdout, stderr = communicate_cancellable(process, input, cancel_event)
+                returncode = process.returncode
+            else:
+                process = subprocess.Popen(
+                    ffmpeg_cmd,
+                    universal_newlines=text,
+                    encoding='utf-8' if text else None
+                )
+                stdout, stderr = communicate_cancellable(process, None, cancel_event)
+                returncode = process.returncode
+            span.set(returncode=returncode, input_bytes=len(input) if input is not None else 0,
+                     output_bytes=len(stdout) if stdout is not None else 0)
+
+            if check and returncode != 0:
+                raise subprocess.CalledProcessError(returncode, ffmpeg_cmd, output=stdout, stderr=stderr)
+        
+            return subprocess.CompletedProcess(ffmpeg_cmd, returncode, stdout, stderr)
+        except PipelineCancelled:
+            raise
+        except Exception as e:
+            log(f"Subprocess error: {str(e)}")
+            raise subprocess.CalledProcessError(1, ffmpeg_cmd, stderr=str(e))
+
+def communicate_cancellable(process, input=None, cancel_event=None):
+    """process.communicate() that kills the process and raises PipelineCancelled as soon as cancel_event is set."""
+    while True:
+        try:
+            return process.communicate(input, timeout=None if cancel_event is None else 0.2)
+        except subprocess.TimeoutExpired:
+            if cancel_event.is_set():
+                process.kill()
+                process.communicate()
+                raise PipelineCancelled()
+
+def mp3_to_wav(input_file, output_file):
+    """Converts an MP3 file to a mono 24000 Hz WAV."""
+    audio = AudioSegment.from_mp3(input_file)
+    audio = audio.set_frame_rate(24000).set_channels(1)
+    audio.export(output_file, format="wav")
+
+async def generate_edge_tts(text, output_file, voice="it-IT-ElsaNeural", communicate_factory=None, rate=None,
+                            temp_dir=None):
+    """Generates audio with edge-tts (online) and converts to WAV, rate is the edge-tts rate (e.g. "+10%")."""
+    temp_mp3 = os.path.join(temp_dir or pytemp_dir, f'temp_{os.urandom(8).hex()}.mp3')
+    try:
+        if communicate_factory is None:
+            import edge_tts
+            communicate_factory = edge_tts.Communicate
+        if rate is None or rate == '+0%':
+            communicate = communicate_factory(text, voice)
+        else:
+            communicate = communicate_factory(text, voice, rate=rate)
+        await communicate.save(temp_mp3)
+        # The decoding runs in a thread so that the other requests keep going
+        await asyncio.get_event_loop().run_in_executor(None, mp3_to_wav, temp_mp3, output_file)
+    except Exception as e:
+        raise Exception(f"Error in the generation with edge-tts: {str(e)}")
+    finally:
+        # Removed on failure too, a failed request or decoding leaves its MP3 behind
+        try:
+            os.remove(temp_mp3)
+        except OSError:
+            pass
+
+async def generate_edge_tts_window(jobs, voice, max_in_flight, communicate_factory=None, on_done=None, cancel_event=None,
+                                   temp_dir=None):
+    """Generates all the (text, output_file, rate) jobs keeping at most max_in_flight requests open."""
+    semaphore = asyncio.Semaphore(max_in_flight)
+    free_slots = list(range(max_in_flight))  # Each request in flight is drawn on the row of its slot in the trace
+
+    async def generate_one(text, output_file, rate):
+        async with semaphore:
+            # Once cancelled the queued jobs are skipped, only the requests in flight are completed
+            if cancel_event is not None and cancel_event.is_set():
+                return PipelineCancelled()
+            slot = free_slots.pop()
+            try:
+                with tracing.span('tts', 'cue', lane=f'edge-tts {slot}', file=os.path.basename(output_file),
+                                  engine='edge-tts', chars=len(text)) as span:
+                    await generate_edge_tts(text, output_file, voice=voice, communicate_factory=communicate_factory,
+                                            rate=rate, temp_dir=temp_dir)
+                    if tracing.enabled():
+                        span.set(bytes=file_size(output_file))
+                return None
+            except Exception as e:
+                return e
+            finally:
+                free_slots.append(slot)
+                if on_done is not None:
+                    on_done()
+
+    return await asyncio.gather(*(generate_one(text, output_file, rate) for text, output_file, rate in jobs))
+
+def generate_edge_tts_batch(jobs, voice="it-IT-ElsaNeural", max_in_flight=None, communicate_factory=None,
+                            on_done=None, cancel_event=None, temp_dir=None):
+    """Generates a list of (text, output_file, rate) jobs with edge-tts in a single event loop.
+
+    Returns a list in the same order as jobs with None for each success or the exception raised.
+    rate is the edge-tts rate of the cue, None or "+0%" for the normal rate of the voice.
+    communicate_factory(text, voice) replaces edge_tts.Communicate, e.g. to point it to a local server,
+    it also gets the rate keyword when the rate of a cue is changed.
+    on_done() is called after each generated job, the jobs not started after cancel_event is set
+    return PipelineCancelled. The MP3 downloaded by edge-tts are kept in temp_dir (default pytemp).
+    """
+    if not jobs:
+        return []
+    max_in_flight = max(1, max_in_flight or edge_tts_max_in_flight)
+    log(f"Generating {len(jobs)} edge-tts segments with {max_in_flight} requests in flight")
+    return asyncio.run(generate_edge_tts_window(jobs, voice, max_in_flight, communicate_factory, on_done, cancel_event,
+                                                temp_dir))
+
+class TTSCache:
+    """Content-addressed cache of TTS WAV files with LRU eviction, shared by all the jobs."""
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(engine, voice, rate, text):
+        """Returns the cache key for a text generated with the given engine, voice and rate."""
+        data = json.dumps([engine, voice, str(rate), text], ensure_ascii=False)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.wav')
+
+    def get(self, key, output_file):
+        """Copies the cached audio to output_file, returns False if it is not in the cache."""
+        cached = self.path(key)
+        try:
+            shutil.copyfile(cached, output_file)
+            os.utime(cached)
+            return True
+        except (FileNotFoundError, PermissionError):
+            # Missing or just deleted by another job
+            return False
+
+    def put(self, key, audio_file):
+        """Stores audio_file in the cache, the rename makes it visible to other jobs only when complete."""
+        temp_file = os.path.join(self.cache_dir, f'{key}.{os.urandom(8).hex()}.tmp')
+        try:
+            shutil.copyfile(audio_file, temp_file)
+            os.replace(temp_file, self.path(key))
+        except OSError as e:
+            log(f"Warning: Could not store {audio_file} in the TTS cache: {e}")
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+    def trim(self):
+        """Deletes the least recently used files until the cache fits in max_bytes."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.wav'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+            total -= size
+        log(f"TTS cache size: {total / (1024 * 1024):.1f} MB")
+
+def engine_rate_for(engine, base_rate, factor):
+    """Returns the rate to set on a TTS engine to speak factor times faster than base_rate.
+
+    pyttsx3 has a rate in words per minute, edge-tts a percentage of the normal rate of the voice.
+    """
+    if engine == 'edge-tts':
+        return f"{int(round((factor - 1) * 100)):+d}%"
+    return int(round(base_rate * factor))
+
+class SpeechRateModel:
+    """Predicts how long each voice takes to speak a text, calibrated from the cues already synthesized.
+
+    The duration at the normal rate is seconds = a + b * characters (letters and digits), fitted by least
+    squares for each engine, voice and normal rate. Only the sums of the fit are kept, in speech_model.json,
+    so every measured cue updates the model of the voice and it keeps learning across the jobs. A job adds its
+    cues to the file as it is when the job saves it, so the jobs of a batch running at the same time all keep theirs.
+    """
+
+    VERSION = 1
+    save_lock = threading.Lock()  # The jobs of a batch save the model from their own threads
+    MAX_SAMPLES = 2000  # Beyond this the old cues weigh less and less, the model follows a voice that changes
+
+    def __init__(self, path):
+        self.path = path
+        self.voices = self.load(path)
+        # Cues measured by this job, added to the sums saved in the meantime by the other jobs
+        self.added = []
+
+    @classmethod
+    def load(cls, path):
+        """Sums of each voice saved in path, empty when there is no valid model."""
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+            if data.get('version') == cls.VERSION:
+                return data['voices']
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+        return {}
+
+    @staticmethod
+    def voice_key(engine, voice, base_rate):
+        return json.dumps([engine, voice, str(base_rate)], ensure_ascii=False)
+
+    @staticmethod
+    def characters(text):
+        return sum(1 for char in text if char.isalnum())
+
+    def samples(self, engine, voice, base_rate):
+        """Number of cues measured for a voice."""
+        sums = self.voices.get(self.voice_key(engine, voice, base_rate))
+        return int(round(sums[0])) if sums else 0
+
+    def state(self, engine, voice, base_rate):
+        """Cues measured for a voice and a digest of its sums, they tell which model the rates of a job came from."""
+        sums = self.voices.get(self.voice_key(engine, voice, base_rate))
+        digest = hashlib.sha256(json.dumps(sums).encode('utf-8')).hexdigest()[:16]
+        return {'samples': self.samples(engine, voice, base_rate), 'digest': digest}
+
+    def add(self, engine, voice, base_rate, text, seconds, factor=1.0):
+        """Records a cue that lasted seconds when spoken factor times faster than the normal rate."""
+        key = self.voice_key(engine, voice, base_rate)
+        x = self.characters(text)
+        y = seconds * factor
+        self.added.append((key, x, y))
+        self.accumulate(self.voices, key, x, y)
+
+    @classmethod
+    def accumulate(cls, voices, key, x, y):
+        """Adds a cue of x characters that lasted y seconds at the normal rate to the sums of a voice."""
+        n, sx, sy, sxx, sxy = voices.get(key, [0, 0, 0, 0, 0])
+        if n >= cls.MAX_SAMPLES:
+            scale = (cls.MAX_SAMPLES - 1) / n
+            n, sx, sy, sxx, sxy = n * scale, sx * scale, sy * scale, sxx * scale, sxy * scale
+        voices[key] = [n + 1, sx + x, sy + y, sxx + x * x, sxy + x * y]
+
+    def predict(self, engine, voice, base_rate, text):
+        """Returns the seconds needed to speak text at the normal rate, None if the voice is not calibrated yet."""
+        if self.samples(engine, voice, base_rate) < speech_model_min_samples:
+            return None
+        n, sx, sy, sxx, sxy = self.voices[self.voice_key(engine, voice, base_rate)]
+        x = self.characters(text)
+        spread = n * sxx - sx * sx
+        if spread > 1e-9 * n * n:
+            slope = (n * sxy - sx * sy) / spread
+            seconds = (sy - slope * sx) / n + slope * x
+        else:
+            # All the cues measured so far have the same length
+            seconds = sy * x / sx if sx else sy / n
+        return max(seconds, 0.1)
+
+    def rate_factor(self, engine, voice, base_rate, text, target, slowdown_threshold, speedup_threshold):
+        """Returns how much faster than the normal rate text must be spoken to last target seconds.
+
+        The factor is rounded to speech_rate_step and stays within the speed thresholds (None disables one).
+        Returns 1.0 when the voice is not calibrated yet.
+        """
+        predicted = self.predict(engine, voice, base_rate, text)
+        if predicted is None:
+            return 1.0
+        factor = round(predicted / max(target, 0.5) / speech_rate_step) * speech_rate_step
+        # The thresholds limit the final length of a segment relative to its natural length, that is 1 / factor
+        if slowdown_threshold is not None and slowdown_threshold < 1:
+            factor = min(factor, 1 / (1 - slowdown_threshold))
+        if speedup_threshold is not None:
+            factor = max(factor, 1 / (1 + speedup_threshold))
+        return round(min(max(factor, SPEECH_RATE_MIN), SPEECH_RATE_MAX), 4)
+
+    def save(self):
+        """Adds the cues measured by this job to the model file, keeping those saved meanwhile by the other jobs."""
+        with self.save_lock:
+            voices = self.load(self.path)
+            for key, x, y in self.added:
+                self.accumulate(voices, key, x, y)
+            temp_file = f'{self.path}.{os.urandom(8).hex()}.tmp'
+            try:
+                with open(temp_file, 'w', encoding='utf-8') as file:
+                    json.dump({'version': self.VERSION, 'voices': voices}, file)
+                os.replace(temp_file, self.path)
+            except OSError as e:
+                log(f"Warning: Could not save the speech rate model: {e}")
+                return
+            self.voices = voices
+            self.added = []
+
+class JobManifest:
+    """Rendered segment of each cue of the last conversion, saved in manifest.json of the segments folder.
+
+    The key of a cue covers everything that changes its segment (engine, voice, text, duration, speed
+    thresholds, stretch engine), so after an edit of the SRT only the changed cues are synthesized and stretched again.
+    The files of a cue are named after its key, so a cue that moves to another index keeps its segment.
+    It is also the segment index of the job: the frames, rate and channels of each segment are recorded
+    when it is produced, so its duration is known without decoding it. The segments kept in the SegmentStore
+    of the job have their offset in it instead of a file, and a checksum: a segment of the store that no longer
+    matches it is rendered again like a cue missing from the manifest.
+    """
+
+    VERSION = 1  # Change it when process_segment produces a different audio
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, 'manifest.json')
+        self.entries = {}
+        self.report = None  # Timing of the last conversion, see schedule_report()
+        self.repair = None  # Changes made to an invalid SRT by the last conversion, see Subtitles.repair()
+        self.speech_model = None  # State of the speech rate model used by the last conversion, see SpeechRateModel.state()
+        self.store = SegmentStore(os.path.join(output_dir, 'segments.pcm'))
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+            if data.get('version') == self.VERSION:
+                self.entries = data['cues']
+                self.report = data.get('schedule')
+                self.repair = data.get('repair')
+                self.speech_model = data.get('speech_model')
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+
+    @classmethod
+    def make_key(cls, engine, voice, rate, text, duration, auto_adjust, slowdown_threshold, speedup_threshold, stretch,
+                 schedule=False):
+        """Returns the key of a cue, the start time is not part of it because it only moves the segment in the mix."""
+        fields = [cls.VERSION, engine, voice, str(rate), text, round(duration, 3), auto_adjust,
+                  slowdown_threshold, speedup_threshold]
+        if stretch != "ffmpeg":
+            # The keys of the FFmpeg stretch stay the same as before, so the old manifests are still valid
+            fields.append(stretch)
+        if schedule:
+            # duration is the window of the timing scheduler, the segment is not made longer to fill it
+            fields.append('schedule')
+        data = json.dumps(fields, ensure_ascii=False)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()[:20]
+
+    def tts_file(self, key):
+        return os.path.join(self.output_dir, f'output_{key}.wav')
+
+    def adjusted_file(self, key):
+        return os.path.join(self.output_dir, f'adjusted_{key}.wav')
+
+    def get(self, key):
+        """Returns (audio_file, too_short, info, speed) of a segment rendered by a previous run, None if it must be rendered.
+
+        audio_file is a StoredSegment for the segments kept in the store.
+        info is (frames, rate, channels), None for the segments recorded before the index existed.
+        speed is the change of length given by process_segment, None when it was not recorded.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        info = (entry['frames'], entry['rate'], entry['channels']) if 'frames' in entry else None
+        if 'offset' in entry:
+            if entry['offset'] + info[0] * info[2] > self.store.size():
+                return None
+            audio_file = StoredSegment(self.store, entry['offset'], *info)
+            if 'crc' in entry:
+                try:
+                    if zlib.crc32(audio_file.samples()) != entry['crc']:
+                        log("Segment store: the segment of a cue does not match its checksum, it is rendered again")
+                        return None
+                except (OSError, ValueError):
+                    return None
+        else:
+            audio_file = os.path.join(self.output_dir, entry['file'])
+            if not os.path.exists(audio_file):
+                return None
+        return audio_file, entry['too_short'], info, entry.get('speed')
+
+    def put(self, key, audio_file, too_short, info=None, speed=None):
+        if isinstance(audio_file, StoredSegment):
+            self.entries[key] = {'offset': audio_file.offset, 'crc': zlib.crc32(audio_file.samples()), 'too_short': too_short}
+        else:
+            self.entries[key] = {'file': os.path.basename(audio_file), 'too_short': too_short}
+        if info is not None:
+            self.entries[key].update(zip(('frames', 'rate', 'channels'), info))
+        if speed is not None:
+            self.entries[key]['speed'] = speed
+
+    def compact(self, keys):
+        """Drops the cues not in keys and rewrites the store when less than half of it is still used.
+
+        Runs before the segments of a conversion are read, the offsets of the segments kept change.
+        """
+        size = self.store.size()
+        # The segments cut off by a truncated store are dropped, their cues are rendered again
+        self.entries = {
+            key: entry for key, entry in self.entries.items()
+            if key in keys and ('offset' not in entry or entry['offset'] + entry['frames'] * entry['channels'] <= size)
+        }
+        stored = [entry for entry in self.entries.values() if 'offset' in entry]
+        live = sum(entry['frames'] * entry['channels'] for entry in stored)
+        if size == 0 or live * 2 > size:
+            return
+        with tracing.span('compact_store', samples=size, live=live):
+            stored.sort(key=lambda entry: entry['offset'])
+            offsets = self.store.compact([(entry['offset'], entry['frames'] * entry['channels']) for entry in stored])
+            for entry, offset in zip(stored, offsets):
+                entry['offset'] = offset
+        log(f"Segment store compacted from {size * 2} to {live * 2} bytes")
+        self.write()
+
+    def save(self, keys):
+        """Keeps only the cues in keys, deletes the segment files no longer used and writes the manifest."""
+        self.entries = {key: entry for key, entry in self.entries.items() if key in keys}
+        used = {entry['file'] for entry in self.entries.values() if 'file' in entry}
+        for name in os.listdir(self.output_dir):
+            if name.endswith('.wav') and name.startswith(('output_', 'adjusted_')) and name not in used:
+                try:
+                    os.remove(os.path.join(self.output_dir, name))
+                except OSError:
+                    pass
+        self.write()
+
+    def write(self):
+        temp_file = f'{self.path}.{os.urandom(8).hex()}.tmp'
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as file:
+                data = {'version': self.VERSION, 'cues': self.entries}
+                if self.report is not None:
+                    data['schedule'] = self.report
+                if self.repair is not None:
+                    data['repair'] = self.repair
+                if self.speech_model is not None:
+                    data['speech_model'] = self.speech_model
+                json.dump(data, file)
+            os.replace(temp_file, self.path)
+        except OSError as e:
+            log(f"Warning: Could not save the job manifest: {e}")
+
+class SegmentStore:
+    """The segments of a job appended to one file of 16 bit samples and read back through a memory map.
+
+    A job with thousands of cues writes a single file instead of a WAV for each segment, and the mixer
+    reads each segment as a slice of the map without copying it. The JobManifest keeps where each one is.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.writer = None
+        self.map = None
+        # A store cut in the middle of a sample ends with half of it, dropped so that the new segments stay aligned
+        try:
+            size = os.path.getsize(path)
+            if size % 2:
+                os.truncate(path, size - 1)
+        except OSError:
+            pass
+
+    def size(self):
+        """Number of samples in the store."""
+        if self.writer is not None:
+            return self.writer.tell() // 2
+        try:
+            return os.path.getsize(self.path) // 2
+        except OSError:
+            return 0
+
+    def add(self, samples, frame_rate, channels):
+        """Appends interleaved 16 bit samples, returns their StoredSegment."""
+        if self.writer is None:
+            self.writer = open(self.path, 'ab')
+        offset = self.writer.tell() // 2
+        self.writer.write(np.ascontiguousarray(samples, dtype='<i2').tobytes())
+        return StoredSegment(self, offset, len(samples) // channels, frame_rate, channels)
+
+    def read(self, offset, count):
+        """Returns count samples from offset, a view of the memory map."""
+        if self.map is None or len(self.map) < offset + count:
+            if self.writer is not None:
+                self.writer.flush()
+            # The map is opened again only when segments were added after it
+            self.map = np.memmap(self.path, dtype='<i2', mode='r') if self.size() else np.zeros(0, dtype='<i2')
+            if len(self.map) < offset + count:
+                raise ValueError(f"segment past the end of {os.path.basename(self.path)}")
+        return self.map[offset:offset + count]
+
+    def compact(self, segments):
+        """Rewrites the store with only the (offset, count) segments, returns their new offsets."""
+        temp_file = f'{self.path}.{os.urandom(8).hex()}.tmp'
+        offsets = []
+        position = 0
+        with open(temp_file, 'wb') as file:
+            for offset, count in segments:
+                file.write(self.read(offset, count).tobytes())
+                offsets.append(position)
+                position += count
+        self.close()
+        os.replace(temp_file, self.path)
+        return offsets
+
+    def close(self):
+        """Closes the file and the map, the views already returned keep their map open."""
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        self.map = None
+
+class StoredSegment:
+    """A segment of a SegmentStore, used in place of its file by the mixers."""
+
+    def __init__(self, store, offset, frames, rate, channels):
+        self.store = store
+        self.offset = offset
+        self.frames = frames
+        self.rate = rate
+        self.channels = channels
+
+    def samples(self):
+        """The interleaved 16 bit samples, read from the memory map without copying them."""
+        return self.store.read(self.offset, self.frames * self.channels)
+
+def wav_info(audio_file):
+    """Returns (frames, rate, channels) of a WAV file, read from its header without decoding the audio."""
+    with open(audio_file, 'rb') as file:
+        header = file.read(12)
+        if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+            raise ValueError(f"'{os.path.basename(audio_file)}' is not a WAV file")
+        rate = channels = block_align = None
+        while True:
+            chunk = file.read(8)
+            if len(chunk) < 8:
+                raise ValueError(f"'{os.path.basename(audio_file)}' has no audio data")
+            name, size = chunk[:4], struct.unpack('<I', chunk[4:])[0]
+            if name == b'fmt ':
+                fmt = file.read(size + size % 2)
+                channels, rate, _, block_align = struct.unpack('<HIIH', fmt[2:14])
+            elif name == b'data' and block_align:
+                # A WAV written to a pipe leaves the size at its maximum, the rest of the file is the audio
+                remaining = os.fstat(file.fileno()).st_size - file.tell()
+                return min(size, remaining) // block_align, rate, channels
+            else:
+                file.seek(size + size % 2, 1)
+
+def indexed_duration(audio_file, index=None):
+    """Duration in seconds of a segment, from the segment index or else from its WAV header."""
+    info = index.get(audio_file) if index else None
+    if info is None:
+        try:
+            info = wav_info(audio_file)
+        except (OSError, ValueError, struct.error):
+            # Not a WAV file, only then it is decoded
+            return AudioSegment.from_file(audio_file).duration_seconds
+    frames, rate, _ = info
+    return frames / rate
+
+def file_size(path):
+    """Size of a file in bytes, None if it does not exist (used by the trace spans)."""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+def timeline_offset(start_time, sample_rate=24000):
+    """Sample of the timeline where a segment starting at start_time seconds is placed."""
+    # Same rounding as the adelay filter of the FFmpeg mixer, which computes the delay in single precision
+    delay_ms = int(start_time * 1000)
+    return int(np.float32(delay_ms) * np.float32(sample_rate) / np.float32(1000))
+
+def silence_end(start_time, duration, sample_rate=24000):
+    """Sample where a gap of duration seconds ends in the timeline, no silence audio is rendered for it.
+
+    The gaps add nothing to the mix, they only make the timeline longer. The length is the one of the
+    silence WAV written before: pydub created it at 11025 Hz and audioop.ratecv() turned its N frames
+    into (N - 1) * 24000 // 11025 + 1 samples.
+    """
+    frames = int(11025 * (duration * 1000 / 1000.0))
+    samples = (frames - 1) * sample_rate // 11025 + 1 if frames > 0 else 0
+    return timeline_offset(start_time, sample_rate) + samples
+
+def cue_windows(start, end, spoken, min_gap=0.1, tail=0.5):
+    """Returns the seconds each cue can be spoken for, up to min_gap before the start of the next spoken cue.
+
+    start and end are the millisecond arrays of the cues and spoken marks the cues with text, so the gaps
+    and the empty cues after a cue are free for it. The last spoken cue can run tail seconds past its end.
+    A window is never shorter than its cue. All the windows are computed at once, in linear time.
+    """
+    start = np.asarray(start, dtype=np.int64)
+    end = np.asarray(end, dtype=np.int64)
+    spoken_index = np.flatnonzero(spoken)
+    if not len(spoken_index):
+        return (end - start) / 1000
+    # Position in spoken_index of the next spoken cue after each cue
+    following = np.searchsorted(spoken_index, np.arange(len(start)), side='right')
+    next_start = start[spoken_index[np.minimum(following, len(spoken_index) - 1)]] - int(round(min_gap * 1000))
+    limit = np.where(following == len(spoken_index), end + int(round(tail * 1000)), next_start)
+    return (np.maximum(limit, end) - start) / 1000
+
+def schedule_report(speeds, delays):
+    """Sums up the timing of a conversion, speeds are the changes of length of the segments (1.0 when not
+    stretched) and delays the seconds each segment was moved after its cue."""
+    changes = np.abs(np.asarray(speeds, dtype=np.float64) - 1)
+    stretched = changes[changes > 1e-9]
+    delays = np.asarray(delays, dtype=np.float64)
+    delayed = delays[delays > 1e-9]
+    return {
+        'segments': len(changes),
+        'stretched': len(stretched),
+        'shortened': int(np.count_nonzero(np.asarray(speeds) < 1 - 1e-9)),
+        'lengthened': int(np.count_nonzero(np.asarray(speeds) > 1 + 1e-9)),
+        'mean_change': round(float(stretched.mean()), 4) if len(stretched) else 0.0,
+        'max_change': round(float(stretched.max()), 4) if len(stretched) else 0.0,
+        'delayed': len(delayed),
+        'max_delay': round(float(delayed.max()), 3) if len(delayed) else 0.0,
+    }
+
+def normalize_audio(audio_segment, target_dbfs=-20.0):
+    """Normalizza l'audio a un livello costante in dBFS."""
+    change_in_dbfs = target_dbfs - audio_segment.dBFS
+    return audio_segment.apply_gain(change_in_dbfs)
+
+def compress_audio(audio_segment):
+    """Applies dynamic compression to reduce volume variations."""
+    return compress_dynamic_range(
+        audio_segment,
+        threshold=-24.0,
+        ratio=4.0,
+        attack=5.0,
+        release=50.0
+    )
+
+def loudnorm_audio(input_file, output_file, cancel_event=None):
+    """Apply loudnorm with FFmpeg for advanced normalization, cancel_event stops it like run_subprocess()."""
+    with tracing.span('loudnorm', engine='ffmpeg'):
+        log(f"Applying loudnorm: {input_file} -> {output_file}")
+        # First step: analysis
+        ffmpeg_cmd = [
+            get_ffmpeg_path(), '-i', input_file,
+            '-af', 'loudnorm=I=-23:TP=-1.5:LRA=11:print_format=json',
+            '-f', 'null', '-'
+        ]
+        try:
+            result = run_subprocess(ffmpeg_cmd, capture_output=True, text=True, check=True, cancel_event=cancel_event)
+            stats_output = result.stderr
+            json_start = stats_output.find('{')
+            json_end = stats_output.rfind('}') + 1
+            if json_start == -1 or json_end == -1:
+                raise ValueError("Impossibile trovare output JSON da loudnorm")
+            stats = json.loads(stats_output[json_start:json_end])
+            measured_I = float(stats['input_i'])
+            measured_TP = float(stats['input_tp'])
+            measured_LRA = float(stats['input_lra'])
+            measured_thresh = float(stats['input_thresh'])
+            # Second step: normalization
+            ffmpeg_cmd = [
+                get_ffmpeg_path(), '-i', input_file,
+                '-af', f'loudnorm=I=-23:TP=-1.5:LRA=11:measured_I={measured_I}:measured_TP={measured_TP}:measured_LRA={measured_LRA}:measured_thresh={measured_thresh}:linear=true',
+                '-ar', '24000', '-ac', '1', output_file, '-y'
+            ]
+            run_subprocess(ffmpeg_cmd, capture_output=True, text=True, check=True, cancel_event=cancel_event)
+            log(f"Applied loudnorm to {output_file}")
+        except PipelineCancelled:
+            raise
+        except Exception as e:
+            log(f"Error applying loudnorm: {e}. Falling back to pydub normalization.")
+            audio_segment = AudioSegment.from_file(input_file)
+            compressed_segment = compress_audio(audio_segment)
+            normalized_segment = normalize_audio(compressed_segment, target_dbfs=-20.0)
+            normalized_segment.export(output_file, format="wav")
+
+def loudnorm_samples(samples, sample_rate=24000, channels=1):
+    """In memory version of loudnorm_audio: measures the samples once and applies a single gain."""
+    with tracing.span('loudnorm', engine='numpy', samples=len(samples)):
+        stats = measure_loudness(samples, sample_rate, channels)
+        return samples * 10 ** (loudnorm_gain(stats) / 20)
+
+def loudnorm_gain(stats):
+    """Gain in dB that brings the measured audio to the loudnorm targets (-23 LUFS, -1.5 dBTP)."""
+    gain = normalization_gain(stats, target_i=-23.0, target_tp=-1.5)
+    log(f"Loudness: {stats['integrated']:.2f} LUFS, true peak {stats['true_peak']:.2f} dBTP, "
+        f"LRA {stats['lra']:.2f} LU, gain {gain:.2f} dB")
+    return gain
+
+def read_wav_samples(input_file, sample_rate=24000):
+    """Reads an audio file as mono float32 samples in [-1, 1] at sample_rate."""
+    try:
+        with wave.open(input_file, 'rb') as wav:
+            channels = wav.getnchannels()
+            sample_width = wav.getsampwidth()
+            rate = wav.getframerate()
+            data = wav.readframes(wav.getnframes())
+        if sample_width == 1:
+            samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128) / 128
+        elif sample_width == 2:
+            samples = np.frombuffer(data, dtype='<i2').astype(np.float32) / 32768
+        elif sample_width == 4:
+            samples = np.frombuffer(data, dtype='<i4').astype(np.float32) / 2147483648
+        else:
+            raise wave.Error(f"unsupported sample width {sample_width}")
+    except (wave.Error, EOFError):
+        # Formats not supported by the wave module (e.g. float WAV) are decoded by pydub
+        audio = AudioSegment.from_file(input_file).set_sample_width(2)
+        channels = audio.channels
+        rate = audio.frame_rate
+        samples = np.frombuffer(audio.raw_data, dtype='<i2').astype(np.float32) / 32768
+    return mono_samples(samples, rate, channels, sample_rate)
+
+def mono_samples(samples, rate, channels, sample_rate=24000):
+    """Downmixes interleaved float samples to mono and resamples them to sample_rate."""
+    if channels > 1:
+        samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels).mean(axis=1)
+    return resample_audio(samples, rate, sample_rate)
+
+def segment_samples(segment, sample_rate=24000):
+    """Reads a segment of the mix, a file or a StoredSegment, as mono float32 samples at sample_rate."""
+    if isinstance(segment, StoredSegment):
+        samples = segment.samples().astype(np.float32) / 32768
+        return mono_samples(samples, segment.rate, segment.channels, sample_rate)
+    return read_wav_samples(segment, sample_rate)
+
+def fft_length(length, multiple):
+    """Smallest multiple of multiple >= length with only 2, 3, 5 and 7 as factors, the sizes the FFT is fast with.
+
+    Returns length when multiple has a larger factor.
+    """
+    def smooth(value):
+        for factor in (2, 3, 5, 7):
+            while value % factor == 0:
+                value //= factor
+        return value == 1
+
+    if not smooth(multiple):
+        return length
+    count = -(-length // multiple)
+    while not smooth(count):
+        count += 1
+    return count * multiple
+
+def resample_audio(samples, from_rate, to_rate):
+    """Resamples mono samples with a band-limited FFT resampler."""
+    if from_rate == to_rate or len(samples) == 0:
+        return samples
+    new_length = int(round(len(samples) * to_rate / from_rate))
+    # The samples are padded with silence to a length the FFT is fast with (a prime length is 10-20 times slower)
+    padded_length = fft_length(len(samples), from_rate // math.gcd(from_rate, to_rate))
+    output_length = new_length
+    if padded_length != len(samples):
+        samples = np.concatenate([samples, np.zeros(padded_length - len(samples), dtype=samples.dtype)])
+        output_length = padded_length * to_rate // from_rate
+    spectrum = np.fft.rfft(samples)
+    bins = output_length // 2 + 1
+    if bins <= len(spectrum):
+        spectrum = spectrum[:bins]
+    else:
+        spectrum = np.concatenate([spectrum, np.zeros(bins - len(spectrum), dtype=spectrum.dtype)])
+    return (np.fft.irfft(spectrum, output_length) * (output_length / len(samples)))[:new_length].astype(np.float32)
+
+def read_pcm16(input_file):
+    """Reads an audio file as interleaved 16 bit samples, returns (samples, frame_rate, channels)."""
+    try:
+        with wave.open(input_file, 'rb') as wav:
+            if wav.getsampwidth() != 2:
+                raise wave.Error("not a 16 bit WAV")
+            channels = wav.getnchannels()
+            frame_rate = wav.getframerate()
+            data = wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError):
+        audio = AudioSegment.from_file(input_file).set_sample_width(2)
+        channels = audio.channels
+        frame_rate = audio.frame_rate
+        data = audio.raw_data
+    samples = np.frombuffer(data[:len(data) - len(data) % (2 * channels)], dtype='<i2')
+    return samples, frame_rate, channels
+
+def write_pcm16(samples, output_file, frame_rate=24000, channels=1):
+    """Writes interleaved 16 bit samples as a WAV file."""
+    with wave.open(output_file, 'wb') as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(frame_rate)
+        wav.writeframes(samples.astype('<i2').tobytes())
+
+def normalize_pcm16(samples, target_dbfs=-20.0):
+    """Same result as normalize_audio on 16 bit samples, without building an AudioSegment."""
+    if len(samples) == 0:
+        return samples
+    # pydub truncates the RMS to an integer and audioop.mul rounds towards minus infinity
+    rms = int(np.sqrt(np.dot(samples.astype(np.int64), samples.astype(np.int64)) / len(samples)))
+    if rms == 0:
+        return samples
+    dbfs = 20 * math.log(rms / 32768, 10)
+    factor = 10 ** ((target_dbfs - dbfs) / 20)
+    scaled = samples.astype(np.float64) * factor
+    scaled = np.where(scaled > 32767, 32767, np.where(scaled < -32767, -32768, np.floor(scaled)))
+    return scaled.astype('<i2')
+
+def wsola_stretch(samples, atempo, frame_length=WSOLA_FRAME, tolerance=WSOLA_TOLERANCE):
+    """Changes the tempo of mono float samples keeping the pitch (WSOLA), returns round(len / atempo) samples.
+
+    The output is built from Hann windowed frames with 50% overlap. Each frame is read near its place in
+    the input, moved by up to tolerance samples to the position that best continues the previous one.
+    """
+    if len(samples) == 0:
+        return np.zeros(0, dtype=np.float32)
+    hop = frame_length // 2
+    output_length = int(round(len(samples) / atempo))
+    frames = output_length // hop + 2
+    window = np.hanning(frame_length + 1)[:frame_length].astype(np.float32)
+    # Input position of each frame, the padding keeps every read and search inside the buffer
+    positions = np.round(np.arange(frames) * hop * atempo).astype(np.int64)
+    padded = np.concatenate([
+        np.zeros(hop + tolerance, dtype=np.float32), samples.astype(np.float32),
+        np.zeros(int(positions[-1]) + frame_length + 2 * tolerance + hop, dtype=np.float32)
+    ])
+    output = np.zeros((frames + 1) * hop + frame_length, dtype=np.float32)
+    weights = np.zeros_like(output)
+    delta = 0
+    for k in range(frames):
+        position = int(positions[k]) + tolerance + delta
+        start = k * hop
+        output[start:start + frame_length] += padded[position:position + frame_length] * window
+        weights[start:start + frame_length] += window
+        if k + 1 < frames:
+            natural = padded[position + hop:position + hop + frame_length]
+            region = padded[positions[k + 1]:positions[k + 1] + frame_length + 2 * tolerance]
+            delta = int(np.argmax(np.correlate(region, natural, 'valid'))) - tolerance
+    output /= np.maximum(weights, 1e-3)
+    return output[hop:hop + output_length]
+
+def stretch_pcm16(samples, frame_rate, channels, atempo, engine=None):
+    """Changes the tempo of 16 bit samples, returns 24000 Hz mono samples.
+
+    engine "ffmpeg" runs atempo/rubberband in a FFmpeg process, "wsola" stretches the samples in memory
+    with wsola_stretch(), None uses stretch_engine.
+    """
+    if (engine or stretch_engine).lower() == "wsola":
+        mono = samples.reshape(-1, channels).mean(axis=1) / 32768 if channels > 1 else samples / 32768
+        stretched = wsola_stretch(resample_audio(mono.astype(np.float32), frame_rate, 24000), atempo)
+        return np.clip(np.rint(stretched * 32768), -32768, 32767).astype('<i2')
+    ffmpeg_cmd = [
+        get_ffmpeg_path(), '-f', 's16le', '-ar', str(frame_rate), '-ac', str(channels), '-i', 'pipe:0',
+        '-filter:a', f'atempo={atempo},rubberband=pitch=1.0,volume=1.0',
+        '-ar', '24000', '-ac', '1', '-f', 's16le', 'pipe:1'
+    ]
+    result = run_subprocess(ffmpeg_cmd, capture_output=True, text=False, check=True, input=samples.astype('<i2').tobytes())
+    data = result.stdout
+    return np.frombuffer(data[:len(data) - len(data) % 2], dtype='<i2')
+
+def write_wav_samples(samples, output_file, sample_rate=24000):
+    """Writes mono float samples as a 16 bit PCM WAV file."""
+    pcm = np.clip(np.rint(samples * 32768), -32768, 32767).astype('<i2')
+    with wave.open(output_file, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm.tobytes())
+
+def compare_wav_files(file_a, file_b, sample_rate=24000):
+    """Returns the peak and RMS difference in dBFS between two audio files (useful to compare the mixers)."""
+    a = read_wav_samples(file_a, sample_rate)
+    b = read_wav_samples(file_b, sample_rate)
+    length = max(len(a), len(b))
+    diff = np.zeros(length, dtype=np.float64)
+    diff[:len(a)] += a
+    diff[:len(b)] -= b
+    if length == 0 or not diff.any():
+        return float('-inf'), float('-inf')
+    peak = 20 * np.log10(np.max(np.abs(diff)))
+    rms = 10 * np.log10(np.mean(diff ** 2))
+    return peak, rms
+
+def mix_timeline_numpy(audio_files, output_file=None, sample_rate=24000, volume=0.25, length=0):
+    """Places every (file, start, end) segment at its sample offset in a single buffer and writes it once.
+
+    A segment can also be a StoredSegment instead of a file.
+    length is the minimum number of samples of the timeline (the end of its last gap).
+    Returns the mixed samples, output_file None only returns them.
+    """
+    segments = []
+    for audio_file, start_time, _ in audio_files:
+        offset = timeline_offset(start_time, sample_rate)
+        samples = segment_samples(audio_file, sample_rate)
+        segments.append((offset, samples))
+        length = max(length, offset + len(samples))
+    timeline = np.zeros(length, dtype=np.float32)
+    for offset, samples in segments:
+        timeline[offset:offset + len(samples)] += samples
+    timeline *= volume
+    if output_file is not None:
+        write_wav_samples(timeline, output_file, sample_rate)
+    log(f"Timeline mixed in memory: {len(audio_files)} segments, {length / sample_rate:.2f}s")
+    return timeline
+
+def mix_timeline_ffmpeg(audio_files, output_file, work_dir, length=0, index=None):
+    """Mixes the (file, start, end) segments with batches of FFmpeg adelay/amix filters.
+
+    The output is padded with silence to at least length samples (the end of the last gap).
+    index maps the segment files to their (frames, rate, channels), see indexed_duration().
+    FFmpeg reads files, the StoredSegments are written to WAV files in work_dir while they are mixed.
+    """
+    if not audio_files:
+        write_wav_samples(np.zeros(length, dtype=np.float32), output_file)
+        return
+    exported = []
+    try:
+        segments = []
+        for n, (audio_file, start_time, end_time) in enumerate(audio_files):
+            if isinstance(audio_file, StoredSegment):
+                stored_file = os.path.join(work_dir, f'stored_{n}.wav')
+                exported.append(stored_file)
+                write_pcm16(audio_file.samples(), stored_file, audio_file.rate, audio_file.channels)
+                audio_file = stored_file
+            segments.append((audio_file, start_time, end_time))
+        mix_files_ffmpeg(segments, output_file, work_dir, length, index)
+    finally:
+        for stored_file in exported:
+            try:
+                os.remove(stored_file)
+            except OSError:
+                pass
+
+def mix_files_ffmpeg(audio_files, output_file, work_dir, length=0, index=None):
+    """Mixes the (file, start, end) segments of mix_timeline_ffmpeg, the files are the inputs of the FFmpeg batches."""
+    batch_files = []
+    batch_size = MAX_INPUTS
+    # The padding goes in the filter of the last mix, which is the one of the batch when there is only one
+    pad = f",apad=whole_len={length}" if length else ""
+    single_batch = len(audio_files) <= batch_size
+
+    for batch_idx in range(0, len(audio_files), batch_size):
+        batch = audio_files[batch_idx:batch_idx + batch_size]
+        batch_output = os.path.join(work_dir, f'batch_{batch_idx // batch_size}.wav')
+        filter_complex_parts = []
+        ffmpeg_cmd = [get_ffmpeg_path()]
+
+        for i, (audio_file, start_time, end_time) in enumerate(batch):
+            segment_duration = end_time - start_time
+            audio_file = audio_file.replace('\\', '/')
+            ffmpeg_cmd.extend(['-i', audio_file])
+            delay_ms = int(start_time * 1000)
+            filter_complex_parts.append(f"[{i}:a]adelay={delay_ms}|{delay_ms}[a{i}];")
+            log(f"Batch {batch_idx // batch_size}, Input {i}: {audio_file}, start_time: {start_time}s, end_time: {end_time}s, duration: {segment_duration}s")
+
+        weights = ' '.join(['1'] * len(batch))
+        filter_complex = "".join(filter_complex_parts)
+        filter_complex += "".join(f"[a{i}]" for i in range(len(batch))) + f"amix=inputs={len(batch)}:duration=longest:dropout_transition=0:weights={weights}:normalize=0,volume=0.25{pad if single_batch else ''}[outa]"
+        ffmpeg_cmd.extend(['-filter_complex', filter_complex, '-map', '[outa]', '-ac', '1', '-ar', '24000', batch_output, '-y'])
+
+        log(f"Batch {batch_idx // batch_size} filter complex: {filter_complex}")
+        log(f"Batch {batch_idx // batch_size} FFmpeg command: {' '.join(ffmpeg_cmd)}")
+
+        run_subprocess(ffmpeg_cmd, capture_output=True, text=True, check=True)
+        if use_dynaudnorm_for_batches:
+            # Verifica che il file batch esista
+            if not os.path.exists(batch_output):
+                raise FileNotFoundError(f"Batch file {batch_output} not found after creation.")
+            # Applica dynaudnorm al batch
+            temp_batch = os.path.join(work_dir, f'temp_batch_{batch_idx // batch_size}.wav')
+            ffmpeg_cmd = [
+                get_ffmpeg_path(), '-i', batch_output,
+                '-filter:a', 'dynaudnorm', '-ar', '24000', '-ac', '1',
+                temp_batch, '-y'
+            ]
+            run_subprocess(ffmpeg_cmd, capture_output=True, text=True, check=True)
+            shutil.move(temp_batch, batch_output)
+            log(f"Batch {batch_idx // batch_size} normalized with dynaudnorm: {batch_output}")
+        batch_files.append(batch_output)
+        log(f"Batch {batch_idx // batch_size} generated: {batch_output}")
+
+    if len(batch_files) == 1:
+        ffmpeg_cmd = [get_ffmpeg_path(), '-i', batch_files[0], '-c:a', 'copy', output_file, '-y']
+        run_subprocess(ffmpeg_cmd, capture_output=True, text=True, check=True)
+        return
+
+    filter_complex_parts = []
+    ffmpeg_cmd = [get_ffmpeg_path()]
+    for i, batch_file in enumerate(batch_files):
+        batch_file = batch_file.replace('\\', '/')
+        ffmpeg_cmd.extend(['-i', batch_file])
+        filter_complex_parts.append(f"[{i}:a]adelay=0|0[a{i}];")
+    weights = ' '.join(['1'] * len(batch_files))
+    filter_complex = "".join(filter_complex_parts)
+    filter_complex += "".join(f"[a{i}]" for i in range(len(batch_files))) + f"amix=inputs={len(batch_files)}:duration=longest:dropout_transition=0:weights={weights}:normalize=0,volume=0.25{pad}[outa]"
+
+    total_duration = max(max(end_time for _, _, end_time in audio_files), length / 24000)
+    max_segment_duration = max(indexed_duration(af, index) for af, _, _ in audio_files)
+    total_duration = max(total_duration, total_duration + max_segment_duration)
+    total_duration = int(total_duration) + 1
+
+    ffmpeg_cmd.extend(['-filter_complex', filter_complex, '-map', '[outa]', '-ac', '1', '-ar', '24000', '-t', str(total_duration), output_file, '-y'])
+
+    log(f"Final filter complex: {filter_complex}")
+    log(f"Number of batch files: {len(batch_files)}")
+    log(f"Total duration: {total_duration}s")
+    log(f"Final FFmpeg command: {' '.join(ffmpeg_cmd)}")
+
+    run_subprocess(ffmpeg_cmd, capture_output=True, text=True, check=True)
+
+def mix_timeline(audio_files, output_file, work_dir, length=0, index=None):
+    """Mixes the (file or StoredSegment, start, end) segments into output_file with the engine chosen in mixer_engine."""
+    with tracing.span('mix', engine=mixer_engine, segments=len(audio_files)):
+        if mixer_engine.lower() == "ffmpeg":
+            mix_timeline_ffmpeg(audio_files, output_file, work_dir, length, index)
+        else:
+            mix_timeline_numpy(audio_files, output_file, length=length)
+
+def mix_timeline_samples(audio_files, work_dir, length=0, index=None):
+    """Mixes the (file, start, end) segments and returns the 24000 Hz samples instead of a file."""
+    with tracing.span('mix', engine=mixer_engine, segments=len(audio_files)):
+        if mixer_engine.lower() == "ffmpeg":
+            mixed_file = os.path.join(work_dir, 'timeline.wav')
+            mix_timeline_ffmpeg(audio_files, mixed_file, work_dir, length, index)
+            return read_wav_samples(mixed_file)
+        return mix_timeline_numpy(audio_files, length=length)
+
+def validate_srt(subs):
+    error = subs.first_error()
+    if error is not None:
+        log(error)
+        return False
+    return True
+
+class PipelineError(Exception):
+    """Error that stops a phase, the message is meant for the user."""
+
+class PipelineCancelled(PipelineError):
+    """Raised when the user cancels a phase."""
+
+    def __init__(self, message="Operation cancelled."):
+        super().__init__(message)
+
+def check_cancelled(cancel_event):
+    """Raises PipelineCancelled if cancel_event (a threading.Event) is set."""
+    if cancel_event is not None and cancel_event.is_set():
+        raise PipelineCancelled()
+
+def load_dictionary(dictionary_file, whole_words=False, ignore_case=False):
+    """Loads and compiles a word=pronunciation dictionary file, empty if there is no file."""
+    with tracing.span('dictionary'):
+        if not dictionary_file or not os.path.exists(dictionary_file):
+            return Dictionary({})
+        try:
+            dictionary = Dictionary.load(dictionary_file, whole_words, ignore_case,
+                                         cache_dir=dictionary_cache_dir if use_dictionary_cache else None)
+        except Exception as e:
+            raise PipelineError(f"Error in reading the dictionary file: {str(e)}")
+        log(f"Dictionary loaded: {len(dictionary)} words")
+        return dictionary
+
+def get_pyttsx3_engine():
+    """Returns a new pyttsx3 engine for the calling thread, imported only when the offline TTS is used.
+
+    pyttsx3.init() would return the engine already created by any other thread, SAPI and NSSpeechSynthesizer
+    objects must only be used by the thread that created them.
+    """
+    import pyttsx3
+    return pyttsx3.Engine()
+
+def pool_workers(configured, jobs):
+    """Number of worker processes for jobs tasks, configured 0 means one for each CPU core."""
+    workers = configured or os.cpu_count() or 1
+    if platform.system() == "Windows":
+        workers = min(workers, 61)  # Limit of ProcessPoolExecutor on Windows
+    return max(1, min(workers, jobs))
+
+_pyttsx3_worker = None  # (voice, rate, engine) of a pyttsx3 worker process, created by its first job
+
+def worker_pyttsx3_engine(voice_id, rate, engine_factory=None):
+    """Returns the engine of this worker process, created once and reused."""
+    global _pyttsx3_worker
+    if _pyttsx3_worker is None:
+        _pyttsx3_worker = (None, None, (engine_factory or get_pyttsx3_engine)())
+    worker_voice, worker_rate, engine = _pyttsx3_worker
+    if (worker_voice, worker_rate) != (voice_id, rate):
+        engine.setProperty('voice', voice_id)
+        engine.setProperty('rate', rate)
+        _pyttsx3_worker = (voice_id, rate, engine)
+    return engine
+
+def queue_pyttsx3(engine, text, output_file, cue_rate, rate):
+    """Queues one cue on the engine at cue_rate, returns the rate the engine is left at.
+
+    setProperty is queued by pyttsx3 like save_to_file, so the cues of one runAndWait keep their own rate.
+    """
+    if cue_rate != rate:
+        engine.setProperty('rate', cue_rate)
+    engine.save_to_file(text, output_file)
+    return cue_rate
+
+def synthesize_pyttsx3(i, text, output_file, voice_id, rate, engine=None, engine_factory=None, cue_rate=None):
+    """Generates one cue with pyttsx3, in a worker process the engine is created once and reused.
+
+    rate is the normal rate of the engine, cue_rate the rate of this cue (None for the normal rate).
+    """
+    if engine is None:
+        engine = worker_pyttsx3_engine(voice_id, rate, engine_factory)
+    cue_rate = rate if cue_rate is None else cue_rate
+    with tracing.span('tts', 'cue', cue=i, engine='pyttsx3', chars=len(text)) as span:
+        if queue_pyttsx3(engine, text, output_file, cue_rate, rate) != rate:
+            engine.setProperty('rate', rate)
+        engine.runAndWait()
+        if tracing.enabled():
+            span.set(bytes=file_size(output_file))
+
+def synthesize_pyttsx3_chunk(jobs, voice_id, rate, engine=None, engine_factory=None):
+    """Generates the (i, text, output_file, cue_rate) jobs with a single runAndWait, returns their errors like generate_pyttsx3_batch.
+
+    The event loop of the engine is started once for the whole chunk. If it fails, or a cue has no audio,
+    those cues are generated again one at a time so that an error is reported only for the cue that caused it.
+    """
+    if engine is None:
+        engine = worker_pyttsx3_engine(voice_id, rate, engine_factory)
+    if len(jobs) == 1:
+        retry = list(range(len(jobs)))
+    else:
+        for _, _, output_file, _ in jobs:
+            # A file left by an interrupted run would hide a cue that was not generated
+            if os.path.exists(output_file):
+                os.remove(output_file)
+        with tracing.span('tts_chunk', engine='pyttsx3', cues=len(jobs), first=jobs[0][0]) as span:
+            try:
+                current_rate = rate
+                for _, text, output_file, cue_rate in jobs:
+                    current_rate = queue_pyttsx3(engine, text, output_file, cue_rate, current_rate)
+                if current_rate != rate:
+                    engine.setProperty('rate', rate)
+                engine.runAndWait()
+                retry = [index for index, (_, _, output_file, _) in enumerate(jobs) if not file_size(output_file)]
+            except Exception as e:
+                log(f"pyttsx3 chunk starting at segment {jobs[0][0]} failed, retrying its cues one at a time: {str(e)}")
+                span.set(error=type(e).__name__)
+                retry = list(range(len(jobs)))
+            span.set(retried=len(retry))
+    errors = [None] * len(jobs)
+    for index in retry:
+        i, text, output_file, cue_rate = jobs[index]
+        try:
+            synthesize_pyttsx3(i, text, output_file, voice_id, rate, engine=engine, cue_rate=cue_rate)
+        except Exception as e:
+            errors[index] = e
+    return errors
+
+def pyttsx3_chunks(jobs, workers):
+    """Splits the jobs in chunks of at most pyttsx3_chunk_size cues, at least one chunk for each worker."""
+    size = max(1, min(pyttsx3_chunk_size, -(-len(jobs) // workers)))
+    return [jobs[start:start + size] for start in range(0, len(jobs), size)]
+
+def generate_pyttsx3_batch(jobs, voice_id, rate, engine=None, engine_factory=None, on_done=None, cancel_event=None):
+    """Generates the (i, text, output_file, cue_rate) jobs with pyttsx3 on a pool of processes, each with its own engine.
+
+    Returns a list in the same order as jobs with None for each success or the exception raised.
+    rate is the normal rate of the engines, cue_rate the rate of each cue.
+    The jobs are sent in chunks of pyttsx3_chunk_size cues, each generated with a single runAndWait.
+    With one worker the jobs run here with engine. engine_factory() creates the engine of each worker
+    (default get_pyttsx3_engine), it must be a module level function or class so that it can be pickled.
+    on_done() is called after each job, the jobs not started after cancel_event is set return PipelineCancelled.
+    """
+    errors = []
+    workers = pool_workers(pyttsx3_workers, len(jobs))
+    chunks = pyttsx3_chunks(jobs, workers)
+    if workers == 1:
+        for chunk in chunks:
+            if cancel_event is not None and cancel_event.is_set():
+                errors.extend(PipelineCancelled() for _ in chunk)
+                continue
+            errors.extend(synthesize_pyttsx3_chunk(chunk, voice_id, rate, engine=engine, engine_factory=engine_factory))
+            if on_done is not None:
+                for _ in chunk:
+                    on_done()
+        return errors
+
+    log(f"Generating {len(jobs)} pyttsx3 segments in {len(chunks)} chunks with {workers} processes")
+    traced = tracing.enabled()
+    task = (tracing.call_traced, synthesize_pyttsx3_chunk) if traced else (synthesize_pyttsx3_chunk,)
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = {executor.submit(*task, chunk, voice_id, rate, None, engine_factory): chunk for chunk in chunks}
+        for future in as_completed(futures):
+            if on_done is not None:
+                for _ in futures[future]:
+                    on_done()
+            if cancel_event is not None and cancel_event.is_set():
+                # The chunks being synthesized are completed, the queued ones are dropped
+                for pending in futures:
+                    pending.cancel()
+                break
+        # The results are collected in the order of the jobs, waiting for the chunks still running
+        for future, chunk in futures.items():
+            if future.cancelled():
+                errors.extend(PipelineCancelled() for _ in chunk)
+                continue
+            try:
+                result = future.result()
+                if traced:
+                    tracing.add_events(result[1], result[2])
+                    result = result[0]
+                errors.extend(result)
+            except Exception as e:
+                # The worker process itself failed (e.g. the engine could not be created)
+                errors.extend(e for _ in chunk)
+    finally:
+        executor.shutdown(wait=True)
+    return errors
+
+def process_segment(i, output_audio, duration, adjusted_file, auto_adjust, slowdown_threshold, speedup_threshold,
+                    stretch=None, factor=1.0, tolerance=0, schedule=False, to_store=False):
+    """Adjusts the speed of one TTS segment and normalizes it, runs in a worker process.
+
+    The TTS file is decoded once, the samples go through FFmpeg with pipes and only the result is written
+    to adjusted_file (or back to output_audio when the speed is not changed). stretch is the engine of
+    stretch_pcm16(), it is passed explicitly because the worker processes do not see a changed configuration.
+    factor is the rate the cue was synthesized at (relative to the normal rate), the thresholds limit the
+    length of the result relative to its length at the normal rate. A segment within tolerance (e.g. 0.05)
+    of its target is not stretched. With schedule duration is the window given by cue_windows(), the segment
+    is only shortened when it does not fit in it.
+    Returns (audio_file, too_short, info, speed), too_short is True when the segment was left untouched,
+    info is the (frames, rate, channels) of audio_file for the segment index, None if it could not be read,
+    and speed is the length of the result divided by the length of the TTS audio (1.0 when not stretched).
+    With to_store nothing is written and audio_file is replaced by the samples, the caller adds them to the
+    SegmentStore of the job. When the TTS file could not be read it is returned as audio_file in both cases.
+    """
+    with tracing.span('segment', 'cue', cue=i) as span:
+        try:
+            samples, frame_rate, channels = read_pcm16(output_audio)
+        except Exception as e:
+            log(f"Error reading segment {i}: {e}. Using original audio.")
+            return output_audio, False, None, 1.0
+
+        audio_file = output_audio
+        applied_speed = 1.0
+        if auto_adjust:
+            try:
+                audio_duration = len(samples) / channels / frame_rate
+                log(f"Segment {i} audio duration: {audio_duration}s")
+
+                min_duration = 0.1
+                if audio_duration < min_duration or duration <= 0:
+                    log(f"Skipping speed adjustment for segment {i} due to invalid duration")
+                    return (samples if to_store else output_audio), True, (len(samples) // channels, frame_rate, channels), 1.0
+
+                max_duration = duration if schedule else duration + 0.5
+                speed = max_duration / audio_duration if audio_duration > 0 else 1
+                if schedule:
+                    # The window is a limit, not a length to fill
+                    speed = min(speed, 1.0)
+                log(f"Segment {i} initial speed: {speed}")
+
+                if speedup_threshold is not None and speed / factor > (1 + speedup_threshold):
+                    speed = (1 + speedup_threshold) * factor
+                    log(f"Applied speedup threshold for segment {i}: speed adjusted to {speed}")
+                if slowdown_threshold is not None and speed / factor < (1 - slowdown_threshold):
+                    speed = (1 - slowdown_threshold) * factor
+                    log(f"Applied slowdown threshold for segment {i}: speed adjusted to {speed}")
+
+                target_duration = audio_duration * speed
+                log(f"Segment {i} target duration: {target_duration}s")
+                if target_duration < 0.5:
+                    speed = audio_duration / 0.5
+                    target_duration = 0.5
+                    log(f"Adjusted speed for segment {i} to ensure minimum duration of 0.5s")
+
+                span.set(speed=round(speed, 3))
+                if tolerance and abs(speed - 1) <= tolerance:
+                    # Synthesized at the right rate, the segment already fits
+                    log(f"Segment {i} fits its duration, speed adjustment skipped")
+                else:
+                    with tracing.span('tempo', cue=i):
+                        samples = stretch_pcm16(samples, frame_rate, channels, 1 / speed, stretch)
+                    frame_rate, channels = 24000, 1
+                    audio_file = adjusted_file
+                    applied_speed = speed
+                    log(f"Segment {i} adjusted duration: {len(samples) / frame_rate}s")
+            except Exception as e:
+                log(f"Error adjusting speed for segment {i}: {e}. Using original audio.")
+
+        # Normalizes the audio segment
+        try:
+            with tracing.span('normalize', cue=i):
+                samples = normalize_pcm16(samples, target_dbfs=-20.0)
+            log(f"Segment {i} normalized to -20 dBFS")
+        except Exception as e:
+            log(f"Error normalizing segment {i}: {e}. Using unnormalized audio.")
+        if to_store:
+            audio_file = samples
+        else:
+            write_pcm16(samples, audio_file, frame_rate, channels)
+        span.set(bytes=len(samples) * 2)
+        return audio_file, False, (len(samples) // channels, frame_rate, channels), applied_speed
+
+def process_segments(jobs, auto_adjust, slowdown_threshold, speedup_threshold, progress=None, cancel_event=None,
+                     stretch=None, tolerance=0, schedule=False, store=None):
+    """Runs process_segment on the (i, output_audio, duration, adjusted_file, factor) jobs with a pool of processes.
+
+    Returns {i: (audio_file, too_short, info, speed)}. Every job writes only its own files, so the result does not
+    depend on the number of processes or on the order in which they finish. With a SegmentStore the workers send
+    back the samples instead of writing them (see process_segment), each segment is added to the store as soon
+    as it arrives and audio_file is its StoredSegment, or the TTS file when it could not be read.
+    """
+    if progress is None:
+        progress = lambda stage, done, total: None
+    workers = pool_workers(segment_workers, len(jobs))
+    to_store = store is not None
+    results = {}
+
+    def add_result(i, result):
+        samples, too_short, info, speed = result
+        if to_store and isinstance(samples, np.ndarray):
+            result = store.add(samples, info[1], info[2]), too_short, info, speed
+        results[i] = result
+        progress("segments", len(results), len(jobs))
+
+    progress("segments", 0, len(jobs))
+    if workers == 1:
+        for i, output_audio, duration, adjusted_file, factor in jobs:
+            check_cancelled(cancel_event)
+            add_result(i, process_segment(i, output_audio, duration, adjusted_file, auto_adjust, slowdown_threshold,
+                                          speedup_threshold, stretch, factor, tolerance, schedule, to_store))
+        return results
+
+    log(f"Processing {len(jobs)} segments with {workers} processes")
+    # With tracing on the workers send their spans back together with the result
+    traced = tracing.enabled()
+    task = (tracing.call_traced, process_segment) if traced else (process_segment,)
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = {
+            executor.submit(*task, i, output_audio, duration, adjusted_file, auto_adjust, slowdown_threshold,
+                            speedup_threshold, stretch, factor, tolerance, schedule, to_store): i
+            for i, output_audio, duration, adjusted_file, factor in jobs
+        }
+        for future in as_completed(futures):
+            result = future.result()
+            if traced:
+                result, events, threads = result
+                tracing.add_events(events, threads)
+            add_result(futures[future], result)
+            if cancel_event is not None and cancel_event.is_set():
+                # The segments being processed are completed, the queued ones are dropped
+                for pending in futures:
+                    pending.cancel()
+                raise PipelineCancelled()
+    finally:
+        executor.shutdown(wait=True)
+    return results
+
+def save_trace(tracer, name):
+    """Saves the trace of a phase in traces_dir as Chrome/Perfetto JSON and as a summary table."""
+    base = os.path.join(traces_dir, f"{name}_{time.strftime('%Y%m%d_%H%M%S')}")
+    try:
+        os.makedirs(traces_dir, exist_ok=True)
+        tracer.save(base + '.json')
+        with open(base + '.txt', 'w', encoding='utf-8') as file:
+            file.write(tracer.summary_table() + '\n')
+        log(f"Trace saved: {base}.json")
+    except OSError as e:
+        log(f"Warning: Could not save the trace {base}.json: {e}")
+
+def traced_phase(name):
+    """Decorator that records a phase in a span. With trace "on" a phase called on its own saves its trace."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            # A caller that already records (e.g. the command line with --trace) keeps the spans in its own trace
+            tracer = tracing.start() if trace.lower() == "on" and not tracing.enabled() else None
+            try:
+                with tracing.span(name, 'phase'):
+                    return function(*args, **kwargs)
+            finally:
+                if tracer is not None:
+                    tracing.stop()
+                    save_trace(tracer, name)
+        return wrapper
+    return decorator
+
+@traced_phase('phase1')
+def convert_srt(srt_file, voice_id, use_edge_tts=False, dictionary_file=None, auto_adjust=True,
+                slowdown_threshold=0.3, speedup_threshold=0.5, output_wav=None, output_mp3=None, engine=None,
+                progress=None, cancel_event=None, dictionary_whole_words=False, dictionary_ignore_case=False,
+                engine_factory=None, stretch=None, schedule=None, use_speech_model=None, work_dir=None,
+                notify=None):
+    """Phase I: generates the dubbed audio of an SRT file and returns the path of the final WAV.
+
+    A threshold set to None is disabled. engine is an existing pyttsx3 engine to reuse, it is used for
+    the synthesis only with one pyttsx3 worker and must belong to the calling thread (None creates one with
+    get_pyttsx3_engine()). engine_factory creates the engines of the pyttsx3 workers.
+    dictionary_whole_words and dictionary_ignore_case are the matching options of the dictionary.
+    stretch is the engine that changes the speed of the segments ("ffmpeg" or "wsola"), None uses stretch_engine.
+    schedule lets each cue use the silence after it before its speed is changed, None uses timing_scheduler.
+    use_speech_model synthesizes each cue at the rate predicted from its text, None uses the use_speech_model setting.
+    progress(stage, done, total) is called after each cue of the "tts" and "segments" stages and for the "mix" stage.
+    When cancel_event is set the work stops after the current cue and PipelineCancelled is raised.
+    work_dir is the folder of the job: its segments, temporary files and default outputs go there instead of
+    the script folder, so jobs with different work_dir can run at the same time.
+    notify(message) receives the notices for the user, e.g. how an invalid SRT was repaired.
+    """
+    output_final = output_wav or os.path.join(work_dir or script_dir, 'final_output.wav')
+    output_mp3 = output_mp3 or os.path.join(work_dir or script_dir, 'final_output.mp3')
+    shift_delay = 0.5
+    if notify is None:
+        notify = lambda message: None
+
+    if not srt_file or not os.path.exists(srt_file):
+        raise PipelineError(f"SRT file not found: {srt_file}")
+
+    try:
+        with tracing.span('read_srt', file=os.path.basename(srt_file)) as span:
+            subs = Subtitles.load(srt_file)
+            span.set(cues=len(subs), encoding=subs.encoding)
+    except Exception as e:
+        raise PipelineError(f"Error in reading the SRT file: {str(e)}")
+
+    repair = None
+    if auto_repair_srt and not validate_srt(subs):
+        with tracing.span('repair_srt', cues=len(subs)) as span:
+            subs, changes = subs.repair()
+            span.set(**changes)
+        log(f"SRT repaired: {format_changes(changes)}")
+        notify(f"The SRT file was repaired: {format_changes(changes)}.")
+        repair = changes
+    if not validate_srt(subs):
+        raise PipelineError("The SRT file contains errors in the TimesTamp.")
+    # Times of the cues in seconds, converted once from the millisecond arrays
+    starts = (subs.start / 1000).tolist()
+    ends = (subs.end / 1000).tolist()
+    durations = ((subs.end - subs.start) / 1000).tolist()
+    stretch = (stretch or stretch_engine).lower()
+    # With the timing scheduler a cue can also use the silence after it, its speed is changed only when it does not fit
+    schedule = auto_adjust and (timing_scheduler if schedule is None else schedule)
+    # The keyword has the name of the module setting it overrides
+    use_speech_model = auto_adjust and (globals()['use_speech_model'] if use_speech_model is None else use_speech_model)
+    if schedule:
+        spoken = [duration > 0 and bool(text.strip()) for duration, text in zip(durations, subs.texts)]
+        windows = cue_windows(subs.start, subs.end, spoken, schedule_min_gap).tolist()
+    else:
+        windows = durations
+
+    log(f"Using TTS engine: {'edge-tts' if use_edge_tts else 'pyttsx3'} with voice: {voice_id}")
+
+    if not use_edge_tts:
+        engine = engine or get_pyttsx3_engine()
+        engine.setProperty('voice', voice_id)
+
+    dictionary = load_dictionary(dictionary_file, dictionary_whole_words, dictionary_ignore_case)
+    if progress is None:
+        progress = lambda stage, done, total: None
+
+    output_dir = os.path.join(work_dir or script_dir, 'audio_segments')
+    temp_dir = job_temp_dir(work_dir)
+    manifest = None
+    try:
+        audio_files = []
+        os.makedirs(output_dir, exist_ok=True)
+
+        engine_name = 'edge-tts' if use_edge_tts else 'pyttsx3'
+        engine_rate = '+0%' if use_edge_tts else engine.getProperty('rate')
+
+        # The cues rendered by the previous run with the same text, timing, voice and thresholds are reused
+        manifest = JobManifest(output_dir)
+        cue_keys = {}
+        cue_texts = {}
+        for i, content in enumerate(subs.texts):
+            if durations[i] <= 0 or not content.strip():
+                continue
+            text = cue_texts[i] = dictionary.apply(content)
+            cue_keys[i] = JobManifest.make_key(engine_name, voice_id, engine_rate, text, windows[i],
+                                               auto_adjust, slowdown_threshold, speedup_threshold, stretch, schedule)
+        # The store drops the segments of the previous run no longer used before any segment is read from it
+        manifest.compact(set(cue_keys.values()))
+        rendered = {}
+        # Generate all the TTS segments first, so edge-tts can send the requests in parallel
+        tts_jobs = []
+        for i, key in cue_keys.items():
+            if key in rendered:
+                continue
+            # Cues identical to an earlier one are rendered once
+            rendered[key] = manifest.get(key)
+            if rendered[key] is None:
+                tts_jobs.append((i, cue_texts[i], manifest.tts_file(key)))
+        log(f"Job manifest: {len(rendered) - len(tts_jobs)} segments reused, {len(tts_jobs)} to render")
+        render_jobs = tts_jobs
+
+        # Each cue is synthesized at the rate predicted from its text, so most of them already fit their time
+        speech_model = SpeechRateModel(speech_model_file) if use_speech_model else None
+        # The predicted rates depend on what the model has learned, the log and the manifest record its state
+        speech_state = None
+        if speech_model is not None:
+            speech_state = speech_model.state(engine_name, voice_id, engine_rate)
+            log(f"Speech rate model: {speech_state['samples']} cues measured for this voice, state {speech_state['digest']}")
+        cue_factors = {}
+        waves = [tts_jobs]
+        if speech_model is not None and speech_model.samples(engine_name, voice_id, engine_rate) < speech_model_min_samples:
+            # A new voice is calibrated on its first cues, generated at the normal rate
+            waves = [tts_jobs[:speech_model_min_samples], tts_jobs[speech_model_min_samples:]]
+
+        tts_cache = None
+        if use_tts_cache:
+            tts_cache = TTSCache(tts_cache_dir, tts_cache_max_mb * 1024 * 1024)
+        tts_errors = {}
+        tts_done = [0]
+        tts_total = [0]
+
+        def tts_progress():
+            tts_done[0] += 1
+            progress("tts", tts_done[0], tts_total[0])
+
+        for wave in waves:
+            if not wave or (cancel_event is not None and cancel_event.is_set()):
+                continue
+            wave_jobs = []
+            for i, text, output_audio in wave:
+                factor = 1.0
+                if speech_model is not None:
+                    target = windows[i] if schedule else durations[i] + 0.5
+                    factor = speech_model.rate_factor(engine_name, voice_id, engine_rate, text, target,
+                                                      slowdown_threshold, speedup_threshold)
+                    if schedule:
+                        # The scheduler does not slow down the cues that fit, neither does the engine
+                        factor = max(factor, 1.0)
+                cue_factors[i] = factor
+                rate = engine_rate if factor == 1 else engine_rate_for(engine_name, engine_rate, factor)
+                wave_jobs.append((i, text, output_audio, rate))
+            if speech_model is not None:
+                log(f"Speech rate model: {sum(cue_factors[job[0]] != 1 for job in wave_jobs)} of {len(wave_jobs)} cues "
+                    f"synthesized at a predicted rate")
+
+            if tts_cache is not None:
+                missing_jobs = []
+                with tracing.span('tts_cache') as span:
+                    for i, text, output_audio, rate in wave_jobs:
+                        if not tts_cache.get(TTSCache.make_key(engine_name, voice_id, rate, text), output_audio):
+                            missing_jobs.append((i, text, output_audio, rate))
+                    span.set(hits=len(wave_jobs) - len(missing_jobs), misses=len(missing_jobs))
+                log(f"TTS cache: {len(wave_jobs) - len(missing_jobs)} hits, {len(missing_jobs)} segments to generate")
+                wave_jobs = missing_jobs
+
+            tts_total[0] += len(wave_jobs)
+            progress("tts", tts_done[0], tts_total[0])
+            if use_edge_tts:
+                errors = generate_edge_tts_batch([(text, output_audio, rate) for _, text, output_audio, rate in wave_jobs],
+                                                 voice=voice_id, on_done=tts_progress, cancel_event=cancel_event,
+                                                 temp_dir=temp_dir)
+            else:
+                errors = generate_pyttsx3_batch(wave_jobs, voice_id, engine_rate, engine=engine, engine_factory=engine_factory,
+                                                on_done=tts_progress, cancel_event=cancel_event)
+            for (i, _, _, _), error in zip(wave_jobs, errors):
+                if error is not None:
+                    tts_errors[i] = error
+
+            for i, text, output_audio, rate in wave_jobs:
+                if i in tts_errors or not os.path.exists(output_audio):
+                    continue
+                if tts_cache is not None:
+                    tts_cache.put(TTSCache.make_key(engine_name, voice_id, rate, text), output_audio)
+                if speech_model is not None:
+                    try:
+                        frames, sample_rate, _ = wav_info(output_audio)
+                    except (OSError, ValueError, struct.error) as e:
+                        # A TTS file that is not a readable WAV gives no sample, the conversion goes on without it
+                        log(f"Skipping speech model sample for subtitle {i}: {e}")
+                        continue
+                    if frames:
+                        speech_model.add(engine_name, voice_id, engine_rate, text, frames / sample_rate, cue_factors[i])
+
+        if tts_cache is not None:
+            tts_cache.trim()
+        if speech_model is not None:
+            speech_model.save()
+        # The segments already generated stay in the cache for the next run
+        check_cancelled(cancel_event)
+
+        last_end_time = 0
+        # The gaps and the empty cues are only offsets, they set the minimum length of the timeline
+        timeline_length = 0
+        # Frames, rate and channels of the segments in the mix, read by the mixers instead of decoding them again
+        segment_index = {}
+
+        if len(subs) and starts[0] > 0:
+            silence_duration = starts[0]
+            timeline_length = max(timeline_length, silence_end(0, silence_duration))
+            log(f"Initial silence: {silence_duration}s")
+
+        # The speed adjustment and the normalization of each cue are independent, they run in parallel
+        segment_jobs = [
+            (i, output_audio, windows[i], manifest.adjusted_file(cue_keys[i]), cue_factors.get(i, 1.0))
+            for i, _, output_audio in render_jobs if i not in tts_errors
+        ]
+        with tracing.span('segments', segments=len(segment_jobs)):
+            segment_results = process_segments(segment_jobs, auto_adjust, slowdown_threshold, speedup_threshold,
+                                               progress=progress, cancel_event=cancel_event, stretch=stretch,
+                                               tolerance=stretch_tolerance if schedule or speech_model is not None else 0,
+                                               schedule=schedule, store=manifest.store if segment_store else None)
+        for i, (audio_file, too_short, info, speed) in segment_results.items():
+            rendered[cue_keys[i]] = (audio_file, too_short, info, speed)
+            manifest.put(cue_keys[i], audio_file, too_short, info, speed)
+        for i, error in tts_errors.items():
+            rendered[cue_keys[i]] = error
+
+        speeds = []
+        delays = []
+        placed_end = -math.inf  # End of the last segment placed by the timing scheduler
+
+        for i, text in enumerate(subs.texts):
+            if durations[i] <= 0:
+                log(f"Skipping subtitle {i} due to invalid timing (start: {starts[i]}s, end: {ends[i]}s)")
+                last_end_time = ends[i]
+                continue
+
+            duration = durations[i]
+            log(f"Processing subtitle {i}: '{text}' (start: {starts[i]}s, end: {ends[i]}s, duration: {duration}s)")
+
+            if not text.strip():
+                log(f"Silence for empty subtitle {i} (duration: {duration}s)")
+                timeline_length = max(timeline_length, silence_end(starts[i], duration))
+                last_end_time = ends[i]
+                continue
+
+            if isinstance(rendered[cue_keys[i]], Exception):
+                log(f"Error generating TTS for subtitle {i}: {rendered[cue_keys[i]]}")
+                continue
+
+            audio_file, too_short, info, speed = rendered[cue_keys[i]]
+            if info is not None:
+                segment_index[audio_file] = info
+            speeds.append(1.0 if speed is None else speed)
+            if schedule:
+                # One pass over the cues: a segment starts at its cue or, when the previous one runs past it, right after
+                start_time = max(starts[i], placed_end + schedule_min_gap)
+                placed_end = start_time + indexed_duration(audio_file, segment_index)
+                delays.append(start_time - starts[i])
+                if start_time > starts[i]:
+                    log(f"Segment {i} moved by {start_time - starts[i]:.3f}s, the previous one runs past its start")
+                audio_files.append((audio_file, start_time, ends[i]))
+                if too_short:
+                    continue
+            elif too_short:
+                audio_files.append((audio_file, starts[i], ends[i]))
+                continue
+            else:
+                start_time = starts[i]
+                if i > 0 and (start_time - last_end_time) < 0.5:
+                    start_time += shift_delay
+                    log(f"Applied shift delay of {shift_delay}s for segment {i}: start_time adjusted to {start_time}s")
+                delays.append(start_time - starts[i])
+
+                audio_files.append((audio_file, start_time, ends[i]))
+
+            if i > 0:
+                silence_duration = starts[i] - last_end_time
+                if silence_duration > 0:
+                    timeline_length = max(timeline_length, silence_end(last_end_time, silence_duration))
+
+            last_end_time = ends[i]
+
+        with tracing.span('schedule') as span:
+            report = schedule_report(speeds, delays)
+            span.set(**report)
+        log(f"Timing: {report['stretched']} of {report['segments']} segments stretched ({report['shortened']} shortened, "
+            f"{report['lengthened']} lengthened, average {report['mean_change']:.1%}, max {report['max_change']:.1%}), "
+            f"{report['delayed']} moved after their cue (max {report['max_delay']:.3f}s)")
+        manifest.report = report
+        manifest.repair = repair
+        manifest.speech_model = speech_state
+        manifest.save(set(cue_keys.values()))
+        check_cancelled(cancel_event)
+
+        if not audio_files and not timeline_length:
+            raise PipelineError("No valid audio file to concatenate.")
+
+        mixed_file = os.path.join(output_dir, 'timeline.wav')
+        progress("mix", 0, 1)
+        try:
+            # Normalize and (optionally) compress the final file
+            if use_loudnorm and loudness_engine.lower() == "numpy":
+                # The mixed timeline is measured and normalized in memory and written only once
+                write_wav_samples(loudnorm_samples(mix_timeline_samples(audio_files, output_dir, timeline_length, segment_index)), output_final)
+            elif use_loudnorm:
+                mix_timeline(audio_files, mixed_file, output_dir, timeline_length, segment_index)
+                temp_final = os.path.join(temp_dir, f'temp_final_{os.urandom(8).hex()}.wav')
+                loudnorm_audio(mixed_file, temp_final)
+                shutil.move(temp_final, output_final)
+            else:
+                mix_timeline(audio_files, mixed_file, output_dir, timeline_length, segment_index)
+                final_segment = AudioSegment.from_file(mixed_file)
+                compressed_final = compress_audio(final_segment)
+                normalized_final = normalize_audio(compressed_final, target_dbfs=-20.0)
+                normalized_final.export(output_final, format="wav")
+            log(f"File finale generato e processato: {output_final}")
+        except subprocess.CalledProcessError as e:
+            error_msg = f"Error FFmpeg during the union of the batch: {e.stderr}"
+            log(error_msg)
+            raise PipelineError(error_msg)
+        except Exception as e:
+            error_msg = f"Error during the mix of the segments: {e}"
+            log(error_msg)
+            raise PipelineError(error_msg)
+
+        ffmpeg_cmd = [get_ffmpeg_path(), '-i', output_final, '-c:a', 'mp3', '-b:a', '192k', output_mp3, '-y']
+        try:
+            with tracing.span('encode', format='mp3'):
+                run_subprocess(ffmpeg_cmd, capture_output=True, text=True, check=True)
+            log(f"File MP3 generato: {output_mp3}")
+        except subprocess.CalledProcessError as e:
+            error_msg = f"Error FFmpeg during conversion to mp3: {e.stderr}"
+            log(error_msg)
+            raise PipelineError(error_msg)
+        progress("mix", 1, 1)
+
+        return output_final
+
+    except PipelineCancelled:
+        # The manifest lists only the segments completed before, the partial files are deleted by the next run
+        log("Conversion cancelled")
+        raise
+    finally:
+        if manifest is not None:
+            manifest.store.close()
+        cleanup_pytemp(temp_dir)
+
+def probe_audio(input_file):
+    """Returns (sample rate, channels) of the first audio stream of a file, read from the stream list printed by FFmpeg.
+
+    Only mono matters, every other layout is decoded as stereo: channels is 1 or 2.
+    """
+    result = run_subprocess([get_ffmpeg_path(), '-hide_banner', '-i', input_file], check=False)
+    match = re.search(r'Stream #.*?Audio:.*?(\d+) Hz, ([^,\n]+)', result.stderr or '')
+    if match is None:
+        raise PipelineError(f"No audio stream found in '{os.path.basename(input_file)}'.")
+    layout = match.group(2).strip()
+    return int(match.group(1)), 1 if layout == 'mono' or layout.startswith('1 channel') else 2
+
+def probe_duration(input_file):
+    """Duration in seconds of a file, read from the header printed by FFmpeg, None when it is not known."""
+    result = run_subprocess([get_ffmpeg_path(), '-hide_banner', '-i', input_file], check=False)
+    match = re.search(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)', result.stderr or '')
+    if match is None:
+        return None
+    return int(match.group(1)) * 3600 + int(match.group(2)) * 60 + float(match.group(3))
+
+def spill_fits(input_file, sample_rate, temp_dir, copies=1):
+    """True when temp_dir has room for copies raw 16 bit stereo files of the audio of input_file, with 10% to spare."""
+    duration = probe_duration(input_file)
+    if duration is None:
+        return False
+    try:
+        free = shutil.disk_usage(temp_dir).free
+    except OSError:
+        return False
+    return free > duration * sample_rate * 4 * copies * 1.1
+
+def has_video_stream(input_file):
+    """True when FFmpeg lists a video stream in the file."""
+    result = run_subprocess([get_ffmpeg_path(), '-hide_banner', '-i', input_file], check=False)
+    return re.search(r'Stream #.*?Video:', result.stderr or '') is not None
+
+def decode_pcm16_chunks(input_file, sample_rate, frames, channels=2):
+    """Decodes the audio of a file with FFmpeg and yields it as stereo 16 bit chunks of (frames, 2) samples.
+
+    Only one chunk is in memory at a time. With channels 1 the audio is decoded as mono and copied
+    on both channels like AudioSegment.pan(), the upmix of FFmpeg would lower it by 3 dB.
+    """
+    ffmpeg_cmd = [
+        get_ffmpeg_path(), '-v', 'error', '-i', input_file, '-vn',
+        '-f', 's16le', '-ar', str(sample_rate), '-ac', str(channels), 'pipe:1'
+    ]
+    log(f"Executing FFmpeg command: {' '.join(ffmpeg_cmd)}")
+    with tempfile.TemporaryFile() as errors:
+        process = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=errors)
+        finished = False
+        try:
+            while True:
+                data = process.stdout.read(frames * 2 * channels)
+                if not data:
+                    break
+                samples = np.frombuffer(data, dtype='<i2').reshape(-1, channels)
+                yield np.repeat(samples, 2, axis=1) if channels == 1 else samples
+            finished = True
+        finally:
+            # When the consumer stops early FFmpeg is stopped too
+            process.stdout.close()
+            if not finished:
+                process.kill()
+            returncode = process.wait()
+        if returncode != 0:
+            errors.seek(0)
+            message = errors.read().decode('utf-8', errors='replace')
+            raise PipelineError(f"Error FFmpeg in decoding '{os.path.basename(input_file)}': {message}")
+
+def encode_pcm16_chunks(chunks, sample_rate, channels, output_file, output_args):
+    """Encodes 16 bit chunks with FFmpeg while they are produced, the whole audio is never in memory."""
+    ffmpeg_cmd = [
+        get_ffmpeg_path(), '-v', 'error', '-f', 's16le', '-ar', str(sample_rate), '-ac', str(channels),
+        '-i', 'pipe:0'
+    ] + output_args + [output_file, '-y']
+    log(f"Executing FFmpeg command: {' '.join(ffmpeg_cmd)}")
+    with tempfile.TemporaryFile() as errors, \
+            tracing.span('ffmpeg', 'subprocess', command=' '.join(ffmpeg_cmd)[:300]) as span:
+        process = subprocess.Popen(ffmpeg_cmd, stdin=subprocess.PIPE, stderr=errors)
+        written = 0
+        broken = False
+        try:
+            for chunk in chunks:
+                data = chunk.tobytes()
+                process.stdin.write(data)
+                written += len(data)
+            process.stdin.close()
+        except BrokenPipeError:
+            # FFmpeg has stopped, its error is reported below (some versions exit with 0 after an error in the options)
+            broken = True
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+        returncode = process.wait()
+        span.set(returncode=returncode, input_bytes=written)
+        if returncode != 0 or broken:
+            errors.seek(0)
+            raise subprocess.CalledProcessError(returncode, ffmpeg_cmd, stderr=errors.read().decode('utf-8', errors='replace'))
+
+def cancellable_chunks(chunks, cancel_event=None):
+    """Yields the chunks of a generator, it is closed and PipelineCancelled is raised when cancel_event is set."""
+    try:
+        for chunk in chunks:
+            check_cancelled(cancel_event)
+            yield chunk
+    finally:
+        chunks.close()
+
+def spill_pcm16_chunks(chunks, raw_file):
+    """Yields the 16 bit chunks while writing them to raw_file, a later pass reads them back with read_pcm16_raw()."""
+    with open(raw_file, 'wb') as file:
+        for chunk in chunks:
+            file.write(chunk.tobytes())
+            yield chunk
+
+def read_pcm16_raw(raw_file, frames, channels=2):
+    """Yields the (frames, channels) 16 bit chunks of a file written by spill_pcm16_chunks(), one at a time."""
+    with open(raw_file, 'rb') as file:
+        while True:
+            data = file.read(frames * 2 * channels)
+            if not data:
+                break
+            yield np.frombuffer(data, dtype='<i2').reshape(-1, channels)
+
+def stream_dbfs(chunks):
+    """Level in dBFS of 16 bit chunks like AudioSegment.dBFS, measured one chunk at a time."""
+    total = 0.0
+    count = 0
+    for chunk in chunks:
+        samples = chunk.ravel().astype(np.float64)
+        total += float(np.dot(samples, samples))
+        count += len(samples)
+    rms = math.sqrt(total / count) if count else 0.0
+    return 20 * math.log10(rms / 32768) if rms > 0 else float('-inf')
+
+def stream_loudnorm_gain(chunks, sample_rate):
+    """Measures the mono downmix of stereo 16 bit chunks and returns the linear gain of loudnorm_gain()."""
+    with tracing.span('loudnorm', engine='numpy'):
+        meter = LoudnessMeter(sample_rate)
+        for chunk in chunks:
+            meter.add(chunk.mean(axis=1) / 32768)
+        return 10 ** (loudnorm_gain(meter.result()) / 20)
+
+def pan_gains(pan_amount):
+    """Left and right gains in dB applied by AudioSegment.pan(), pan_amount from -1 (left) to 1 (right)."""
+    max_boost_db = 20 * math.log10(2.0)
+    boost_db = abs(pan_amount) * max_boost_db
+    reduce_factor = 2.0 - 10 ** (boost_db / 20)
+    reduce_db = 20 * math.log10(reduce_factor) if reduce_factor > 0 else float('-inf')
+    # Like pydub, the boost is halved: two speakers do not sum to a full 6 dB
+    boost_db = boost_db / 2.0
+    return (boost_db, reduce_db) if pan_amount < 0 else (reduce_db, boost_db)
+
+def mix_pcm16_chunks(original_chunks, dubbed, sample_rate, frames, original_gain, dubbed_gain):
+    """Yields the stereo 16 bit chunks of original + dub, each multiplied by its (left, right) linear gains.
+
+    original_chunks are the stereo chunks of the original and dubbed is (file, channels), decoded while they
+    are mixed. The dub is cut or completed with silence to the length of the original.
+    """
+    original_gain = np.asarray(original_gain, dtype=np.float32)
+    dubbed_gain = np.asarray(dubbed_gain, dtype=np.float32)
+    dubbed_chunks = decode_pcm16_chunks(dubbed[0], sample_rate, frames, dubbed[1])
+    try:
+        for chunk in original_chunks:
+            mixed = chunk * original_gain
+            dub_chunk = next(dubbed_chunks, None)
+            if dub_chunk is not None:
+                length = min(len(dub_chunk), len(mixed))
+                mixed[:length] += dub_chunk[:length] * dubbed_gain
+            # Saturated like the overlay of two 16 bit AudioSegments
+            np.rint(mixed, out=mixed)
+            yield np.clip(mixed, -32768, 32767, out=mixed).astype('<i2')
+    finally:
+        dubbed_chunks.close()
+
+def video_args(video_file):
+    """FFmpeg output arguments that add the first video stream of video_file, copied without encoding it again."""
+    return ['-i', video_file, '-map', '1:v:0', '-map', '0:a:0', '-c:v', 'copy']
+
+def mix_to_file(original_audio, dubbed_audio, original_volume, dubbed_volume, balance, output_file,
+                codec_args=None, video_file=None, temp_dir=None, cancel_event=None):
+    """Mixes the original audio/video with the dubbed audio and encodes the mix in output_file.
+
+    codec_args are the FFmpeg arguments of the audio codec, None keeps the MP3 of Phase II. With
+    video_file the video stream of that file is copied next to the mix, so the audio is encoded only once.
+    The temporary files go in temp_dir (default pytemp), which is emptied at the end. When cancel_event is set
+    the mix stops after the current chunk or FFmpeg command and the partial output_file is deleted.
+    With phase2_spill the original is decoded once and kept in a raw file in temp_dir (4 bytes per frame, the mix
+    with the numpy loudnorm takes as much again), without it or without the space it is decoded again in each pass.
+    """
+    temp_dir = temp_dir or pytemp_dir
+    try:
+        # Sample rate of the mix, the higher of the two like AudioSegment.overlay()
+        try:
+            original_rate, original_channels = probe_audio(original_audio)
+            dubbed_rate, dubbed_channels = probe_audio(dubbed_audio)
+        except subprocess.CalledProcessError as e:
+            raise PipelineError(f"Error in uploading audio files: {e.stderr}")
+        sample_rate = max(original_rate, dubbed_rate)
+        frames = int(phase2_chunk_seconds * sample_rate)
+        extra_args = video_args(video_file) if video_file else []
+        encode_error = "Error during file merge" if video_file else "Error FFmpeg during conversion to mp3"
+
+        # The original is decoded once, in the level pass, and written to a raw file that the next pass reads back,
+        # when there is room for it (and for the mix measured by the numpy loudnorm)
+        numpy_loudnorm = use_loudnorm and loudness_engine.lower() == "numpy"
+        spill = phase2_spill and spill_fits(original_audio, sample_rate, temp_dir, 2 if numpy_loudnorm else 1)
+        if phase2_spill and not spill:
+            log(f"Not enough free space in {temp_dir} to keep the decoded original, it is decoded in each pass")
+        original_raw = os.path.join(temp_dir, f'temp_original_{os.urandom(8).hex()}.pcm')
+
+        def original_chunks():
+            if spill:
+                return cancellable_chunks(read_pcm16_raw(original_raw, frames), cancel_event)
+            return cancellable_chunks(decode_pcm16_chunks(original_audio, sample_rate, frames, original_channels), cancel_event)
+
+        original_gain_db = original_volume
+        with tracing.span('level', spill=spill):
+            chunks = cancellable_chunks(
+                decode_pcm16_chunks(original_audio, sample_rate, frames, original_channels), cancel_event)
+            original_dbfs = stream_dbfs(spill_pcm16_chunks(chunks, original_raw) if spill else chunks)
+        if math.isfinite(original_dbfs) and abs(original_dbfs - (-20.0)) > 3:
+            original_gain_db += -20.0 - original_dbfs
+            log("Normalized original_segment to -20 dBFS")
+
+        balance_value = balance / 100
+        original_pan = pan_gains(-balance_value)
+        dubbed_pan = pan_gains(balance_value)
+        original_gain = [10 ** ((original_gain_db + pan) / 20) for pan in original_pan]
+        dubbed_gain = [10 ** ((dubbed_volume + pan) / 20) for pan in dubbed_pan]
+
+        def mixed_chunks():
+            return mix_pcm16_chunks(original_chunks(), (dubbed_audio, dubbed_channels), sample_rate, frames,
+                                    original_gain, dubbed_gain)
+
+        if numpy_loudnorm:
+            # The MP3 is mono like the output of loudnorm_audio, so the downmix is what gets measured
+            # With the spill the mix is measured and written to a raw file in the same pass, the encode reads it back
+            if spill:
+                mixed_raw = os.path.join(temp_dir, f'temp_mixed_{os.urandom(8).hex()}.pcm')
+                gain = stream_loudnorm_gain(spill_pcm16_chunks(mixed_chunks(), mixed_raw), sample_rate)
+                os.remove(original_raw)
+                mixed = cancellable_chunks(read_pcm16_raw(mixed_raw, frames), cancel_event)
+            else:
+                gain = stream_loudnorm_gain(mixed_chunks(), sample_rate)
+                mixed = mixed_chunks()
+            normalized = (
+                np.clip(np.rint(chunk.mean(axis=1) * gain), -32768, 32767).astype('<i2') for chunk in mixed
+            )
+            output_args = extra_args + ['-ar', '24000'] + (codec_args or [])
+            try:
+                with tracing.span('encode', format=os.path.splitext(output_file)[1][1:]):
+                    encode_pcm16_chunks(normalized, sample_rate, 1, output_file, output_args)
+            except subprocess.CalledProcessError as e:
+                raise PipelineError(f"{encode_error}: {e.stderr}")
+        elif use_loudnorm:
+            # The two passes of FFmpeg loudnorm read a WAV file, written one chunk at a time
+            temp_wav = os.path.join(temp_dir, f'temp_mixed_{os.urandom(8).hex()}.wav')
+            with tracing.span('overlay'):
+                with wave.open(temp_wav, 'wb') as wav:
+                    wav.setnchannels(2)
+                    wav.setsampwidth(2)
+                    wav.setframerate(sample_rate)
+                    for chunk in mixed_chunks():
+                        wav.writeframes(chunk.tobytes())
+            if video_file:
+                # loudnorm writes a lossless WAV, the only lossy encoding is the one next to the video
+                temp_output = os.path.join(temp_dir, f'temp_loudnorm_{os.urandom(8).hex()}.wav')
+                loudnorm_audio(temp_wav, temp_output, cancel_event)
+                ffmpeg_cmd = [get_ffmpeg_path(), '-i', temp_output] + extra_args + codec_args + [output_file, '-y']
+                try:
+                    run_subprocess(ffmpeg_cmd, capture_output=True, text=True, check=True, cancel_event=cancel_event)
+                except subprocess.CalledProcessError as e:
+                    raise PipelineError(f"{encode_error}: {e.stderr}")
+            else:
+                temp_mp3 = os.path.join(temp_dir, f'temp_mp3_{os.urandom(8).hex()}.mp3')
+                loudnorm_audio(temp_wav, temp_mp3, cancel_event)
+                shutil.move(temp_mp3, output_file)
+            os.remove(temp_wav)
+        else:
+            output_args = extra_args + (codec_args or ['-c:a', 'mp3', '-b:a', '192k'])
+            try:
+                with tracing.span('encode', format=os.path.splitext(output_file)[1][1:]):
+                    encode_pcm16_chunks(mixed_chunks(), sample_rate, 2, output_file, output_args)
+            except subprocess.CalledProcessError as e:
+                raise PipelineError(f"{encode_error}: {e.stderr}")
+        return output_file
+
+    except PipelineCancelled:
+            # A half written output would look like a finished one
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        raise
+    finally:
+        cleanup_pytemp(temp_dir)
+
+@traced_phase('phase2')
+def mix_original_audio(original_audio, dubbed_audio=None, original_volume=-6, dubbed_volume=7, balance=0, output_mp3=None,
+                       work_dir=None, cancel_event=None):
+    """Phase II: mixes the original audio/video with the dubbed audio and returns the path of the MP3.
+
+    balance goes from -100 (original on the right, dub on the left) to 100.
+    work_dir is the folder of the job and cancel_event stops the work, see convert_srt().
+    """
+    dubbed_audio = dubbed_audio or os.path.join(work_dir or script_dir, 'final_output.wav')
+    output_mp3 = output_mp3 or os.path.join(work_dir or script_dir, 'final_mix.mp3')
+
+    if not original_audio or not os.path.exists(original_audio):
+        raise PipelineError("Select a valid original audio/video file.")
+    if not os.path.exists(dubbed_audio):
+        raise PipelineError(f"The dubbed audio file '{os.path.basename(dubbed_audio)}' does not exist. Run the conversion first.")
+
+    mix_to_file(original_audio, dubbed_audio, original_volume, dubbed_volume, balance, output_mp3,
+                temp_dir=job_temp_dir(work_dir), cancel_event=cancel_event)
+    log(f'File finale generato: {output_mp3}')
+    return output_mp3
+
+@traced_phase('phase3')
+def merge_audio_video(original_video, dubbed_audio=None, output_video=None, work_dir=None, cancel_event=None):
+    """Phase III: replaces the audio track of the original video and returns the path of the new video.
+
+    work_dir is the folder of the job and cancel_event stops the work, see convert_srt().
+    """
+    dubbed_audio = dubbed_audio or os.path.join(work_dir or script_dir, 'final_mix.mp3')
+    output_video = output_video or os.path.join(work_dir or script_dir, 'final_video.mp4')
+
+    if not original_video or not os.path.exists(dubbed_audio):
+        raise PipelineError("Select the original video and make sure you have generated dubbed audio.")
+
+    try:
+        ffmpeg_cmd = [
+            get_ffmpeg_path(), '-i', original_video, '-i', dubbed_audio,
+            '-c:v', 'copy', '-c:a', 'aac', '-b:a', '192k',
+            '-map', '0:v:0', '-map', '1:a:0', output_video, '-y'
+        ]
+        run_subprocess(ffmpeg_cmd, capture_output=True, text=True, check=True, cancel_event=cancel_event)
+        log(f'File video finale generato: {output_video}')
+        return output_video
+    except subprocess.CalledProcessError as e:
+        error_msg = f"Errore FFmpeg: {e.stderr}"
+        log(error_msg)
+        raise PipelineError(f"Error during file merge: {error_msg}")
+    except PipelineCancelled:
+        # A half written output would look like a finished one
+        if os.path.exists(output_video):
+            os.remove(output_video)
+        raise
+    finally:
+        cleanup_pytemp(job_temp_dir(work_dir))
+
+@traced_phase('mixmerge')
+def mix_and_merge(original_video, dubbed_audio=None, original_volume=-6, dubbed_volume=7, balance=0, output_video=None,
+                  work_dir=None, cancel_event=None):
+    """Phase II and III in one pass: mixes the audio and writes it next to the untouched video stream.
+
+    The mix is encoded once, straight to AAC, instead of going through final_mix.mp3.
+    work_dir is the folder of the job and cancel_event stops the work, see convert_srt().
+    """
+    dubbed_audio = dubbed_audio or os.path.join(work_dir or script_dir, 'final_output.wav')
+    output_video = output_video or os.path.join(work_dir or script_dir, 'final_video.mp4')
+
+    if not original_video or not os.path.exists(original_video):
+        raise PipelineError("Select a valid original video file.")
+    if not os.path.exists(dubbed_audio):
+        raise PipelineError(f"The dubbed audio file '{os.path.basename(dubbed_audio)}' does not exist. Run the conversion first.")
+    if not has_video_stream(original_video):
+        raise PipelineError(f"No video stream found in '{os.path.basename(original_video)}', use Phase II for an audio file.")
+
+    # With loudnorm the mix is mono like final_mix.mp3, without it is stereo
+    channels = 1 if use_loudnorm else 2
+    codec_args = ['-c:a', 'aac', '-b:a', f'{mixmerge_kbps_per_channel * channels}k']
+    mix_to_file(original_video, dubbed_audio, original_volume, dubbed_volume, balance, output_video,
+                codec_args=codec_args, video_file=original_video, temp_dir=job_temp_dir(work_dir),
+                cancel_event=cancel_event)
+    log(f'File video finale generato: {output_video}')
+    return output_video
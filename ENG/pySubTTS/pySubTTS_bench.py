@@ -0,0 +1,488 @@
+# pySubTTS - benchmark of the pipeline with synthetic subtitles, sources and a fake TTS engine
+# By MoonDragon (https://github.com/MoonDragon-MD/pySubTTS)
+# Does not need a network, voices or PyQt5, only FFmpeg
+# Examples
+# python3 pySubTTS_bench.py
+# python3 pySubTTS_bench.py --cues 100 1000 10000 --workers 0
+# python3 pySubTTS_bench.py --cues 100 1000 --profiles regular -o after.json --compare before.json
+# python3 pySubTTS_bench.py --cues 1000 --profiles regular --tts-loop-ms 20 --chunk-size 1
+# python3 pySubTTS_bench.py --cues 300 --profiles regular --one-pass -o one_pass.json --compare benchmark.json
+# python3 pySubTTS_bench.py --cues 200 --profiles regular --batch 4 --sequential -o sequential.json
+# python3 pySubTTS_bench.py --cues 200 --profiles regular --batch 4 -o batch.json --compare sequential.json
+# python3 pySubTTS_bench.py --cues 2000 --profiles regular --no-segment-store -o files.json
+
+import os
+import sys
+import json
+import time
+import wave
+import zlib
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import functools
+from contextlib import contextmanager
+import numpy as np
+import pipeline
+import batch
+
+WORDS = (
+    "the a house night light road river morning voice friend city window letter music station "
+    "never always quickly slowly tomorrow again together suddenly maybe really "
+    "walk open close wait listen remember follow call find leave bring write"
+).split()
+
+# Gap between the end of a cue and the start of the next one in seconds, negative values overlap
+PROFILES = {
+    "regular": lambda rng: rng.uniform(0.3, 1.5),
+    "tight": lambda rng: rng.uniform(0.0, 0.45),
+    "overlap": lambda rng: rng.uniform(-0.4, 1.0),
+}
+
+def format_srt_time(seconds):
+    """Converts seconds to an SRT timestamp (HH:MM:SS,mmm)."""
+    ms = int(round(seconds * 1000))
+    return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d},{ms % 1000:03d}"
+
+def generate_srt(path, cues, profile, seed=1):
+    """Writes an SRT with cues subtitles, the gaps follow profile. Returns the end of the last cue in seconds."""
+    rng = random.Random(f"{seed}-{cues}-{profile}")
+    gap = PROFILES[profile]
+    start = rng.uniform(0.5, 3.0)
+    end = start
+    with open(path, 'w', encoding='utf-8') as file:
+        for n in range(1, cues + 1):
+            text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 14))).capitalize() + "."
+            # About the reading time of the text, spread so that the segments are both sped up and slowed down
+            duration = max(0.4, (0.3 + 0.06 * len(text)) * rng.uniform(0.6, 1.4))
+            end = start + duration
+            file.write(f"{n}\n{format_srt_time(start)} --> {format_srt_time(end)}\n{text}\n\n")
+            start = max(0.0, end + gap(rng))
+    return end
+
+def generate_source(path, duration, video=True, sample_rate=48000):
+    """Generates a synthetic video (or audio only) source with pink noise, it is reused if it already exists."""
+    if os.path.exists(path):
+        return path
+    ffmpeg_cmd = [pipeline.get_ffmpeg_path(), '-f', 'lavfi', '-i',
+                  f'anoisesrc=color=pink:amplitude=0.1:seed=1:sample_rate={sample_rate}']
+    if video:
+        ffmpeg_cmd += ['-f', 'lavfi', '-i', 'color=c=gray:size=160x90:rate=5',
+                       '-map', '1:v', '-map', '0:a', '-c:v', 'mpeg4', '-q:v', '31', '-c:a', 'aac', '-b:a', '96k']
+    ffmpeg_cmd += ['-ac', '2', '-t', f'{duration:.3f}', path, '-y']
+    pipeline.run_subprocess(ffmpeg_cmd, capture_output=True, text=True, check=True)
+    return path
+
+class FakeVoice:
+    def __init__(self, voice_id, name):
+        self.id = voice_id
+        self.name = name
+
+class FakeTTSEngine:
+    """Deterministic replacement of the pyttsx3 engine, each text becomes a tone as long as its reading time.
+
+    loop_overhead simulates the seconds spent by a real driver to start and stop the event loop of each runAndWait.
+    """
+
+    def __init__(self, sample_rate=22050, loop_overhead=0.0):
+        self.sample_rate = sample_rate
+        self.loop_overhead = loop_overhead
+        self.properties = {'rate': 200, 'volume': 1.0, 'voice': 'fake', 'voices': [FakeVoice('fake', 'Fake tone voice')]}
+        self.queue = []
+
+    def getProperty(self, name):
+        return self.properties[name]
+
+    def setProperty(self, name, value):
+        # Queued like in pyttsx3, so the cues of one runAndWait can have different rates
+        self.queue.append(('property', name, value))
+
+    def save_to_file(self, text, filename):
+        self.queue.append(('save', text, filename))
+
+    def runAndWait(self):
+        queue, self.queue = self.queue, []
+        if self.loop_overhead:
+            time.sleep(self.loop_overhead)
+        for command, first, second in queue:
+            if command == 'property':
+                self.properties[first] = second
+            else:
+                self.write_tone(first, second)
+
+    def write_tone(self, text, filename):
+        # 200 words per minute are about 15 characters per second
+        seconds = (0.15 + 0.065 * len(text)) * 200 / self.properties['rate']
+        t = np.arange(int(seconds * self.sample_rate)) / self.sample_rate
+        frequency = 150 + zlib.crc32(text.encode('utf-8')) % 250
+        # Modulated at 4 Hz like syllables, with 20 ms fades
+        envelope = (0.55 + 0.45 * np.sin(2 * np.pi * 4 * t)) * np.minimum(1, np.minimum(t, t[-1] - t) / 0.02)
+        tone = 0.3 * np.sin(2 * np.pi * frequency * t) * envelope
+        with wave.open(filename, 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(self.sample_rate)
+            wav.writeframes((tone * 32767).astype('<i2').tobytes())
+
+def current_rss():
+    """Resident memory of this process in bytes, None where /proc is not available."""
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def cpu_time():
+    """CPU time of this process and of its finished children (FFmpeg, worker processes)."""
+    times = os.times()
+    return times[0] + times[1] + times[2] + times[3]
+
+class StageMonitor:
+    """Collects wall time, CPU time and peak RSS of nested stages, the name of a stage is its path (phase1/mix)."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.stats = {}
+        self.active = []
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+
+    def sample(self):
+        while not self.stop_event.wait(self.interval):
+            self.update_peak()
+
+    def update_peak(self):
+        rss = current_rss()
+        if rss is not None:
+            for entry in list(self.active):
+                entry['peak_rss'] = max(entry['peak_rss'] or 0, rss)
+
+    def close(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def current(self):
+        return self.active[-1]['name'] if self.active else None
+
+    @contextmanager
+    def stage(self, name):
+        path = f"{self.active[-1]['path']}/{name}" if self.active else name
+        entry = {'name': name, 'path': path, 'peak_rss': current_rss()}
+        self.active.append(entry)
+        start_wall = time.perf_counter()
+        start_cpu = cpu_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = cpu_time() - start_cpu
+            self.update_peak()
+            self.active.remove(entry)
+            stats = self.stats.setdefault(path, {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'peak_rss_mb': None})
+            stats['calls'] += 1
+            stats['wall'] += wall
+            stats['cpu'] += cpu
+            if entry['peak_rss'] is not None:
+                stats['peak_rss_mb'] = max(stats['peak_rss_mb'] or 0, round(entry['peak_rss'] / 1048576, 1))
+
+    def wrap(self, owner, attribute, name, parents=None):
+        """Replaces owner.attribute with a version that runs in the stage name.
+
+        With parents the stage is recorded only when the current stage is one of them.
+        """
+        function = getattr(owner, attribute)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if parents is not None and self.current() not in parents:
+                return function(*args, **kwargs)
+            with self.stage(name):
+                return function(*args, **kwargs)
+
+        setattr(owner, attribute, wrapper)
+        return function
+
+@contextmanager
+def instrumented(monitor, engine):
+    """Records the stages of the pipeline functions while the block runs."""
+    targets = [
+        (pipeline.Subtitles, 'repair', 'repair', None),
+        (engine, 'runAndWait', 'synthesis', None),
+        (pipeline, 'process_segments', 'segments', None),
+        (pipeline, 'stretch_pcm16', 'tempo', None),
+        (pipeline, 'normalize_pcm16', 'normalize', None),
+        (pipeline, 'mix_timeline', 'mix', None),
+        (pipeline, 'mix_timeline_samples', 'mix', None),
+        (pipeline, 'loudnorm_samples', 'loudnorm', None),
+        (pipeline, 'loudnorm_audio', 'loudnorm', None),
+        # The FFmpeg commands launched directly by Phase I are its final encodes
+        (pipeline, 'run_subprocess', 'encode', ('phase1',)),
+        # Phase II streams the mix to the encoder, the stage includes the decoding and mixing of each chunk
+        (pipeline, 'encode_pcm16_chunks', 'encode', ('phase2', 'mixmerge')),
+        (pipeline, 'stream_loudnorm_gain', 'loudnorm', None),
+        (pipeline, 'stream_dbfs', 'level', None),
+    ]
+    originals = [(owner, attribute, monitor.wrap(owner, attribute, name, parents)) for owner, attribute, name, parents in targets]
+    try:
+        yield
+    finally:
+        for owner, attribute, function in reversed(originals):
+            setattr(owner, attribute, function)
+
+def run_workload(work_dir, cues, profile, args):
+    """Runs Phase I, II and III on a synthetic workload and returns its results."""
+    name = f"{cues}_{profile}"
+    job_dir = os.path.join(work_dir, name)
+    os.makedirs(job_dir, exist_ok=True)
+    # Each workload calibrates its own speech rate model, like the first job of a new voice
+    pipeline.speech_model_file = os.path.join(job_dir, 'speech_model.json')
+    srt_file = os.path.join(job_dir, f"{name}.srt")
+    duration = generate_srt(srt_file, cues, profile, args.seed)
+    extension = 'mp4' if args.source == 'video' else 'wav'
+    source = generate_source(os.path.join(work_dir, f"source_{int(duration) + 2}s.{extension}"), int(duration) + 2,
+                             video=args.source == 'video', sample_rate=args.source_rate)
+
+    # The partial can be pickled, the worker processes create their engines with the same overhead
+    engine_factory = functools.partial(FakeTTSEngine, loop_overhead=args.tts_loop_ms / 1000)
+    engine = engine_factory()
+    monitor = StageMonitor()
+    # Without this the job manifest would reuse the segments rendered by a previous run
+    shutil.rmtree(os.path.join(job_dir, 'audio_segments'), ignore_errors=True)
+    result = {'name': name, 'cues': cues, 'profile': profile, 'source': args.source, 'duration': round(duration, 3)}
+    try:
+        with instrumented(monitor, engine), monitor.stage('total'):
+            with monitor.stage('phase1'):
+                pipeline.convert_srt(srt_file, 'fake', engine=engine, engine_factory=engine_factory,
+                                     auto_adjust=not args.no_auto_adjust, stretch=args.stretch, work_dir=job_dir)
+            if args.one_pass and args.source == 'video':
+                with monitor.stage('mixmerge'):
+                    pipeline.mix_and_merge(source, work_dir=job_dir)
+            else:
+                with monitor.stage('phase2'):
+                    pipeline.mix_original_audio(source, work_dir=job_dir)
+            if args.source == 'video' and not args.one_pass:
+                with monitor.stage('merge'):
+                    pipeline.merge_audio_video(source, work_dir=job_dir)
+    except (pipeline.PipelineError, MemoryError) as e:
+        result['error'] = str(e) or type(e).__name__
+    finally:
+        monitor.close()
+    segments_dir = os.path.join(job_dir, 'audio_segments')
+    report = pipeline.JobManifest(segments_dir).report
+    if report is not None:
+        result['schedule'] = report
+    if os.path.isdir(segments_dir):
+        # Files left by Phase I for the segments, one for each cue without the segment store
+        result['segment_files'] = len(os.listdir(segments_dir))
+    # Stages recorded inside the total, without its prefix
+    result['stages'] = {path.split('/', 1)[1] if '/' in path else path: stats for path, stats in monitor.stats.items()}
+    for stats in result['stages'].values():
+        stats['wall'] = round(stats['wall'], 4)
+        stats['cpu'] = round(stats['cpu'], 4)
+    return result
+
+def run_season(work_dir, cues, profile, args):
+    """Dubs args.batch episodes of a synthetic workload through the batch queue, or one after the other with --sequential.
+
+    The stages of the episodes overlap only in the queue, so only the total wall time is measured, with the sum
+    of the convert (Phase I) and mixmerge (Phase II and III) stages of the episodes.
+    """
+    name = f"{cues}_{profile}_x{args.batch}"
+    season_dir = os.path.join(work_dir, name)
+    # The segments of a previous run would be reused by the job manifests
+    shutil.rmtree(os.path.join(season_dir, 'dubbed'), ignore_errors=True)
+    os.makedirs(season_dir, exist_ok=True)
+    pipeline.speech_model_file = os.path.join(season_dir, 'speech_model.json')
+    if os.path.exists(pipeline.speech_model_file):
+        os.remove(pipeline.speech_model_file)
+    extension = 'mp4' if args.source == 'video' else 'wav'
+    jobs = []
+    total_duration = 0
+    for episode in range(1, args.batch + 1):
+        srt_file = os.path.join(season_dir, f"episode{episode:02d}.srt")
+        duration = generate_srt(srt_file, cues, profile, args.seed + episode - 1)
+        total_duration += duration
+        source = generate_source(os.path.join(work_dir, f"source_{int(duration) + 2}s.{extension}"), int(duration) + 2,
+                                 video=args.source == 'video', sample_rate=args.source_rate)
+        jobs.append(batch.BatchJob(f"episode{episode:02d}", srt_file, source,
+                                   os.path.join(season_dir, 'dubbed', f"episode{episode:02d}")))
+
+    engine_factory = functools.partial(FakeTTSEngine, loop_overhead=args.tts_loop_ms / 1000)
+    convert_options = dict(voice_id='fake', engine=engine_factory(), engine_factory=engine_factory,
+                           auto_adjust=not args.no_auto_adjust, stretch=args.stretch)
+    monitor = StageMonitor()
+    result = {'name': name, 'cues': cues * args.batch, 'profile': profile, 'source': args.source,
+              'duration': round(total_duration, 3), 'episodes': args.batch, 'sequential': args.sequential}
+    try:
+        with monitor.stage('total'):
+            if args.sequential:
+                for job in jobs:
+                    os.makedirs(job.work_dir, exist_ok=True)
+                    try:
+                        start = time.perf_counter()
+                        pipeline.convert_srt(job.srt_file, work_dir=job.work_dir, **convert_options)
+                        job.timings['convert'] = time.perf_counter() - start
+                        start = time.perf_counter()
+                        batch.mix_job(job, args.one_pass, {})
+                        job.timings['mixmerge'] = time.perf_counter() - start
+                        job.status = 'done'
+                    except pipeline.PipelineError as e:
+                        job.status, job.error = 'failed', str(e)
+            else:
+                batch.run_batch(jobs, convert_options, one_pass=args.one_pass)
+    finally:
+        monitor.close()
+    errors = [f"{job.name}: {job.error or job.status}" for job in jobs if job.status != 'done']
+    if errors:
+        result['error'] = '; '.join(errors)
+    result['stages'] = monitor.stats
+    for stage in ('convert', 'mixmerge'):
+        timings = [job.timings[stage] for job in jobs if stage in job.timings]
+        result['stages'][stage] = {'calls': len(timings), 'wall': sum(timings), 'cpu': None, 'peak_rss_mb': None}
+    for stats in result['stages'].values():
+        stats['wall'] = round(stats['wall'], 4)
+        stats['cpu'] = None if stats['cpu'] is None else round(stats['cpu'], 4)
+    return result
+
+def ffmpeg_version():
+    try:
+        result = pipeline.run_subprocess([pipeline.get_ffmpeg_path(), '-version'], capture_output=True, text=True, check=True)
+        return result.stdout.splitlines()[0]
+    except Exception:
+        return None
+
+def print_result(result):
+    print(f"\n{result['name']} ({result['cues']} cues, {result['duration']:.0f}s)" + (f" ERROR: {result['error']}" if 'error' in result else ""))
+    print(f"  {'stage':<28}{'calls':>7}{'wall s':>10}{'cpu s':>10}{'peak MB':>10}")
+    for path, stats in result['stages'].items():
+        peak = '-' if stats['peak_rss_mb'] is None else f"{stats['peak_rss_mb']:.0f}"
+        cpu = '-' if stats['cpu'] is None else f"{stats['cpu']:.2f}"
+        print(f"  {path:<28}{stats['calls']:>7}{stats['wall']:>10.2f}{cpu:>10}{peak:>10}")
+    if 'segment_files' in result:
+        print(f"  {result['segment_files']} files in audio_segments")
+    if 'schedule' in result:
+        report = result['schedule']
+        print(f"  {report['stretched']} of {report['segments']} segments stretched (average {report['mean_change']:.1%}, "
+              f"max {report['max_change']:.1%}), {report['delayed']} moved after their cue (max {report['max_delay']:.2f}s)")
+
+def print_comparison(old, new):
+    """Prints the wall time of the stages of two result files side by side."""
+    old_workloads = {workload['name']: workload for workload in old['workloads']}
+    print(f"\n{'workload':<16}{'stage':<28}{'before s':>10}{'after s':>10}{'speedup':>9}")
+    for workload in new['workloads']:
+        previous = old_workloads.get(workload['name'])
+        if previous is None:
+            continue
+        for path, stats in workload['stages'].items():
+            before = previous['stages'].get(path)
+            if before is None:
+                continue
+            ratio = f"{before['wall'] / stats['wall']:.2f}x" if stats['wall'] > 0 else '-'
+            print(f"{workload['name']:<16}{path:<28}{before['wall']:>10.2f}{stats['wall']:>10.2f}{ratio:>9}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the pySubTTS pipeline with synthetic workloads.")
+    parser.add_argument('--cues', type=int, nargs='+', default=[100, 1000], help='Number of cues of the SRTs (default 100 1000)')
+    parser.add_argument('--profiles', nargs='+', choices=sorted(PROFILES), default=["regular", "tight", "overlap"],
+                        help='Gap distributions of the cues (default all)')
+    parser.add_argument('--source', choices=['video', 'audio'], default='video', help='Synthetic original source (default video)')
+    parser.add_argument('--source-rate', type=int, default=48000, help='Sample rate of the original source (default 48000)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Processes for the synthesis and the segments, 0 = one for each CPU core. Synthesis, tempo '
+                             'and normalize are recorded only with 1, the other processes are not measured (default 1)')
+    parser.add_argument('--chunk-size', type=int, default=pipeline.pyttsx3_chunk_size,
+                        help=f'Cues queued before each runAndWait, 1 = one event loop for each cue (default {pipeline.pyttsx3_chunk_size})')
+    parser.add_argument('--tts-loop-ms', type=float, default=0.0,
+                        help='Milliseconds spent by the fake engine in each runAndWait, like the start of a real driver (default 0)')
+    parser.add_argument('--one-pass', action='store_true',
+                        help='Mix and merge a video source in one pass (mix_and_merge) instead of Phase II and merge')
+    parser.add_argument('--stretch', choices=['ffmpeg', 'wsola'], default=pipeline.stretch_engine,
+                        help=f'Engine of the tempo stage (default {pipeline.stretch_engine})')
+    parser.add_argument('--no-speech-model', action='store_true',
+                        help='Synthesize every cue at the normal rate instead of the rate predicted by the speech model')
+    parser.add_argument('--no-scheduler', action='store_true',
+                        help='Stretch every segment to its duration + 0.5s instead of using the silence after its cue')
+    parser.add_argument('--no-auto-adjust', action='store_true', help='Do not accelerate/decelerate the segments')
+    parser.add_argument('--no-segment-store', action='store_true',
+                        help='Write a WAV file for each segment instead of keeping them in the segment store of the job')
+    parser.add_argument('--batch', type=int, default=0, metavar='EPISODES',
+                        help='Dub EPISODES different SRTs of each workload as a season with the batch queue (default 0, one SRT)')
+    parser.add_argument('--sequential', action='store_true',
+                        help='With --batch dub the episodes one after the other instead of overlapping their stages')
+    parser.add_argument('--tts-cache', action='store_true', help='Keep the TTS cache enabled (default disabled)')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the synthetic subtitles (default 1)')
+    parser.add_argument('--work-dir', help='Directory of the generated files (default a temporary directory, removed at the end)')
+    parser.add_argument('-o', '--output', default='benchmark.json', help='Path of the JSON results (default benchmark.json)')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare with')
+    parser.add_argument('--log', action='store_true', help='Print the debug messages')
+    args = parser.parse_args()
+    if args.log:
+        pipeline.logging = "on"
+
+    pipeline.segment_workers = args.workers
+    pipeline.pyttsx3_workers = args.workers
+    pipeline.pyttsx3_chunk_size = args.chunk_size
+    pipeline.use_tts_cache = args.tts_cache
+    pipeline.use_speech_model = not args.no_speech_model
+    pipeline.timing_scheduler = not args.no_scheduler
+    pipeline.segment_store = not args.no_segment_store
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='pySubTTS_bench_')
+    os.makedirs(work_dir, exist_ok=True)
+
+    results = {
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'ffmpeg': ffmpeg_version(),
+        'config': {
+            'segment_workers': pipeline.segment_workers,
+            'pyttsx3_workers': pipeline.pyttsx3_workers,
+            'pyttsx3_chunk_size': pipeline.pyttsx3_chunk_size,
+            'tts_loop_ms': args.tts_loop_ms,
+            'use_tts_cache': pipeline.use_tts_cache,
+            'use_loudnorm': pipeline.use_loudnorm,
+            'loudness_engine': pipeline.loudness_engine,
+            'mixer_engine': pipeline.mixer_engine,
+            'auto_adjust': not args.no_auto_adjust,
+            'stretch_engine': args.stretch,
+            'use_speech_model': not args.no_speech_model,
+            'timing_scheduler': not args.no_scheduler,
+            'segment_store': not args.no_segment_store,
+            'one_pass': args.one_pass,
+            'batch': args.batch,
+            'sequential': args.sequential,
+            'batch_convert_jobs': pipeline.batch_convert_jobs,
+            'batch_mix_jobs': pipeline.batch_mix_jobs,
+            'seed': args.seed,
+        },
+        'workloads': [],
+    }
+    try:
+        for cues in sorted(args.cues):
+            for profile in args.profiles:
+                if args.batch:
+                    result = run_season(work_dir, cues, profile, args)
+                else:
+                    result = run_workload(work_dir, cues, profile, args)
+                results['workloads'].append(result)
+                print_result(result)
+                # Saved after each workload, so a long run that is stopped keeps the results
+                with open(args.output, 'w', encoding='utf-8') as file:
+                    json.dump(results, file, indent=1)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"\nResults saved in {args.output}")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as file:
+            print_comparison(json.load(file), results)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
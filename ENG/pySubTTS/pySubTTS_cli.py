@@ -0,0 +1,217 @@
+# pySubTTS - command line version, does not need PyQt5 or a display
+# By MoonDragon (https://github.com/MoonDragon-MD/pySubTTS)
+# Examples
+# python3 pySubTTS_cli.py convert input.srt --edge --voice it-IT-ElsaNeural
+# python3 pySubTTS_cli.py mix original.mp4
+# python3 pySubTTS_cli.py merge original.mp4
+# python3 pySubTTS_cli.py mixmerge original.mp4
+# python3 pySubTTS_cli.py voices
+# python3 pySubTTS_cli.py batch season_folder --edge --voice it-IT-ElsaNeural -o dubbed_folder
+# python3 pySubTTS_cli.py --trace trace.json convert input.srt --voice <id>
+
+import os
+import sys
+import argparse
+import pipeline
+import tracing
+import batch
+
+def threshold(value):
+    """Converts a threshold in percent, "off" disables it."""
+    if value.lower() == "off":
+        return None
+    return int(value) / 100
+
+def convert_options(args):
+    """Keyword arguments of convert_srt given by the options of the convert and batch commands."""
+    return dict(
+        voice_id=args.voice,
+        use_edge_tts=args.edge,
+        dictionary_file=args.dictionary,
+        dictionary_whole_words=args.whole_words,
+        dictionary_ignore_case=args.ignore_case,
+        auto_adjust=not args.no_auto_adjust,
+        slowdown_threshold=args.slowdown,
+        speedup_threshold=args.speedup,
+        stretch=args.stretch,
+        schedule=False if args.no_scheduler else None,
+        use_speech_model=False if args.no_speech_model else None
+    )
+
+def run_convert(args):
+    output_final = pipeline.convert_srt(
+        args.srt,
+        output_wav=args.output_wav,
+        output_mp3=args.output_mp3,
+        notify=print,
+        **convert_options(args)
+    )
+    print(f"Conversion completed: {output_final}")
+
+def run_mix(args):
+    output_mp3 = pipeline.mix_original_audio(
+        args.original,
+        dubbed_audio=args.dubbed,
+        original_volume=args.original_volume,
+        dubbed_volume=args.dubbed_volume,
+        balance=args.balance,
+        output_mp3=args.output
+    )
+    print(f"Generated audio file: {output_mp3}")
+
+def run_merge(args):
+    output_video = pipeline.merge_audio_video(args.original, dubbed_audio=args.dubbed, output_video=args.output)
+    print(f"Video file generated: {output_video}")
+
+def run_mixmerge(args):
+    output_video = pipeline.mix_and_merge(
+        args.original,
+        dubbed_audio=args.dubbed,
+        original_volume=args.original_volume,
+        dubbed_volume=args.dubbed_volume,
+        balance=args.balance,
+        output_video=args.output
+    )
+    print(f"Video file generated: {output_video}")
+
+def run_batch(args):
+    output_dir = args.output or batch.default_output_dir(args.source)
+    jobs = batch.load_jobs(args.source, output_dir)
+    if args.convert_jobs:
+        pipeline.batch_convert_jobs = args.convert_jobs
+    if args.mix_jobs:
+        pipeline.batch_mix_jobs = args.mix_jobs
+    os.makedirs(output_dir, exist_ok=True)
+    report_file = os.path.join(output_dir, 'batch.json')
+    print(f"{len(jobs)} jobs in {output_dir}")
+
+    def progress(job, stage, done, total):
+        # Only the stages of the batch, not each cue
+        if stage not in ('convert', 'mixmerge'):
+            return
+        phase = 'Phase I' if stage == 'convert' else 'Phase II and III'
+        if not done:
+            print(f"[{job.name}] {phase} started")
+        elif job.status in ('failed', 'cancelled'):
+            print(f"[{job.name}] {phase} {job.status}" + (f": {job.error}" if job.error else ""))
+        else:
+            print(f"[{job.name}] {phase} completed in {job.timings[stage]:.1f}s")
+            if stage == 'convert':
+                for notice in job.notices:
+                    print(f"[{job.name}] {notice}")
+
+    batch.run_batch(
+        jobs,
+        convert_options(args),
+        mix_options=dict(original_volume=args.original_volume, dubbed_volume=args.dubbed_volume, balance=args.balance),
+        one_pass=not args.two_pass,
+        progress=progress,
+        report_file=report_file
+    )
+    failed = [job for job in jobs if job.status != 'done']
+    print(f"{len(jobs) - len(failed)} of {len(jobs)} jobs completed, report saved: {report_file}")
+    for job in failed:
+        print(f"  {job.name}: {job.status}" + (f" ({job.error})" if job.error else ""), file=sys.stderr)
+    if failed:
+        raise pipeline.PipelineError(f"{len(failed)} jobs not completed")
+
+def add_convert_arguments(parser):
+    """Options of Phase I, shared by the convert and batch commands."""
+    parser.add_argument('--voice', required=True, help='Voice id (edge-tts name or pyttsx3 id, see the voices command)')
+    parser.add_argument('--edge', action='store_true', help='Use Edge TTS (online) instead of pyttsx3 (offline)')
+    parser.add_argument('--dictionary', help='Path to the TXT dictionary file (word=pronunciation)')
+    parser.add_argument('--whole-words', action='store_true', help='Replace the dictionary words only when they are whole words')
+    parser.add_argument('--ignore-case', action='store_true', help='Match the dictionary words ignoring upper/lower case')
+    parser.add_argument('--no-auto-adjust', action='store_true', help='Do not accelerate/decelerate the segments')
+    parser.add_argument('--slowdown', type=threshold, default=0.3, help='Slowdown threshold in percent or "off" (default 30)')
+    parser.add_argument('--speedup', type=threshold, default=0.5, help='Acceleration threshold in percent or "off" (default 50)')
+    parser.add_argument('--stretch', choices=['ffmpeg', 'wsola'],
+                        help=f'Engine that changes the speed of the segments, wsola works in memory (default {pipeline.stretch_engine})')
+    parser.add_argument('--no-scheduler', action='store_true',
+                        help='Stretch every segment to its duration + 0.5s instead of using the silence after it first')
+    parser.add_argument('--no-speech-model', action='store_true',
+                        help='Synthesize every cue at the normal rate instead of the rate predicted from its text')
+
+def add_mix_arguments(parser):
+    """Options of Phase II, shared by the mix, mixmerge and batch commands."""
+    parser.add_argument('--original-volume', type=int, default=-6, help='Original audio volume in dB (default -6)')
+    parser.add_argument('--dubbed-volume', type=int, default=7, help='Dubbed audio volume in dB (default 7)')
+    parser.add_argument('--balance', type=int, default=0, help='Audio balance L/R from -100 to 100 (default 0)')
+
+def run_voices(args):
+    engine = pipeline.get_pyttsx3_engine()
+    for voice in engine.getProperty('voices'):
+        print(f"{voice.id}\t{voice.name}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Dubbing with TTS from SRT subtitles, without GUI.")
+    parser.add_argument('--log', action='store_true', help='Print the debug messages')
+    parser.add_argument('--trace', metavar='FILE', help='Save a Chrome/Perfetto trace of the timings in FILE and print a summary')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    convert_parser = subparsers.add_parser('convert', help='Phase I: generate the dubbed audio from an SRT file')
+    convert_parser.add_argument('srt', help='Path to the SRT subtitle file')
+    add_convert_arguments(convert_parser)
+    convert_parser.add_argument('--output-wav', help='Path of the final WAV (default final_output.wav)')
+    convert_parser.add_argument('--output-mp3', help='Path of the final MP3 (default final_output.mp3)')
+    convert_parser.set_defaults(func=run_convert)
+
+    mix_parser = subparsers.add_parser('mix', help='Phase II: mix the original audio/video with the dubbed audio')
+    mix_parser.add_argument('original', help='Path to the original video/audio')
+    mix_parser.add_argument('--dubbed', help='Path to the dubbed WAV (default final_output.wav)')
+    add_mix_arguments(mix_parser)
+    mix_parser.add_argument('-o', '--output', help='Path of the mixed MP3 (default final_mix.mp3)')
+    mix_parser.set_defaults(func=run_mix)
+
+    merge_parser = subparsers.add_parser('merge', help='Phase III: merge the mixed audio with the original video')
+    merge_parser.add_argument('original', help='Path to the original video')
+    merge_parser.add_argument('--dubbed', help='Path to the mixed audio (default final_mix.mp3)')
+    merge_parser.add_argument('-o', '--output', help='Path of the final video (default final_video.mp4)')
+    merge_parser.set_defaults(func=run_merge)
+
+    mixmerge_parser = subparsers.add_parser('mixmerge', help='Phase II and III in one pass: mix the audio and merge it with the video, encoding it only once')
+    mixmerge_parser.add_argument('original', help='Path to the original video')
+    mixmerge_parser.add_argument('--dubbed', help='Path to the dubbed WAV (default final_output.wav)')
+    add_mix_arguments(mixmerge_parser)
+    mixmerge_parser.add_argument('-o', '--output', help='Path of the final video (default final_video.mp4)')
+    mixmerge_parser.set_defaults(func=run_mixmerge)
+
+    batch_parser = subparsers.add_parser('batch', help='Phase I, II and III of many SRT/video pairs, e.g. a whole season')
+    batch_parser.add_argument('source', help='Folder of SRT files with the videos of the same name, or a JSON manifest '
+                                             '([{"srt": ..., "original": ..., "name": ...}])')
+    batch_parser.add_argument('-o', '--output', help='Folder of the jobs, one subfolder each (default the dubbed folder next to the source)')
+    add_convert_arguments(batch_parser)
+    add_mix_arguments(batch_parser)
+    batch_parser.add_argument('--two-pass', action='store_true',
+                              help='Write final_mix.mp3 and then merge it with the video instead of mixing and merging in one pass')
+    batch_parser.add_argument('--convert-jobs', type=int,
+                              help=f'Jobs in Phase I at the same time, only with --edge (default {pipeline.batch_convert_jobs})')
+    batch_parser.add_argument('--mix-jobs', type=int,
+                              help=f'Jobs mixed and merged at the same time (default {pipeline.batch_mix_jobs})')
+    batch_parser.set_defaults(func=run_batch)
+
+    voices_parser = subparsers.add_parser('voices', help='List the pyttsx3 (offline) voices')
+    voices_parser.set_defaults(func=run_voices)
+
+    args = parser.parse_args()
+    if args.log:
+        pipeline.logging = "on"
+
+    if args.trace:
+        tracing.start()
+    try:
+        args.func(args)
+    except pipeline.PipelineError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if args.trace:
+            tracer = tracing.stop()
+            tracer.save(args.trace)
+            print(tracer.summary_table())
+            print(f"Trace saved: {args.trace}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+# pySubTTS - fast SRT reader, the cues are kept as millisecond arrays and a text table
+# By MoonDragon (https://github.com/MoonDragon-MD/pySubTTS)
+# Used by pipeline.py
+
+import re
+import codecs
+import chardet
+import numpy as np
+
+MIN_DURATION_MS = 500  # Duration given by repair() to the cues that are too short, when the next cue leaves room
+SAMPLE_SIZE = 64 * 1024  # Bytes given to chardet from the start, the middle and the end of the file
+BOMS = [  # UTF-32 first, its little endian BOM starts like the UTF-16 one
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+# Same separators as the srt module, also the full width ones of some Asian subtitles
+SEPARATOR = '[,.:\uff0c\uff0e\u3002\uff1a]'
+TIMESTAMP = rf'(\d+){SEPARATOR}(\d+){SEPARATOR}(\d+)(?:{SEPARATOR}(\d*))?'
+# Optional index line and timing line of a cue, its text goes from the end of the match to the next cue
+CUE_REGEX = re.compile(
+    rf'^(?:[ \t]*-?\d+(?:\.\d*)?[ \t]*\r?\n)?[ \t]*{TIMESTAMP} *-[ -] *> *{TIMESTAMP}[^\r\n]*(?:\r?\n|\Z)',
+    re.MULTILINE
+)
+
+def detect_encoding(data):
+    """Returns the encoding of the bytes of an SRT file, from the BOM, UTF-8 or chardet on a sample."""
+    for bom, encoding in BOMS:
+        if data.startswith(bom):
+            return encoding
+    try:
+        data.decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    if len(data) > 3 * SAMPLE_SIZE:
+        middle = len(data) // 2
+        data = data[:SAMPLE_SIZE] + data[middle:middle + SAMPLE_SIZE] + data[-SAMPLE_SIZE:]
+    return chardet.detect(data)['encoding']
+
+def decode(data):
+    """Decodes the bytes of an SRT file, returns (text, encoding)."""
+    encoding = detect_encoding(data)
+    if encoding is not None:
+        try:
+            return data.decode(encoding), encoding
+        except (UnicodeDecodeError, LookupError):
+            pass
+    # The sample was not enough, chardet reads the whole file as before
+    encoding = chardet.detect(data)['encoding'] or 'latin-1'
+    return data.decode(encoding, errors='replace'), encoding
+
+def milliseconds(hours, minutes, seconds, millis):
+    return ((int(hours) * 60 + int(minutes)) * 60 + int(seconds)) * 1000 + (int(millis) if millis else 0)
+
+def format_timestamp(ms):
+    """Returns the SRT timestamp (HH:MM:SS,mmm) of a time in milliseconds."""
+    ms = int(ms)
+    return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d},{ms % 1000:03d}"
+
+def format_changes(changes):
+    """Describes the changes returned by Subtitles.repair() in one line."""
+    parts = [
+        f"{changes['sorted']} cues moved by the sort",
+        f"{changes['merged']} merged into a cue with the same start",
+        f"{changes['clipped']} clipped at the start of the next cue",
+        f"{changes['extended']} extended towards the minimum duration",
+    ]
+    return ', '.join(part for part, key in zip(parts, ('sorted', 'merged', 'clipped', 'extended')) if changes[key]) or "no changes"
+
+class Subtitles:
+    """Cues of an SRT file: start and end in milliseconds (int64 arrays) and the text of each cue.
+
+    No object is created for each cue, the pipeline reads the arrays directly.
+    """
+
+    def __init__(self, start, end, texts, encoding=None):
+        self.start = np.asarray(start, dtype=np.int64)
+        self.end = np.asarray(end, dtype=np.int64)
+        self.texts = texts
+        self.encoding = encoding
+
+    def __len__(self):
+        return len(self.texts)
+
+    @classmethod
+    def parse(cls, text, encoding=None):
+        """Parses the text of an SRT file, the cues are read one after the other from the timing lines."""
+        starts = []
+        ends = []
+        texts = []
+        text_start = None
+        for match in CUE_REGEX.finditer(text):
+            if text_start is not None:
+                texts.append(text[text_start:match.start()])
+            starts.append(milliseconds(*match.group(1, 2, 3, 4)))
+            ends.append(milliseconds(*match.group(5, 6, 7, 8)))
+            text_start = match.end()
+        if text_start is None:
+            if text.strip():
+                raise ValueError("No subtitle found, the file is not in SRT format")
+        else:
+            texts.append(text[text_start:])
+        # Windows line endings become \n and the blank lines after the text are removed
+        texts = [cue.replace('\r\n', '\n').rstrip('\n') for cue in texts]
+        return cls(starts, ends, texts, encoding)
+
+    @classmethod
+    def load(cls, srt_file):
+        """Reads an SRT file in any encoding."""
+        with open(srt_file, 'rb') as file:
+            text, encoding = decode(file.read())
+        return cls.parse(text, encoding)
+
+    def first_error(self):
+        """Describes the first cue that ends before it starts or overlaps the previous one, None if all are valid."""
+        invalid = np.flatnonzero(self.end <= self.start)
+        overlapping = np.flatnonzero(self.start[1:] < self.end[:-1]) + 1
+        if len(invalid) and (not len(overlapping) or invalid[0] <= overlapping[0]):
+            i = int(invalid[0])
+            return f"Invalid subtitle {i}: end ({format_timestamp(self.end[i])}) <= start ({format_timestamp(self.start[i])})"
+        if len(overlapping):
+            i = int(overlapping[0])
+            return (f"Overlapping subtitle {i}: start ({format_timestamp(self.start[i])}) "
+                    f"< previous end ({format_timestamp(self.end[i - 1])})")
+        return None
+
+    def repair(self, min_duration=MIN_DURATION_MS):
+        """Sorts the cues by start, merges those with the same start, clips the overlaps and extends the short cues.
+
+        Returns (Subtitles, changes), changes counts the cues 'sorted', 'merged', 'clipped' and 'extended'.
+        The short cues are extended up to min_duration milliseconds but never past the next cue, so the
+        result always passes first_error(). Everything runs on the arrays, the texts are only reordered.
+        """
+        order = np.argsort(self.start, kind='stable')
+        start = self.start[order]
+        end = self.end[order]
+        texts = [self.texts[i] for i in order.tolist()]
+        changes = {'sorted': int(np.count_nonzero(order != np.arange(len(order))))}
+
+        # The cues with the same start (two tracks at the same time) become one, with the latest end
+        first = np.flatnonzero(np.r_[True, start[1:] != start[:-1]]) if len(start) else np.zeros(0, dtype=np.int64)
+        changes['merged'] = len(start) - len(first)
+        if changes['merged']:
+            end = np.maximum.reduceat(end, first)
+            start = start[first]
+            bounds = np.r_[first, len(texts)].tolist()
+            # Identical lines (repeated by some automatic subtitles) are kept once
+            texts = ['\n'.join(dict.fromkeys(texts[a:b])) for a, b in zip(bounds[:-1], bounds[1:])]
+
+        # Each cue ends at most when the next one starts
+        next_start = np.r_[start[1:], np.iinfo(np.int64).max]
+        clipped = end > next_start
+        changes['clipped'] = int(np.count_nonzero(clipped))
+        end = np.where(clipped, next_start, end)
+
+        target = np.minimum(start + min_duration, next_start)
+        extended = end < target
+        changes['extended'] = int(np.count_nonzero(extended))
+        end = np.where(extended, target, end)
+        return Subtitles(start, end, texts, self.encoding), changes
+
+    def to_srt(self):
+        """Returns the cues in SRT format, numbered again from 1."""
+        return ''.join(
+            f"{index}\n{format_timestamp(start)} --> {format_timestamp(end)}\n{text}\n\n"
+            for index, (start, end, text) in enumerate(zip(self.start.tolist(), self.end.tolist(), self.texts), 1)
+        )
+
+    def save(self, srt_file):
+        """Writes the cues to an SRT file in UTF-8."""
+        with open(srt_file, 'w', encoding='utf-8') as file:
+            file.write(self.to_srt())
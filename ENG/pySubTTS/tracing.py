@@ -0,0 +1,175 @@
+# pySubTTS - timing spans of the pipeline, exported as a Chrome/Perfetto trace and as a summary table
+# By MoonDragon (https://github.com/MoonDragon-MD/pySubTTS)
+# Used by pipeline.py and pySubTTS_cli.py
+# The trace opens in chrome://tracing or https://ui.perfetto.dev
+
+import os
+import json
+import time
+import threading
+
+_tracer = None  # Active Tracer, None when tracing is off
+
+class NullSpan:
+    """Span returned when tracing is off, it does nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **args):
+        pass
+
+NULL_SPAN = NullSpan()
+
+class Span:
+    """Times the block it wraps, set() adds arguments known only at the end (e.g. the bytes written)."""
+
+    def __init__(self, tracer, name, category, lane, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.lane = lane
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.add(self.name, self.category, self.start, duration, self.args, self.lane)
+        return False
+
+    def set(self, **args):
+        self.args.update(args)
+
+class Tracer:
+    """Collects the spans of a process as Chrome trace events (complete events, times in microseconds)."""
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.events = []
+        self.threads = {}
+        self.lanes = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, category, start, duration, args, lane=None):
+        with self.lock:
+            if lane is None:
+                tid = threading.get_ident()
+                if tid not in self.threads:
+                    self.threads[tid] = threading.current_thread().name
+            else:
+                # Spans that overlap in the same thread (e.g. the edge-tts requests) get their own row
+                tid = self.lanes.get(lane)
+                if tid is None:
+                    tid = self.lanes[lane] = len(self.lanes) + 1
+                    self.threads[tid] = lane
+            self.events.append({
+                'name': name, 'cat': category, 'ph': 'X', 'pid': self.pid, 'tid': tid,
+                'ts': round(start * 1e6, 1), 'dur': round(duration * 1e6, 1), 'args': args
+            })
+
+    def extend(self, events, threads=None):
+        """Adds the events recorded by another process (see call_traced)."""
+        with self.lock:
+            self.events.extend(events)
+            for (pid, tid), thread_name in (threads or {}).items():
+                self.threads[(pid, tid)] = thread_name
+
+    def thread_names(self):
+        names = {}
+        for key, thread_name in self.threads.items():
+            pid, tid = key if isinstance(key, tuple) else (self.pid, key)
+            names[(pid, tid)] = thread_name
+        return names
+
+    def chrome_trace(self):
+        """Returns the trace in the Chrome trace event format, also read by Perfetto."""
+        metadata = []
+        pids = sorted({event['pid'] for event in self.events} | {self.pid})
+        for pid in pids:
+            process_name = 'pySubTTS' if pid == self.pid else f'worker {pid}'
+            metadata.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0, 'args': {'name': process_name}})
+        for (pid, tid), thread_name in self.thread_names().items():
+            metadata.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread_name}})
+        return {'traceEvents': metadata + sorted(self.events, key=lambda event: event['ts']), 'displayTimeUnit': 'ms'}
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.chrome_trace(), file, ensure_ascii=False)
+
+    def summary(self):
+        """Returns [(name, count, total, maximum)] in seconds, sorted by total time."""
+        totals = {}
+        for event in self.events:
+            count, total, maximum = totals.get(event['name'], (0, 0.0, 0.0))
+            duration = event['dur'] / 1e6
+            totals[event['name']] = (count + 1, total + duration, max(maximum, duration))
+        return sorted(((name,) + values for name, values in totals.items()), key=lambda row: -row[2])
+
+    def summary_table(self, slowest=10):
+        """Text table of the summary followed by the slowest cues and subprocesses."""
+        lines = [f"{'span':<20}{'count':>8}{'total s':>11}{'mean ms':>11}{'max ms':>11}"]
+        for name, count, total, maximum in self.summary():
+            lines.append(f"{name:<20}{count:>8}{total:>11.3f}{total / count * 1000:>11.1f}{maximum * 1000:>11.1f}")
+        detailed = [event for event in self.events if event['cat'] in ('cue', 'subprocess')]
+        if detailed and slowest:
+            lines.append("")
+            lines.append(f"Slowest {min(slowest, len(detailed))} cues and subprocesses")
+            for event in sorted(detailed, key=lambda event: -event['dur'])[:slowest]:
+                # The command goes last, it is the longest argument
+                args = sorted(event['args'].items(), key=lambda item: item[0] == 'command')
+                args = ', '.join(f'{key}={value}' for key, value in args)
+                lines.append(f"{event['dur'] / 1000:>11.1f} ms  {event['name']:<12}{args[:160]}")
+        return '\n'.join(lines)
+
+def enabled():
+    """True when the spans are being recorded."""
+    return _tracer is not None
+
+def start():
+    """Starts recording the spans of this process and returns the Tracer."""
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+def stop():
+    """Stops recording and returns the Tracer with the spans, None if tracing was off."""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+def span(name, category='stage', lane=None, **args):
+    """Returns a context manager that records a span, almost free when tracing is off.
+
+    category is "phase", "stage", "cue" (one subtitle) or "subprocess". lane puts the span on its own row.
+    """
+    tracer = _tracer
+    if tracer is None:
+        return NULL_SPAN
+    return Span(tracer, name, category, lane, args)
+
+def add_events(events, threads=None):
+    """Adds the spans returned by call_traced to the active trace."""
+    tracer = _tracer
+    if tracer is not None:
+        tracer.extend(events, threads)
+
+def call_traced(function, *args):
+    """Runs function(*args) in a worker process recording its spans, returns (result, events, threads)."""
+    global _tracer
+    previous = _tracer
+    # A forked worker inherits the tracer of the parent, the spans are sent back with the result instead
+    tracer = _tracer = Tracer()
+    try:
+        result = function(*args)
+    finally:
+        _tracer = previous
+    threads = {(tracer.pid, tid): thread_name for tid, thread_name in tracer.threads.items()}
+    return result, tracer.events, threads
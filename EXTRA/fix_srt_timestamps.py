@@ -3,124 +3,95 @@
 SRT Timestamp Sorter and Overlap Fixer
 
 This script:
-1. Parses an SRT file.
-2. Sorts subtitles by start timestamp.
-3. Adjusts end timestamps to avoid overlaps.
-4. Writes a corrected SRT file.
+1. Parses an SRT file (or every SRT file of a directory).
+2. Sorts subtitles by start timestamp and merges those that start together.
+3. Adjusts end timestamps to avoid overlaps and extends the too short subtitles.
+4. Writes a corrected SRT file and prints what it changed.
+
+It uses the same repair of pySubTTS (Subtitles.repair() in subtitles.py), which pySubTTS also
+applies by itself to an invalid SRT. A directory is processed on all the CPU cores.
 
 Author: AI Assistant
 Date: July 31, 2025
 """
 
 # python3 fix_srt_timestamps.py -i input.srt -o output.srt
+# python3 fix_srt_timestamps.py -i subtitles_folder -o fixed_folder
 
-import re
-from datetime import timedelta
+import os
+import sys
 import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-def parse_srt_time(time_str):
-    """Convert SRT timestamp (HH:MM:SS,mmm) to timedelta."""
-    match = re.match(r'(\d{2}):(\d{2}):(\d{2}),(\d{3})', time_str.strip())
-    if not match:
-        raise ValueError(f"Invalid timestamp format: {time_str}")
-    hours, minutes, seconds, milliseconds = map(int, match.groups())
-    return timedelta(hours=hours, minutes=minutes, seconds=seconds, milliseconds=milliseconds)
-
-def format_srt_time(td):
-    """Convert timedelta to SRT timestamp format (HH:MM:SS,mmm)."""
-    total_ms = int(td.total_seconds() * 1000)
-    hours = total_ms // (3600 * 1000)
-    minutes = (total_ms // (60 * 1000)) % 60
-    seconds = (total_ms // 1000) % 60
-    milliseconds = total_ms % 1000
-    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{milliseconds:03d}"
-
-def parse_srt_file(input_file):
-    """Parse SRT file into a list of subtitle entries."""
-    with open(input_file, 'r', encoding='utf-8') as f:
-        content = f.read().strip()
-    
-    entries = []
-    blocks = re.split(r'\n\s*\n', content)
-    for block in blocks:
-        lines = block.strip().split('\n')
-        if len(lines) < 3:
-            continue
-        try:
-            index = int(lines[0])
-            time_match = re.match(r'(\d{2}:\d{2}:\d{2},\d{3}) --> (\d{2}:\d{2}:\d{2},\d{3})', lines[1])
-            if not time_match:
-                continue
-            start_time = parse_srt_time(time_match.group(1))
-            end_time = parse_srt_time(time_match.group(2))
-            text = '\n'.join(lines[2:])
-            entries.append({
-                'index': index,
-                'start': start_time,
-                'end': end_time,
-                'text': text
-            })
-        except (ValueError, IndexError):
-            continue
-    return entries
+# subtitles.py is looked for next to this script, then in the English pySubTTS folder of the repository
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [script_dir, os.path.join(script_dir, '..', 'ENG', 'pySubTTS')]
+from subtitles import Subtitles, MIN_DURATION_MS, format_changes
 
-def fix_srt_timestamps(entries):
-    """Sort entries by start time and fix overlaps."""
-    # Sort by start time
-    entries.sort(key=lambda x: x['start'])
-    
-    # Fix overlaps
-    for i in range(len(entries) - 1):
-        current = entries[i]
-        next_entry = entries[i + 1]
-        # If current end time overlaps with next start time, adjust end time
-        if current['end'] > next_entry['start']:
-            current['end'] = next_entry['start']
-        # Ensure end time is after start time
-        if current['end'] <= current['start']:
-            current['end'] = current['start'] + timedelta(milliseconds=500)  # Minimum duration
-    
-    # Reassign indices
-    for i, entry in enumerate(entries, 1):
-        entry['index'] = i
-    
-    return entries
+def fix_srt_file(input_file, output_file, min_duration=MIN_DURATION_MS):
+    """Repairs an SRT file, returns (number of subtitles, changes)."""
+    subs = Subtitles.load(input_file)
+    fixed, changes = subs.repair(min_duration)
+    fixed.save(output_file)
+    return len(fixed), changes
 
-def write_srt_file(entries, output_file):
-    """Write corrected entries to a new SRT file."""
-    with open(output_file, 'w', encoding='utf-8') as f:
-        for entry in entries:
-            f.write(f"{entry['index']}\n")
-            f.write(f"{format_srt_time(entry['start'])} --> {format_srt_time(entry['end'])}\n")
-            f.write(f"{entry['text']}\n\n")
+def fix_srt_directory(input_dir, output_dir, min_duration=MIN_DURATION_MS, jobs=0):
+    """Repairs every SRT file of input_dir into output_dir, one file for each process. Returns the number of errors."""
+    names = sorted(name for name in os.listdir(input_dir) if name.lower().endswith('.srt'))
+    if not names:
+        print(f"No SRT file found in {input_dir}.")
+        return 0
+    os.makedirs(output_dir, exist_ok=True)
+    workers = max(1, min(jobs or os.cpu_count() or 1, len(names), 61 if os.name == 'nt' else len(names)))
+    print(f"Fixing {len(names)} SRT files with {workers} processes")
+    errors = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(fix_srt_file, os.path.join(input_dir, name), os.path.join(output_dir, name), min_duration): name
+            for name in names
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                count, changes = future.result()
+                print(f"{name}: {count} subtitles, {format_changes(changes)}")
+            except Exception as e:
+                errors += 1
+                print(f"{name}: Error: {e}")
+    print(f"Corrected SRT files created in: {output_dir}")
+    return errors
 
 def main():
     parser = argparse.ArgumentParser(description="Sort and fix SRT timestamps.")
-    parser.add_argument('-i', '--input', type=str, required=True, help='Path to input SRT file')
-    parser.add_argument('-o', '--output', type=str, default='output.srt', help='Path to output SRT file')
+    parser.add_argument('-i', '--input', type=str, required=True, help='Path to input SRT file or to a directory of SRT files')
+    parser.add_argument('-o', '--output', type=str,
+                        help='Path to output SRT file (default output.srt) or directory (default <input>_fixed)')
+    parser.add_argument('--min-duration', type=int, default=MIN_DURATION_MS,
+                        help=f'Minimum duration of a subtitle in milliseconds, when the next one leaves room (default {MIN_DURATION_MS})')
+    parser.add_argument('-j', '--jobs', type=int, default=0, help='Processes used for a directory, 0 = one for each CPU core (default 0)')
     args = parser.parse_args()
 
+    if os.path.isdir(args.input):
+        output_dir = args.output or os.path.normpath(args.input) + '_fixed'
+        return 1 if fix_srt_directory(args.input, output_dir, args.min_duration, args.jobs) else 0
+
     try:
-        # Parse input file
-        entries = parse_srt_file(args.input)
-        if not entries:
+        count, changes = fix_srt_file(args.input, args.output or 'output.srt', args.min_duration)
+        if not count:
             print("No valid subtitle entries found.")
-            return
-        
-        # Fix timestamps
-        fixed_entries = fix_srt_timestamps(entries)
-        
-        # Write output file
-        write_srt_file(fixed_entries, args.output)
-        print(f"Corrected SRT file created: {args.output}")
-        
+            return 0
+        print(f"Corrected SRT file created: {args.output or 'output.srt'}")
+
         # Print summary
-        print(f"Processed {len(entries)} subtitle entries.")
-        
+        print(f"Processed {count} subtitle entries: {format_changes(changes)}.")
+
     except FileNotFoundError:
         print(f"Error: Input file {args.input} not found.")
+        return 1
     except Exception as e:
         print(f"Error: {e}")
+        return 1
+    return 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,272 @@
+# pySubTTS - coda batch, doppia molte coppie SRT/video (ad esempio una stagione intera) in un'unica esecuzione
+# By MoonDragon (https://github.com/MoonDragon-MD/pySubTTS)
+# Usato da pySubTTS_cli.py (comando batch) e pySubTTS_bench.py
+# Ogni lavoro usa una propria cartella, cosi' l'episodio successivo viene sintetizzato mentre il precedente viene mixato
+
+import os
+import re
+import json
+import time
+import queue
+import threading
+import pipeline
+import tracing
+
+# Originali abbinati ai file SRT di una cartella, un video e' preferito a un file audio con lo stesso nome
+MEDIA_EXTENSIONS = ('.mp4', '.mkv', '.avi', '.mov', '.m4v', '.webm', '.ts', '.mpg', '.mpeg', '.wmv', '.flv',
+                    '.wav', '.mp3', '.m4a', '.aac', '.flac', '.ogg', '.opus')
+
+class BatchJob:
+    """Un SRT di un batch con il suo video/audio originale (None per la sola Fase I) e la cartella dei suoi file."""
+
+    def __init__(self, name, srt_file, original=None, work_dir=None):
+        self.name = name
+        self.srt_file = srt_file
+        self.original = original
+        self.work_dir = work_dir
+        self.status = 'queued'  # queued, convert, mixmerge, done, failed o cancelled
+        self.error = None
+        self.outputs = {}
+        self.notices = []  # Avvisi di convert_srt per l'utente, ad esempio come e' stato riparato l'SRT
+        self.timings = {}  # Secondi spesi in ogni fase
+
+    def to_dict(self):
+        return {
+            'name': self.name, 'srt': self.srt_file, 'original': self.original, 'work_dir': self.work_dir,
+            'status': self.status, 'error': self.error, 'outputs': self.outputs, 'notices': self.notices,
+            'timings': {stage: round(seconds, 3) for stage, seconds in self.timings.items()},
+        }
+
+def natural_key(name):
+    """Chiave di ordinamento che mette l'episodio 2 prima dell'episodio 10."""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', name)]
+
+def pair_folder(folder):
+    """Restituisce [(name, srt_file, original)] dei file SRT di folder, ognuno con il file video/audio dello stesso nome.
+
+    Un sottotitolo con un suffisso di lingua (episode01.it.srt) corrisponde anche a episode01.mp4, un SRT senza corrispondenza non ha
+    originale ed esegue solo la Fase I.
+    """
+    media = {}
+    srt_files = []
+    for name in sorted(os.listdir(folder), key=natural_key):
+        path = os.path.join(folder, name)
+        stem, extension = os.path.splitext(name)
+        extension = extension.lower()
+        if not os.path.isfile(path):
+            continue
+        if extension == '.srt':
+            srt_files.append((stem, path))
+        elif extension in MEDIA_EXTENSIONS:
+            current = media.get(stem.lower())
+            if current is None or MEDIA_EXTENSIONS.index(extension) < MEDIA_EXTENSIONS.index(current[0]):
+                media[stem.lower()] = (extension, path)
+    pairs = []
+    for stem, srt_file in srt_files:
+        key = stem.lower()
+        while key not in media and '.' in key:
+            key = key.rsplit('.', 1)[0]
+        pairs.append((stem, srt_file, media[key][1] if key in media else None))
+    return pairs
+
+def read_manifest(path):
+    """Restituisce [(name, srt_file, original)] di un manifest JSON, una lista di {"srt": ..., "original": ..., "name": ...}.
+
+    La lista puo' anche essere i "jobs" di un oggetto. "original" e "name" sono facoltativi, i percorsi relativi
+    sono relativi alla cartella del manifest.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+    except (OSError, ValueError) as e:
+        raise pipeline.PipelineError(f"Errore nella lettura del manifest del batch: {str(e)}")
+    entries = data.get('jobs') if isinstance(data, dict) else data
+    if not isinstance(entries, list):
+        raise pipeline.PipelineError("Il manifest del batch deve essere una lista di lavori o un oggetto con una lista \"jobs\".")
+    base = os.path.dirname(os.path.abspath(path))
+    pairs = []
+    for n, entry in enumerate(entries, 1):
+        if not isinstance(entry, dict) or not entry.get('srt'):
+            raise pipeline.PipelineError(f"Il lavoro {n} del manifest del batch non ha \"srt\".")
+        srt_file = os.path.join(base, entry['srt'])
+        original = os.path.join(base, entry['original']) if entry.get('original') else None
+        name = entry.get('name') or os.path.splitext(os.path.basename(srt_file))[0]
+        pairs.append((name, srt_file, original))
+    return pairs
+
+def default_output_dir(source):
+    """Cartella dei lavori di un batch quando non ne viene data una: dubbed, accanto ai file SRT o al manifest."""
+    base = source if os.path.isdir(source) else os.path.dirname(os.path.abspath(source))
+    return os.path.join(base, 'dubbed')
+
+def load_jobs(source, output_dir=None):
+    """Restituisce i BatchJob di una cartella di coppie SRT/video o di un manifest JSON (vedi read_manifest()).
+
+    Ogni lavoro usa output_dir/<name>, output_dir e' predefinita a default_output_dir(source).
+    """
+    if os.path.isdir(source):
+        pairs = pair_folder(source)
+    elif os.path.isfile(source):
+        pairs = read_manifest(source)
+    else:
+        raise pipeline.PipelineError(f"Cartella o manifest del batch non trovato: {source}")
+    if not pairs:
+        raise pipeline.PipelineError(f"Nessun file SRT trovato in {source}")
+    output_dir = output_dir or default_output_dir(source)
+    jobs = []
+    used = set()
+    for name, srt_file, original in pairs:
+        # Il nome e' la cartella del lavoro, due lavori non ne condividono mai una
+        name = re.sub(r'[\\/:*?"<>|]+', '_', name).strip() or 'job'
+        unique = name
+        n = 2
+        while unique.lower() in used:
+            unique = f'{name}_{n}'
+            n += 1
+        used.add(unique.lower())
+        jobs.append(BatchJob(unique, srt_file, original, os.path.join(output_dir, unique)))
+    return jobs
+
+def write_report(path, jobs):
+    """Scrive lo stato dei lavori in path come JSON, sostituito in un solo passo cosi' non e' mai scritto a meta'."""
+    temp_file = f'{path}.{os.urandom(8).hex()}.tmp'
+    try:
+        with open(temp_file, 'w', encoding='utf-8') as file:
+            json.dump({'jobs': [job.to_dict() for job in jobs]}, file, indent=1, ensure_ascii=False)
+        os.replace(temp_file, path)
+    except OSError as e:
+        pipeline.log(f"Warning: Could not save the batch report: {e}")
+
+def mix_job(job, one_pass, mix_options, cancel_event=None):
+    """Fase II e III di un lavoro: il video viene mixato e unito, un originale audio viene solo mixato."""
+    if not os.path.exists(job.original) or not pipeline.has_video_stream(job.original):
+        # Un originale mancante viene segnalato da mix_original_audio
+        job.outputs['mix'] = pipeline.mix_original_audio(job.original, work_dir=job.work_dir, cancel_event=cancel_event, **mix_options)
+    elif one_pass:
+        job.outputs['video'] = pipeline.mix_and_merge(job.original, work_dir=job.work_dir, cancel_event=cancel_event, **mix_options)
+    else:
+        job.outputs['mix'] = pipeline.mix_original_audio(job.original, work_dir=job.work_dir, cancel_event=cancel_event, **mix_options)
+        job.outputs['video'] = pipeline.merge_audio_video(job.original, work_dir=job.work_dir, cancel_event=cancel_event)
+
+def run_batch(jobs, convert_options, mix_options=None, one_pass=True, progress=None, cancel_event=None,
+              report_file=None):
+    """Doppia i lavori con un gruppo di thread per la Fase I e uno per la Fase II e III, restituisce i lavori.
+
+    Un lavoro passa al mix appena la sua Fase I e' finita, cosi' mentre un episodio viene mixato e unito da FFmpeg
+    il successivo viene gia' sintetizzato. Le fasi eseguono al massimo batch_convert_jobs e batch_mix_jobs
+    lavori alla volta. convert_options sono gli argomenti keyword di convert_srt (voice_id, use_edge_tts, ...)
+    e mix_options quelli di mix_original_audio (volumi e bilanciamento). Con one_pass un video viene mixato e
+    unito da mix_and_merge, altrimenti passando da final_mix.mp3. Un lavoro che fallisce non ferma gli altri.
+    progress(job, stage, done, total) riceve le fasi di convert_srt e le fasi "convert" e "mixmerge" del
+    batch (0 di 1 quando iniziano, 1 di 1 quando finiscono). Lo stato dei lavori viene scritto in report_file.
+    Quando cancel_event e' impostato le fasi in corso vengono fermate come convert_srt e i lavori in coda vengono annullati.
+    """
+    if progress is None:
+        progress = lambda job, stage, done, total: None
+    mix_options = mix_options or {}
+    cancel_event = cancel_event or threading.Event()
+    # pyttsx3 sintetizza gia' su un processo per ogni core (pyttsx3_workers), e con un solo worker ogni lavoro
+    # esegue il suo motore in questo processo, dove due motori non sono sicuri: il driver eSpeak imposta una sola
+    # callback di sintesi per tutto il processo e SAPI richiede COM su ogni thread
+    convert_workers = max(1, pipeline.batch_convert_jobs) if convert_options.get('use_edge_tts') else 1
+    mix_workers = max(1, pipeline.batch_mix_jobs)
+    convert_queue = queue.Queue()
+    mix_queue = queue.Queue()
+    report_lock = threading.Lock()
+
+    def finish(job, status=None):
+        if status is not None:
+            job.status = status
+        if report_file is not None:
+            with report_lock:
+                write_report(report_file, jobs)
+
+    def run_stage(job, stage, function):
+        """Esegue una fase di un lavoro, restituisce False quando e' fallita o e' stata annullata."""
+        finish(job, stage)
+        progress(job, stage, 0, 1)
+        start = time.perf_counter()
+        try:
+            with tracing.span(job.name, 'job', stage=stage):
+                function()
+            return True
+        except pipeline.PipelineCancelled:
+            job.status = 'cancelled'
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e) or type(e).__name__
+            pipeline.log(f"Batch job {job.name} failed in the {stage} stage: {job.error}")
+        finally:
+            job.timings[stage] = time.perf_counter() - start
+            progress(job, stage, 1, 1)
+        finish(job)
+        return False
+
+    def convert_worker():
+        while True:
+            job = convert_queue.get()
+            if job is None:
+                return
+            if cancel_event.is_set():
+                finish(job, 'cancelled')
+                continue
+            os.makedirs(job.work_dir, exist_ok=True)
+
+            def convert():
+                job.outputs['wav'] = pipeline.convert_srt(
+                    job.srt_file, progress=lambda stage, done, total: progress(job, stage, done, total),
+                    cancel_event=cancel_event, work_dir=job.work_dir, notify=job.notices.append, **convert_options)
+                job.outputs['mp3'] = os.path.join(job.work_dir, 'final_output.mp3')
+
+            if run_stage(job, 'convert', convert):
+                if job.original:
+                    mix_queue.put(job)
+                else:
+                    finish(job, 'done')
+
+    def mix_worker():
+        while True:
+            job = mix_queue.get()
+            if job is None:
+                return
+            if cancel_event.is_set():
+                finish(job, 'cancelled')
+            elif run_stage(job, 'mixmerge', lambda: mix_job(job, one_pass, mix_options, cancel_event)):
+                finish(job, 'done')
+
+    def join(threads):
+        """Attende i thread, restituisce True quando nel frattempo Ctrl+C ha annullato il batch."""
+        try:
+            for thread in threads:
+                thread.join()
+            return False
+        except KeyboardInterrupt:
+            # Le fasi in corso si fermano dopo il sottotitolo corrente, i lavori in coda vengono annullati
+            cancel_event.set()
+            for thread in threads:
+                thread.join()
+            return True
+
+    tracer = tracing.start() if pipeline.trace.lower() == "on" and not tracing.enabled() else None
+    convert_threads = [threading.Thread(target=convert_worker, name=f'batch convert {n + 1}') for n in range(convert_workers)]
+    mix_threads = [threading.Thread(target=mix_worker, name=f'batch mix {n + 1}') for n in range(mix_workers)]
+    for job in jobs:
+        convert_queue.put(job)
+    for _ in convert_threads:
+        convert_queue.put(None)
+    pipeline.log(f"Batch of {len(jobs)} jobs, {convert_workers} in Phase I and {mix_workers} in the mix at a time")
+    for thread in convert_threads + mix_threads:
+        thread.start()
+    try:
+        interrupted = join(convert_threads)
+        # I thread del mix finiscono dopo i lavori convertiti, l'ultimo viene messo in coda prima di loro
+        for _ in mix_threads:
+            mix_queue.put(None)
+        interrupted = join(mix_threads) or interrupted
+    finally:
+        if tracer is not None:
+            tracing.stop()
+            pipeline.save_trace(tracer, 'batch')
+    if interrupted:
+        raise KeyboardInterrupt
+    return jobs
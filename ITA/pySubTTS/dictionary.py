@@ -0,0 +1,115 @@
+# pySubTTS - dizionario di pronuncia (parola=pronuncia) applicato a ogni sottotitolo in un solo passaggio
+# By MoonDragon (https://github.com/MoonDragon-MD/pySubTTS)
+# Usato da pipeline.py
+
+import os
+import re
+import json
+import hashlib
+
+CACHE_VERSION = 1  # Da cambiare quando cambia il formato del dizionario compilato
+
+def read_entries(dictionary_file):
+    """Legge le righe parola=pronuncia, una riga successiva prevale su una precedente con la stessa parola."""
+    entries = {}
+    with open(dictionary_file, 'r', encoding='utf-8') as file:
+        for line in file:
+            if '=' not in line:
+                continue
+            word, pronunciation = line.strip().split('=', 1)
+            if word:
+                entries[word] = pronunciation
+    return entries
+
+def build_pattern(words):
+    """Costruisce un'espressione regolare dal trie delle parole, trova sempre la parola piu' lunga."""
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}  # Fine di una parola
+
+    def build(node):
+        alternatives = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not alternatives:
+            return ''
+        if '' in node:
+            # Il ? greedy prova prima le parole piu' lunghe
+            return '(?:' + '|'.join(alternatives) + ')?'
+        if len(alternatives) == 1:
+            return alternatives[0]
+        return '(?:' + '|'.join(alternatives) + ')'
+
+    return build(trie)
+
+class Dictionary:
+    """Dizionario di pronuncia compilato in un'unica espressione regolare.
+
+    Ogni sottotitolo viene riscritto in un solo passaggio: in ogni posizione vince la parola piu' lunga e il
+    testo sostituito non viene cercato di nuovo, quindi il risultato non dipende dall'ordine delle righe.
+    """
+
+    def __init__(self, entries, whole_words=False, ignore_case=False, pattern=None):
+        self.whole_words = whole_words
+        self.ignore_case = ignore_case
+        if ignore_case:
+            entries = {word.lower(): pronunciation for word, pronunciation in entries.items()}
+            # re.IGNORECASE trova anche caratteri che lower() tiene distinti (s e s lunga), vengono cercati con casefold()
+            self.folded = {word.casefold(): pronunciation for word, pronunciation in entries.items()}
+        self.entries = entries
+        self.regex = None
+        if entries:
+            if pattern is None:
+                pattern = build_pattern(entries)
+            self.pattern = pattern
+            if whole_words:
+                pattern = r'(?<!\w)(?:' + pattern + r')(?!\w)'
+            self.regex = re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def apply(self, text):
+        """Restituisce text con ogni parola del dizionario sostituita dalla sua pronuncia."""
+        if self.regex is None:
+            return text
+        if self.ignore_case:
+            return self.regex.sub(self.replacement, text)
+        return self.regex.sub(lambda match: self.entries[match.group(0)], text)
+
+    def replacement(self, match):
+        """Pronuncia di una parola trovata ignorando maiuscole/minuscole, una corrispondenza senza voce resta com'e'."""
+        word = match.group(0)
+        pronunciation = self.entries.get(word.lower())
+        if pronunciation is None:
+            pronunciation = self.folded.get(word.casefold(), word)
+        return pronunciation
+
+    @classmethod
+    def load(cls, dictionary_file, whole_words=False, ignore_case=False, cache_dir=None):
+        """Carica un file dizionario, riusando la forma compilata salvata in cache_dir per lo stesso contenuto."""
+        if cache_dir is None:
+            return cls(read_entries(dictionary_file), whole_words, ignore_case)
+
+        with open(dictionary_file, 'rb') as file:
+            digest = hashlib.sha256(file.read()).hexdigest()
+        cache_file = os.path.join(cache_dir, f'{digest}_{int(ignore_case)}_v{CACHE_VERSION}.json')
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as file:
+                cached = json.load(file)
+            return cls(cached['entries'], whole_words, ignore_case, pattern=cached['pattern'])
+        except (OSError, ValueError, KeyError):
+            pass
+
+        dictionary = cls(read_entries(dictionary_file), whole_words, ignore_case)
+        if dictionary.regex is not None:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                temp_file = f'{cache_file}.{os.urandom(8).hex()}.tmp'
+                with open(temp_file, 'w', encoding='utf-8') as file:
+                    json.dump({'entries': dictionary.entries, 'pattern': dictionary.pattern}, file, ensure_ascii=False)
+                os.replace(temp_file, cache_file)
+            except OSError:
+                pass
+        return dictionary
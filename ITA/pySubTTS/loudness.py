@@ -0,0 +1,198 @@
+# pySubTTS - misuratore di loudness EBU R128 / ITU-R BS.1770 con NumPy (loudness integrata, true peak, LRA)
+# By MoonDragon (https://github.com/MoonDragon-MD/pySubTTS)
+# Usato da pipeline.py, sostituisce il passaggio di misura di FFmpeg loudnorm
+
+import math
+import numpy as np
+
+ABSOLUTE_GATE = -70.0  # LUFS
+RELATIVE_GATE = -10.0  # LU, integrated loudness
+LRA_RELATIVE_GATE = -20.0  # LU, loudness range
+FFT_SIZE = 1 << 20  # Size of the FFT used for the K-weighting filter
+PEAK_BLOCK = 1024  # Samples, the true peak is interpolated only in the blocks that can exceed the current peak
+
+def k_weighting_coefficients(sample_rate):
+    """Restituisce i due biquad (b, a) del filtro K-weighting per sample_rate (stesso progetto di libebur128)."""
+    # High shelf, modella l'effetto acustico della testa
+    f0 = 1681.974450955533
+    gain = 3.999843853973347
+    q = 0.7071752369554196
+    k = math.tan(math.pi * f0 / sample_rate)
+    vh = 10 ** (gain / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = ([(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0],
+             [1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0])
+    # Passa alto (pesatura RLB)
+    f0 = 38.13547087602444
+    q = 0.5003270373238773
+    k = math.tan(math.pi * f0 / sample_rate)
+    a0 = 1 + k / q + k * k
+    highpass = ([1.0, -2.0, 1.0], [1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0])
+    return shelf, highpass
+
+def k_weighting_impulse_response(sample_rate, seconds=0.5):
+    """Risposta all'impulso del filtro K-weighting, la sua coda e' sotto i -200 dB dopo mezzo secondo."""
+    length = int(sample_rate * seconds)
+    response = np.zeros(length)
+    response[0] = 1.0
+    for b, a in k_weighting_coefficients(sample_rate):
+        x1 = x2 = y1 = y2 = 0.0
+        out = np.empty(length)
+        for n in range(length):
+            x0 = response[n]
+            y0 = b[0] * x0 + b[1] * x1 + b[2] * x2 - a[1] * y1 - a[2] * y2
+            out[n] = y0
+            x2, x1, y2, y1 = x1, x0, y1, y0
+        response = out
+    return response
+
+def true_peak_phases(factor=4, taps=49):
+    """Interpolatore polifase windowed-sinc usato per il true peak (stesso filtro di libebur128)."""
+    j = np.arange(taps)
+    m = j - (taps - 1) / 2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        h = np.where(np.abs(m) > 1e-6, np.sin(m * np.pi / factor) / (m * np.pi / factor), 1.0)
+    h *= 0.5 * (1 - np.cos(2 * np.pi * j / (taps - 1)))
+    return [h[phase::factor] for phase in range(factor)]
+
+class LoudnessMeter:
+    """Misura loudness integrata, true peak e loudness range di un audio aggiunto a blocchi.
+
+    add() accetta campioni float in [-1, 1], di forma (n,) per mono o (n, canali). Vengono conservate solo
+    le energie dei 100 ms, quindi la memoria non cresce con la durata dell'audio.
+    """
+
+    def __init__(self, sample_rate, channels=1):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.subblock = int(round(sample_rate / 10))  # 100 ms
+        impulse = k_weighting_impulse_response(sample_rate)
+        self.fft_size = max(FFT_SIZE, 1 << int(math.ceil(math.log2(4 * len(impulse)))))
+        self.chunk_size = self.fft_size - len(impulse) + 1
+        self.filter_spectrum = np.fft.rfft(impulse, self.fft_size)
+        self.filter_history = np.zeros((len(impulse) - 1, channels))
+        # Sovracampionamento solo fino a 4x sotto i 96 kHz, come in BS.1770
+        factor = 4 if sample_rate < 96000 else 2 if sample_rate < 192000 else 1
+        self.phases = true_peak_phases(factor) if factor > 1 else []
+        self.taps = max((len(phase) for phase in self.phases), default=1)
+        # Un campione interpolato non puo' superare il campione piu' grande della sua finestra per questo guadagno
+        self.peak_gain = max((float(np.abs(phase).sum()) for phase in self.phases), default=1.0)
+        self.peak_history = np.zeros((self.taps - 1, channels))
+        self.pending = np.zeros((0, channels))
+        self.energies = []
+        self.peak = 0.0
+
+    def add(self, samples):
+        samples = np.asarray(samples, dtype=np.float64)
+        if samples.ndim == 1:
+            samples = samples[:, np.newaxis]
+        for start in range(0, len(samples), self.chunk_size):
+            chunk = samples[start:start + self.chunk_size]
+            self._add_true_peak(chunk)
+            self._add_energy(self._k_filter(chunk))
+
+    def _k_filter(self, chunk):
+        """Convoluzione FFT con la risposta K-weighting, lo storico la rende continua tra i blocchi."""
+        extended = np.concatenate([self.filter_history, chunk])
+        spectrum = np.fft.rfft(extended, self.fft_size, axis=0) * self.filter_spectrum[:, np.newaxis]
+        filtered = np.fft.irfft(spectrum, self.fft_size, axis=0)
+        history = len(self.filter_history)
+        self.filter_history = extended[len(extended) - history:]
+        return filtered[history:history + len(chunk)]
+
+    def _add_energy(self, filtered):
+        # Tutti i canali hanno peso 1.0 (mono e stereo)
+        squares = np.concatenate([self.pending, filtered ** 2])
+        complete = len(squares) // self.subblock * self.subblock
+        if complete:
+            blocks = squares[:complete].reshape(-1, self.subblock, self.channels)
+            self.energies.append(blocks.sum(axis=(1, 2)))
+        self.pending = squares[complete:]
+
+    def _add_true_peak(self, chunk):
+        self.peak = max(self.peak, float(np.max(np.abs(chunk), initial=0.0)))
+        if not self.phases:
+            return
+        extended = np.concatenate([self.peak_history, chunk])
+        self.peak_history = extended[len(extended) - len(self.peak_history):]
+        blocks = -(-len(extended) // PEAK_BLOCK)
+        for channel in range(self.channels):
+            x = extended[:, channel]
+            block_max = np.zeros(blocks + 1)
+            padded = np.zeros(blocks * PEAK_BLOCK)
+            padded[:len(x)] = np.abs(x)
+            block_max[:blocks] = padded.reshape(blocks, PEAK_BLOCK).max(axis=1)
+            # Le finestre che iniziano in un blocco finiscono al massimo nel successivo
+            candidates = np.flatnonzero(np.maximum(block_max[:-1], block_max[1:]) * self.peak_gain > self.peak)
+            if len(candidates) == 0:
+                continue
+            # I blocchi candidati consecutivi vengono interpolati con una sola convoluzione
+            breaks = np.flatnonzero(np.diff(candidates) > 1)
+            for first, last in zip(np.r_[candidates[0], candidates[breaks + 1]], np.r_[candidates[breaks], candidates[-1]]):
+                segment = x[first * PEAK_BLOCK:(last + 1) * PEAK_BLOCK + self.taps - 1]
+                if len(segment) < self.taps:
+                    continue
+                for phase in self.phases:
+                    interpolated = np.convolve(segment, phase, mode='valid')
+                    self.peak = max(self.peak, float(np.max(np.abs(interpolated))))
+
+    def result(self):
+        """Restituisce {'integrated', 'true_peak', 'lra', 'threshold'} in LUFS, dBTP e LU come FFmpeg loudnorm."""
+        energies = np.concatenate(self.energies) if self.energies else np.zeros(0)
+        block_energy = self._window(energies, 4)
+        integrated, threshold = self._gated_loudness(block_energy)
+        short_term = self._window(energies, 30)
+        lra = self._loudness_range(short_term)
+        true_peak = 20 * math.log10(self.peak) if self.peak > 0 else float('-inf')
+        return {'integrated': integrated, 'true_peak': true_peak, 'lra': lra, 'threshold': threshold}
+
+    def _window(self, energies, subblocks):
+        """Media dei quadrati delle finestre di subblocks x 100 ms, con passo di 100 ms."""
+        if len(energies) < subblocks:
+            return np.zeros(0)
+        cumulative = np.concatenate([[0.0], np.cumsum(energies)])
+        return (cumulative[subblocks:] - cumulative[:-subblocks]) / (subblocks * self.subblock)
+
+    @staticmethod
+    def _loudness(mean_square):
+        with np.errstate(divide='ignore'):
+            return -0.691 + 10 * np.log10(mean_square)
+
+    def _gated_loudness(self, block_energy):
+        loudness = self._loudness(block_energy)
+        gated = block_energy[loudness > ABSOLUTE_GATE]
+        if len(gated) == 0:
+            return float('-inf'), ABSOLUTE_GATE
+        threshold = float(self._loudness(gated.mean())) + RELATIVE_GATE
+        gated = block_energy[loudness > threshold]
+        if len(gated) == 0:
+            return float('-inf'), threshold
+        return float(self._loudness(gated.mean())), threshold
+
+    def _loudness_range(self, short_term):
+        loudness = self._loudness(short_term)
+        loudness = loudness[loudness > ABSOLUTE_GATE]
+        if len(loudness) == 0:
+            return 0.0
+        threshold = float(self._loudness(np.power(10, (loudness + 0.691) / 10).mean())) + LRA_RELATIVE_GATE
+        loudness = loudness[loudness > threshold]
+        if len(loudness) == 0:
+            return 0.0
+        low, high = np.percentile(loudness, [10, 95])
+        return float(high - low)
+
+def measure_loudness(samples, sample_rate, channels=1):
+    """Misura un intero buffer, vedi LoudnessMeter.result()."""
+    meter = LoudnessMeter(sample_rate, channels)
+    meter.add(samples)
+    return meter.result()
+
+def normalization_gain(stats, target_i=-23.0, target_tp=-1.5):
+    """Guadagno in dB che porta l'audio a target_i LUFS senza che il true peak superi target_tp dBTP."""
+    if not math.isfinite(stats['integrated']):
+        return 0.0
+    gain = target_i - stats['integrated']
+    if math.isfinite(stats['true_peak']):
+        gain = min(gain, target_tp - stats['true_peak'])
+    return gain
@@ -0,0 +1,2241 @@
+# pySubTTS - elaborazione (Fase I, II e III) senza GUI
+# By MoonDragon (https://github.com/MoonDragon-MD/pySubTTS)
+# Usata da pySubTTS.py (GUI) e pySubTTS_cli.py (riga di comando)
+
+import os
+import re
+import platform
+from pydub import AudioSegment
+from pydub.effects import compress_dynamic_range
+import asyncio
+import subprocess
+import json
+import shutil
+import hashlib
+import struct
+import wave
+import math
+import time
+import functools
+import tempfile
+import threading
+import zlib
+import numpy as np
+import tracing
+from dictionary import Dictionary
+from subtitles import Subtitles, format_changes
+from loudness import LoudnessMeter, measure_loudness, normalization_gain
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Configurazione FFmpeg portatile, logging e loudnorm
+ffmpegportable = "no"  # Cambia in "no/yes" per usare FFmpeg globale o FFmpeg portatile
+logging = "off"  # Imposta su "on" per debug
+use_loudnorm = True  # Usa loudnorm per il file finale (evita l'aumento costante di volume)
+loudness_engine = "numpy"  # "numpy" misura la loudness in memoria e applica un solo guadagno, "ffmpeg" usa i due passaggi di loudnorm
+use_dynaudnorm_for_batches = False if use_loudnorm else True  # Salta dynaudnorm per batch se loudnorm ? attivo
+edge_tts_max_in_flight = 8  # Numero di richieste edge-tts inviate contemporaneamente
+use_tts_cache = True  # Riusa l'audio TTS gia' generato per lo stesso testo e la stessa voce
+tts_cache_max_mb = 1024  # Dimensione massima della cache TTS, i file usati meno di recente vengono eliminati per primi
+mixer_engine = "numpy"  # "numpy" mixa i segmenti in memoria, "ffmpeg" usa i batch adelay/amix
+stretch_engine = "ffmpeg"  # "ffmpeg" cambia la velocita' di ogni segmento con atempo/rubberband, "wsola" lo adatta in memoria (molto piu' veloce)
+use_speech_model = True  # Prevede la durata di ogni sottotitolo dal suo testo e lo sintetizza alla velocita' giusta, quasi tutti evitano l'adattamento
+speech_model_min_samples = 20  # Sottotitoli misurati per una voce prima di prevederne la velocita', una voce nuova viene calibrata sui primi sottotitoli del lavoro
+speech_rate_step = 0.05  # Passo delle velocita' previste (5%), cosi' la cache TTS trova ancora i sottotitoli generati prima
+timing_scheduler = True  # Ogni sottotitolo puo' usare il silenzio fino al successivo prima di cambiarne la velocita', False lo adatta alla sua durata + 0.5s come prima
+schedule_min_gap = 0.1  # Secondi lasciati dopo un segmento che supera l'inizio del sottotitolo successivo, che viene quindi spostato piu' avanti
+stretch_tolerance = 0.05  # Con lo scheduler dei tempi o il modello di lettura un segmento non viene adattato quando e' entro il 5% della sua durata obiettivo
+segment_workers = 0  # Processi usati per regolare la velocita' dei segmenti, 0 = uno per ogni core della CPU
+segment_store = True  # Tiene i segmenti di un lavoro in un unico file mappato in memoria (audio_segments/segments.pcm), False scrive un adjusted_*.wav per ognuno come prima
+pyttsx3_workers = 0  # Processi usati dal TTS offline (pyttsx3), ognuno con il proprio motore, 0 = uno per ogni core della CPU
+pyttsx3_chunk_size = 32  # Sottotitoli accodati prima di ogni runAndWait di pyttsx3, 1 = un ciclo di eventi per ogni sottotitolo
+use_dictionary_cache = True  # Salva il dizionario compilato, viene ricostruito solo quando il file cambia
+auto_repair_srt = True  # Ordina i sottotitoli e corregge le sovrapposizioni di un SRT non valido invece di rifiutarlo (vedi EXTRA/fix_srt_timestamps.py)
+trace = "off"  # Usa "on" per salvare una traccia Chrome/Perfetto e una tabella riassuntiva di ogni fase in traces/
+mixmerge_kbps_per_channel = 96  # Bitrate AAC dell'audio scritto da mix_and_merge per ogni canale
+batch_convert_jobs = 1  # Episodi di un batch nella Fase I contemporaneamente, piu' di 1 serve solo con edge-tts (pyttsx3 usa sempre 1)
+batch_mix_jobs = 1  # Episodi di un batch mixati e uniti contemporaneamente, mentre i successivi sono nella Fase I
+phase2_chunk_seconds = 20  # Secondi di audio mixati alla volta dalla Fase II, la memoria usata non dipende dalla lunghezza del video
+phase2_spill = True  # La Fase II decodifica l'originale una volta in un file raw in pytemp (circa 11 MB al minuto a 48 kHz, il doppio con il loudnorm numpy), False lo decodifica di nuovo a ogni passaggio
+MAX_INPUTS = 100  # Numero massimo di input per ogni batch FFmpeg
+WSOLA_FRAME = 768  # Campioni di ogni frame WSOLA a 24000 Hz (32 ms), la meta' e' il passo in uscita
+WSOLA_TOLERANCE = 192  # Campioni di cui i frame WSOLA possono spostarsi per restare in fase (8 ms, meta' del periodo di una voce a 62 Hz)
+SPEECH_RATE_MIN = 0.5  # Velocita' minima impostata sui motori TTS, relativa alla velocita' normale della voce
+SPEECH_RATE_MAX = 2.0  # Velocita' massima impostata sui motori TTS, relativa alla velocita' normale della voce
+
+# Directory dello script
+script_dir = os.path.dirname(os.path.abspath(__file__))
+pytemp_dir = os.path.join(script_dir, 'pytemp')
+os.makedirs(pytemp_dir, exist_ok=True)
+tts_cache_dir = os.path.join(script_dir, 'tts_cache')
+dictionary_cache_dir = os.path.join(script_dir, 'dictionary_cache')
+speech_model_file = os.path.join(script_dir, 'speech_model.json')
+traces_dir = os.path.join(script_dir, 'traces')
+
+def log(*args, **kwargs):
+    """Stampa messaggi di log solo se logging ? abilitato."""
+    if logging.lower() == "on":
+        print(*args, **kwargs)
+
+def cleanup_pytemp(temp_dir=None):
+    """Pulisce la cartella pytemp, o la temp_dir di un lavoro."""
+    temp_dir = temp_dir or pytemp_dir
+    if os.path.exists(temp_dir):
+        for temp_file in os.listdir(temp_dir):
+            try:
+                os.remove(os.path.join(temp_dir, temp_file))
+            except Exception as e:
+                log(f"Warning: Could not delete {temp_file}: {e}")
+
+def job_temp_dir(work_dir=None):
+    """Cartella dei file temporanei di un lavoro, pytemp dentro work_dir o la pytemp condivisa senza work_dir."""
+    if work_dir is None:
+        return pytemp_dir
+    temp_dir = os.path.join(work_dir, 'pytemp')
+    os.makedirs(temp_dir, exist_ok=True)
+    return temp_dir
+
+def get_ffmpeg_path():
+    """Restituisce il percorso di FFmpeg in base al sistema operativo e al flag ffmpegportabile."""
+    log(f"Script directory: {script_dir}")
+    
+    if ffmpegportable.lower() == "yes":
+        if platform.system() == "Windows":
+            ffmpeg_path = os.path.join(script_dir, "ffmpeg", "windows", "ffmpeg.exe")
+        else:  # Linux/Ubuntu
+            ffmpeg_path = os.path.join(script_dir, "ffmpeg", "ubuntu", "ffmpeg")
+        
+        ffmpeg_path = os.path.normpath(ffmpeg_path)
+        log(f"FFmpeg path: {ffmpeg_path}")
+        
+        if not os.path.isfile(ffmpeg_path):
+            error_msg = (
+                f"FFmpeg portatile non trovato in {ffmpeg_path}. "
+                "Assicurati che il file esista nella directory corretta o imposta ffmpegportabile = 'no'."
+            )
+            log(error_msg)
+            raise FileNotFoundError(error_msg)
+        
+        if platform.system() != "Windows":
+            try:
+                os.chmod(ffmpeg_path, 0o755)
+                log(f"Set executable permissions for {ffmpeg_path}")
+            except Exception as e:
+                log(f"Warning: Could not set permissions for {ffmpeg_path}: {e}")
+        
+        return ffmpeg_path
+    else:
+        log("Using global FFmpeg")
+        return "ffmpeg"
+
+def run_subprocess(ffmpeg_cmd, capture_output=True, text=True, check=True, input=None, cancel_event=None):
+    """Esegue un comando subprocess compatibile con Python 3.6, input viene inviato al suo stdin.
+
+    Quando cancel_event e' impostato il comando viene fermato e viene sollevata PipelineCancelled.
+    """
+    log(f"Executing FFmpeg command: {' '.join(ffmpeg_cmd)}")
+    with tracing.span('ffmpeg', 'subprocess', command=' '.join(ffmpeg_cmd)[:300]) as span:
+        try:
+            if capture_output:
+                process = subprocess.Popen(
+                    ffmpeg_cmd,
+                    stdin=subprocess.PIPE if input is not None else None,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    universal_newlines=text,
+                    encoding='utf-8' if text else None
+                )
+                stdout, stderr = communicate_cancellable(process, input, cancel_event)
+                returncode = process.returncode
+            else:
+                process = subprocess.Popen(
+                    ffmpeg_cmd,
+                    universal_newlines=text,
+                    encoding='utf-8' if text else None
+                )
+                stdout, stderr = communicate_cancellable(process, None, cancel_event)
+                returncode = process.returncode
+            span.set(returncode=returncode, input_bytes=len(input) if input is not None else 0,
+                     output_bytes=len(stdout) if stdout is not None else 0)
+
+            if check and returncode != 0:
+                raise subprocess.CalledProcessError(returncode, ffmpeg_cmd, output=stdout, stderr=stderr)
+        
+            return subprocess.CompletedProcess(ffmpeg_cmd, returncode, stdout, stderr)
+        except PipelineCancelled:
+            raise
+        except Exception as e:
+            log(f"Subprocess error: {str(e)}")
+            raise subprocess.CalledProcessError(1, ffmpeg_cmd, stderr=str(e))
+
+def communicate_cancellable(process, input=None, cancel_event=None):
+    """process.communicate() che termina il processo e solleva PipelineCancelled appena cancel_event e' impostato."""
+    while True:
+        try:
+            return process.communicate(input, timeout=None if cancel_event is None else 0.2)
+        except subprocess.TimeoutExpired:
+            if cancel_event.is_set():
+                process.kill()
+                process.communicate()
+                raise PipelineCancelled()
+
+def mp3_to_wav(input_file, output_file):
+    """Converte un file MP3 in WAV mono a 24000 Hz."""
+    audio = AudioSegment.from_mp3(input_file)
+    audio = audio.set_frame_rate(24000).set_channels(1)
+    audio.export(output_file, format="wav")
+
+async def generate_edge_tts(text, output_file, voice="it-IT-ElsaNeural", communicate_factory=None, rate=None,
+                            temp_dir=None):
+    """Genera audio con edge-tts (online) e converte in WAV, rate e' la velocita' di edge-tts (ad es. "+10%")."""
+    temp_mp3 = os.path.join(temp_dir or pytemp_dir, f'temp_{os.urandom(8).hex()}.mp3')
+    try:
+        if communicate_factory is None:
+            import edge_tts
+            communicate_factory = edge_tts.Communicate
+        if rate is None or rate == '+0%':
+            communicate = communicate_factory(text, voice)
+        else:
+            communicate = communicate_factory(text, voice, rate=rate)
+        await communicate.save(temp_mp3)
+        # La decodifica gira in un thread cosi' le altre richieste continuano
+        await asyncio.get_event_loop().run_in_executor(None, mp3_to_wav, temp_mp3, output_file)
+    except Exception as e:
+        raise Exception(f"Errore nella generazione con edge-tts: {str(e)}")
+    finally:
+        # Eliminato anche in caso di errore, una richiesta o una decodifica fallita lascia il suo MP3
+        try:
+            os.remove(temp_mp3)
+        except OSError:
+            pass
+
+async def generate_edge_tts_window(jobs, voice, max_in_flight, communicate_factory=None, on_done=None, cancel_event=None,
+                                   temp_dir=None):
+    """Genera tutti i lavori (text, output_file, rate) tenendo aperte al massimo max_in_flight richieste."""
+    semaphore = asyncio.Semaphore(max_in_flight)
+    free_slots = list(range(max_in_flight))  # Ogni richiesta in corso viene disegnata sulla riga del suo slot nella traccia
+
+    async def generate_one(text, output_file, rate):
+        async with semaphore:
+            # Dopo l'annullamento i lavori in coda vengono saltati, si completano solo le richieste in corso
+            if cancel_event is not None and cancel_event.is_set():
+                return PipelineCancelled()
+            slot = free_slots.pop()
+            try:
+                with tracing.span('tts', 'cue', lane=f'edge-tts {slot}', file=os.path.basename(output_file),
+                                  engine='edge-tts', chars=len(text)) as span:
+                    await generate_edge_tts(text, output_file, voice=voice, communicate_factory=communicate_factory,
+                                            rate=rate, temp_dir=temp_dir)
+                    if tracing.enabled():
+                        span.set(bytes=file_size(output_file))
+                return None
+            except Exception as e:
+                return e
+            finally:
+                free_slots.append(slot)
+                if on_done is not None:
+                    on_done()
+
+    return await asyncio.gather(*(generate_one(text, output_file, rate) for text, output_file, rate in jobs))
+
+def generate_edge_tts_batch(jobs, voice="it-IT-ElsaNeural", max_in_flight=None, communicate_factory=None,
+                            on_done=None, cancel_event=None, temp_dir=None):
+    """Genera una lista di lavori (text, output_file, rate) con edge-tts in un unico event loop.
+
+    Restituisce una lista nello stesso ordine di jobs con None per ogni successo o l'eccezione sollevata.
+    rate e' la velocita' edge-tts del sottotitolo, None o "+0%" per la velocita' normale della voce.
+    communicate_factory(text, voice) sostituisce edge_tts.Communicate, ad es. per puntare a un server locale,
+    riceve anche l'argomento rate quando la velocita' di un sottotitolo viene cambiata.
+    on_done() viene chiamata dopo ogni lavoro generato, i lavori non avviati dopo che cancel_event e' impostato
+    restituiscono PipelineCancelled. Gli MP3 scaricati da edge-tts vengono tenuti in temp_dir (predefinita pytemp).
+    """
+    if not jobs:
+        return []
+    max_in_flight = max(1, max_in_flight or edge_tts_max_in_flight)
+    log(f"Generating {len(jobs)} edge-tts segments with {max_in_flight} requests in flight")
+    return asyncio.run(generate_edge_tts_window(jobs, voice, max_in_flight, communicate_factory, on_done, cancel_event,
+                                                temp_dir))
+
+class TTSCache:
+    """Cache dei file WAV TTS indirizzata per contenuto con eliminazione LRU, condivisa da tutti i lavori."""
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(engine, voice, rate, text):
+        """Restituisce la chiave di cache per un testo generato con motore, voce e velocita' indicati."""
+        data = json.dumps([engine, voice, str(rate), text], ensure_ascii=False)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.wav')
+
+    def get(self, key, output_file):
+        """Copia l'audio in cache in output_file, restituisce False se non e' in cache."""
+        cached = self.path(key)
+        try:
+            shutil.copyfile(cached, output_file)
+            os.utime(cached)
+            return True
+        except (FileNotFoundError, PermissionError):
+            # Mancante o appena eliminato da un altro lavoro
+            return False
+
+    def put(self, key, audio_file):
+        """Salva audio_file nella cache, la rinomina lo rende visibile agli altri lavori solo quando e' completo."""
+        temp_file = os.path.join(self.cache_dir, f'{key}.{os.urandom(8).hex()}.tmp')
+        try:
+            shutil.copyfile(audio_file, temp_file)
+            os.replace(temp_file, self.path(key))
+        except OSError as e:
+            log(f"Warning: Could not store {audio_file} in the TTS cache: {e}")
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+    def trim(self):
+        """Elimina i file usati meno di recente finche' la cache non rientra in max_bytes."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.wav'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+            total -= size
+        log(f"TTS cache size: {total / (1024 * 1024):.1f} MB")
+
+def engine_rate_for(engine, base_rate, factor):
+    """Restituisce la velocita' da impostare su un motore TTS per parlare factor volte piu' veloce di base_rate.
+
+    pyttsx3 ha una velocita' in parole al minuto, edge-tts una percentuale della velocita' normale della voce.
+    """
+    if engine == 'edge-tts':
+        return f"{int(round((factor - 1) * 100)):+d}%"
+    return int(round(base_rate * factor))
+
+class SpeechRateModel:
+    """Prevede quanto tempo impiega ogni voce a pronunciare un testo, calibrato sui sottotitoli gia' sintetizzati.
+
+    La durata alla velocita' normale e' seconds = a + b * caratteri (lettere e cifre), stimata ai minimi
+    quadrati per ogni motore, voce e velocita' normale. Vengono tenute solo le somme della stima, in speech_model.json,
+    cosi' ogni sottotitolo misurato aggiorna il modello della voce che continua a imparare da un lavoro all'altro. Un lavoro
+    aggiunge i suoi sottotitoli al file com'e' quando lo salva, cosi' i lavori di un batch eseguiti insieme tengono tutti i loro.
+    """
+
+    VERSION = 1
+    save_lock = threading.Lock()  # I lavori di un batch salvano il modello dai loro thread
+    MAX_SAMPLES = 2000  # Oltre questo i sottotitoli vecchi pesano sempre meno, il modello segue una voce che cambia
+
+    def __init__(self, path):
+        self.path = path
+        self.voices = self.load(path)
+        # Sottotitoli misurati da questo lavoro, aggiunti alle somme salvate nel frattempo dagli altri lavori
+        self.added = []
+
+    @classmethod
+    def load(cls, path):
+        """Somme di ogni voce salvate in path, vuote quando non c'e' un modello valido."""
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+            if data.get('version') == cls.VERSION:
+                return data['voices']
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+        return {}
+
+    @staticmethod
+    def voice_key(engine, voice, base_rate):
+        return json.dumps([engine, voice, str(base_rate)], ensure_ascii=False)
+
+    @staticmethod
+    def characters(text):
+        return sum(1 for char in text if char.isalnum())
+
+    def samples(self, engine, voice, base_rate):
+        """Numero di sottotitoli misurati per una voce."""
+        sums = self.voices.get(self.voice_key(engine, voice, base_rate))
+        return int(round(sums[0])) if sums else 0
+
+    def state(self, engine, voice, base_rate):
+        """Sottotitoli misurati per una voce e un digest delle sue somme, dicono da quale modello vengono le velocita' di un lavoro."""
+        sums = self.voices.get(self.voice_key(engine, voice, base_rate))
+        digest = hashlib.sha256(json.dumps(sums).encode('utf-8')).hexdigest()[:16]
+        return {'samples': self.samples(engine, voice, base_rate), 'digest': digest}
+
+    def add(self, engine, voice, base_rate, text, seconds, factor=1.0):
+        """Registra un sottotitolo durato seconds quando pronunciato factor volte piu' veloce della velocita' normale."""
+        key = self.voice_key(engine, voice, base_rate)
+        x = self.characters(text)
+        y = seconds * factor
+        self.added.append((key, x, y))
+        self.accumulate(self.voices, key, x, y)
+
+    @classmethod
+    def accumulate(cls, voices, key, x, y):
+        """Aggiunge alle somme di una voce un sottotitolo di x caratteri durato y secondi alla velocita' normale."""
+        n, sx, sy, sxx, sxy = voices.get(key, [0, 0, 0, 0, 0])
+        if n >= cls.MAX_SAMPLES:
+            scale = (cls.MAX_SAMPLES - 1) / n
+            n, sx, sy, sxx, sxy = n * scale, sx * scale, sy * scale, sxx * scale, sxy * scale
+        voices[key] = [n + 1, sx + x, sy + y, sxx + x * x, sxy + x * y]
+
+    def predict(self, engine, voice, base_rate, text):
+        """Restituisce i secondi necessari a pronunciare text alla velocita' normale, None se la voce non e' ancora calibrata."""
+        if self.samples(engine, voice, base_rate) < speech_model_min_samples:
+            return None
+        n, sx, sy, sxx, sxy = self.voices[self.voice_key(engine, voice, base_rate)]
+        x = self.characters(text)
+        spread = n * sxx - sx * sx
+        if spread > 1e-9 * n * n:
+            slope = (n * sxy - sx * sy) / spread
+            seconds = (sy - slope * sx) / n + slope * x
+        else:
+            # Tutti i sottotitoli misurati finora hanno la stessa lunghezza
+            seconds = sy * x / sx if sx else sy / n
+        return max(seconds, 0.1)
+
+    def rate_factor(self, engine, voice, base_rate, text, target, slowdown_threshold, speedup_threshold):
+        """Restituisce quanto piu' veloce della velocita' normale va pronunciato text per durare target secondi.
+
+        Il fattore viene arrotondato a speech_rate_step e resta entro le soglie di velocita' (None ne disattiva una).
+        Restituisce 1.0 quando la voce non e' ancora calibrata.
+        """
+        predicted = self.predict(engine, voice, base_rate, text)
+        if predicted is None:
+            return 1.0
+        factor = round(predicted / max(target, 0.5) / speech_rate_step) * speech_rate_step
+        # Le soglie limitano la lunghezza finale di un segmento rispetto alla sua lunghezza naturale, cioe' 1 / factor
+        if slowdown_threshold is not None and slowdown_threshold < 1:
+            factor = min(factor, 1 / (1 - slowdown_threshold))
+        if speedup_threshold is not None:
+            factor = max(factor, 1 / (1 + speedup_threshold))
+        return round(min(max(factor, SPEECH_RATE_MIN), SPEECH_RATE_MAX), 4)
+
+    def save(self):
+        """Aggiunge al file del modello i sottotitoli misurati da questo lavoro, tenendo quelli salvati nel frattempo dagli altri."""
+        with self.save_lock:
+            voices = self.load(self.path)
+            for key, x, y in self.added:
+                self.accumulate(voices, key, x, y)
+            temp_file = f'{self.path}.{os.urandom(8).hex()}.tmp'
+            try:
+                with open(temp_file, 'w', encoding='utf-8') as file:
+                    json.dump({'version': self.VERSION, 'voices': voices}, file)
+                os.replace(temp_file, self.path)
+            except OSError as e:
+                log(f"Warning: Could not save the speech rate model: {e}")
+                return
+            self.voices = voices
+            self.added = []
+
+class JobManifest:
+    """Segmento generato per ogni sottotitolo dell'ultima conversione, salvato in manifest.json della cartella dei segmenti.
+
+    La chiave di un sottotitolo copre tutto cio' che cambia il suo segmento (motore, voce, testo, durata, soglie
+    di velocita', motore di stretch), quindi dopo una modifica dell'SRT solo i sottotitoli cambiati vengono sintetizzati e adattati di nuovo.
+    I file di un sottotitolo prendono il nome dalla sua chiave, cosi' un sottotitolo spostato a un altro indice mantiene il suo segmento.
+    E' anche l'indice dei segmenti del lavoro: frame, rate e canali di ogni segmento vengono registrati
+    quando viene prodotto, cosi' la sua durata e' nota senza decodificarlo. I segmenti tenuti nel SegmentStore
+    del lavoro hanno il loro offset al suo interno invece di un file, e un checksum: un segmento dello store che non
+    corrisponde piu' viene generato di nuovo come un sottotitolo assente dal manifest.
+    """
+
+    VERSION = 1  # Cambiala quando process_segment produce un audio diverso
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, 'manifest.json')
+        self.entries = {}
+        self.report = None  # Tempi dell'ultima conversione, vedi schedule_report()
+        self.repair = None  # Modifiche fatte a un SRT non valido dall'ultima conversione, vedi Subtitles.repair()
+        self.speech_model = None  # Stato del modello della velocita' usato dall'ultima conversione, vedi SpeechRateModel.state()
+        self.store = SegmentStore(os.path.join(output_dir, 'segments.pcm'))
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+            if data.get('version') == self.VERSION:
+                self.entries = data['cues']
+                self.report = data.get('schedule')
+                self.repair = data.get('repair')
+                self.speech_model = data.get('speech_model')
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+
+    @classmethod
+    def make_key(cls, engine, voice, rate, text, duration, auto_adjust, slowdown_threshold, speedup_threshold, stretch,
+                 schedule=False):
+        """Restituisce la chiave di un sottotitolo, l'inizio non ne fa parte perche' sposta solo il segmento nel mix."""
+        fields = [cls.VERSION, engine, voice, str(rate), text, round(duration, 3), auto_adjust,
+                  slowdown_threshold, speedup_threshold]
+        if stretch != "ffmpeg":
+            # Le chiavi dello stretch FFmpeg restano quelle di prima, cosi' i vecchi manifest sono ancora validi
+            fields.append(stretch)
+        if schedule:
+            # duration e' la finestra dello scheduler dei tempi, il segmento non viene allungato per riempirla
+            fields.append('schedule')
+        data = json.dumps(fields, ensure_ascii=False)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()[:20]
+
+    def tts_file(self, key):
+        return os.path.join(self.output_dir, f'output_{key}.wav')
+
+    def adjusted_file(self, key):
+        return os.path.join(self.output_dir, f'adjusted_{key}.wav')
+
+    def get(self, key):
+        """Restituisce (audio_file, too_short, info, speed) di un segmento generato da un'esecuzione precedente, None se va generato.
+
+        audio_file e' uno StoredSegment per i segmenti tenuti nello store.
+        info e' (frames, rate, channels), None per i segmenti registrati prima che esistesse l'indice.
+        speed e' il cambio di lunghezza dato da process_segment, None quando non e' stato registrato.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        info = (entry['frames'], entry['rate'], entry['channels']) if 'frames' in entry else None
+        if 'offset' in entry:
+            if entry['offset'] + info[0] * info[2] > self.store.size():
+                return None
+            audio_file = StoredSegment(self.store, entry['offset'], *info)
+            if 'crc' in entry:
+                try:
+                    if zlib.crc32(audio_file.samples()) != entry['crc']:
+                        log("Segment store: the segment of a cue does not match its checksum, it is rendered again")
+                        return None
+                except (OSError, ValueError):
+                    return None
+        else:
+            audio_file = os.path.join(self.output_dir, entry['file'])
+            if not os.path.exists(audio_file):
+                return None
+        return audio_file, entry['too_short'], info, entry.get('speed')
+
+    def put(self, key, audio_file, too_short, info=None, speed=None):
+        if isinstance(audio_file, StoredSegment):
+            self.entries[key] = {'offset': audio_file.offset, 'crc': zlib.crc32(audio_file.samples()), 'too_short': too_short}
+        else:
+            self.entries[key] = {'file': os.path.basename(audio_file), 'too_short': too_short}
+        if info is not None:
+            self.entries[key].update(zip(('frames', 'rate', 'channels'), info))
+        if speed is not None:
+            self.entries[key]['speed'] = speed
+
+    def compact(self, keys):
+        """Scarta i sottotitoli non in keys e riscrive lo store quando meno della meta' e' ancora usata.
+
+        Viene eseguito prima che i segmenti di una conversione vengano letti, gli offset dei segmenti tenuti cambiano.
+        """
+        size = self.store.size()
+        # I segmenti tagliati da uno store troncato vengono scartati, i loro sottotitoli vengono generati di nuovo
+        self.entries = {
+            key: entry for key, entry in self.entries.items()
+            if key in keys and ('offset' not in entry or entry['offset'] + entry['frames'] * entry['channels'] <= size)
+        }
+        stored = [entry for entry in self.entries.values() if 'offset' in entry]
+        live = sum(entry['frames'] * entry['channels'] for entry in stored)
+        if size == 0 or live * 2 > size:
+            return
+        with tracing.span('compact_store', samples=size, live=live):
+            stored.sort(key=lambda entry: entry['offset'])
+            offsets = self.store.compact([(entry['offset'], entry['frames'] * entry['channels']) for entry in stored])
+            for entry, offset in zip(stored, offsets):
+                entry['offset'] = offset
+        log(f"Segment store compacted from {size * 2} to {live * 2} bytes")
+        self.write()
+
+    def save(self, keys):
+        """Tiene solo i sottotitoli in keys, elimina i file dei segmenti non piu' usati e scrive il manifest."""
+        self.entries = {key: entry for key, entry in self.entries.items() if key in keys}
+        used = {entry['file'] for entry in self.entries.values() if 'file' in entry}
+        for name in os.listdir(self.output_dir):
+            if name.endswith('.wav') and name.startswith(('output_', 'adjusted_')) and name not in used:
+                try:
+                    os.remove(os.path.join(self.output_dir, name))
+                except OSError:
+                    pass
+        self.write()
+
+    def write(self):
+        temp_file = f'{self.path}.{os.urandom(8).hex()}.tmp'
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as file:
+                data = {'version': self.VERSION, 'cues': self.entries}
+                if self.report is not None:
+                    data['schedule'] = self.report
+                if self.repair is not None:
+                    data['repair'] = self.repair
+                if self.speech_model is not None:
+                    data['speech_model'] = self.speech_model
+                json.dump(data, file)
+            os.replace(temp_file, self.path)
+        except OSError as e:
+            log(f"Warning: Could not save the job manifest: {e}")
+
+class SegmentStore:
+    """I segmenti di un lavoro aggiunti a un unico file di campioni a 16 bit e riletti tramite una mappa in memoria.
+
+    Un lavoro con migliaia di sottotitoli scrive un solo file invece di un WAV per ogni segmento, e il mixer
+    legge ogni segmento come una porzione della mappa senza copiarlo. Il JobManifest tiene la posizione di ognuno.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.writer = None
+        self.map = None
+        # Uno store tagliato a meta' di un campione finisce con mezzo campione, scartato cosi' i nuovi segmenti restano allineati
+        try:
+            size = os.path.getsize(path)
+            if size % 2:
+                os.truncate(path, size - 1)
+        except OSError:
+            pass
+
+    def size(self):
+        """Numero di campioni nello store."""
+        if self.writer is not None:
+            return self.writer.tell() // 2
+        try:
+            return os.path.getsize(self.path) // 2
+        except OSError:
+            return 0
+
+    def add(self, samples, frame_rate, channels):
+        """Aggiunge campioni interleaved a 16 bit, restituisce il loro StoredSegment."""
+        if self.writer is None:
+            self.writer = open(self.path, 'ab')
+        offset = self.writer.tell() // 2
+        self.writer.write(np.ascontiguousarray(samples, dtype='<i2').tobytes())
+        return StoredSegment(self, offset, len(samples) // channels, frame_rate, channels)
+
+    def read(self, offset, count):
+        """Restituisce count campioni da offset, una vista della mappa in memoria."""
+        if self.map is None or len(self.map) < offset + count:
+            if self.writer is not None:
+                self.writer.flush()
+            # La mappa viene riaperta solo quando sono stati aggiunti segmenti dopo di essa
+            self.map = np.memmap(self.path, dtype='<i2', mode='r') if self.size() else np.zeros(0, dtype='<i2')
+            if len(self.map) < offset + count:
+                raise ValueError(f"segmento oltre la fine di {os.path.basename(self.path)}")
+        return self.map[offset:offset + count]
+
+    def compact(self, segments):
+        """Riscrive lo store con i soli segmenti (offset, count), restituisce i loro nuovi offset."""
+        temp_file = f'{self.path}.{os.urandom(8).hex()}.tmp'
+        offsets = []
+        position = 0
+        with open(temp_file, 'wb') as file:
+            for offset, count in segments:
+                file.write(self.read(offset, count).tobytes())
+                offsets.append(position)
+                position += count
+        self.close()
+        os.replace(temp_file, self.path)
+        return offsets
+
+    def close(self):
+        """Chiude il file e la mappa, le viste gia' restituite tengono aperta la loro mappa."""
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        self.map = None
+
+class StoredSegment:
+    """Un segmento di un SegmentStore, usato dai mixer al posto del suo file."""
+
+    def __init__(self, store, offset, frames, rate, channels):
+        self.store = store
+        self.offset = offset
+        self.frames = frames
+        self.rate = rate
+        self.channels = channels
+
+    def samples(self):
+        """I campioni interleaved a 16 bit, letti dalla mappa in memoria senza copiarli."""
+        return self.store.read(self.offset, self.frames * self.channels)
+
+def wav_info(audio_file):
+    """Restituisce (frames, rate, channels) di un file WAV, letti dalla sua intestazione senza decodificare l'audio."""
+    with open(audio_file, 'rb') as file:
+        header = file.read(12)
+        if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+            raise ValueError(f"'{os.path.basename(audio_file)}' is not a WAV file")
+        rate = channels = block_align = None
+        while True:
+            chunk = file.read(8)
+            if len(chunk) < 8:
+                raise ValueError(f"'{os.path.basename(audio_file)}' has no audio data")
+            name, size = chunk[:4], struct.unpack('<I', chunk[4:])[0]
+            if name == b'fmt ':
+                fmt = file.read(size + size % 2)
+                channels, rate, _, block_align = struct.unpack('<HIIH', fmt[2:14])
+            elif name == b'data' and block_align:
+                # Un WAV scritto su una pipe lascia la dimensione al massimo, il resto del file e' l'audio
+                remaining = os.fstat(file.fileno()).st_size - file.tell()
+                return min(size, remaining) // block_align, rate, channels
+            else:
+                file.seek(size + size % 2, 1)
+
+def indexed_duration(audio_file, index=None):
+    """Durata in secondi di un segmento, dall'indice dei segmenti oppure dalla sua intestazione WAV."""
+    info = index.get(audio_file) if index else None
+    if info is None:
+        try:
+            info = wav_info(audio_file)
+        except (OSError, ValueError, struct.error):
+            # Non e' un file WAV, solo allora viene decodificato
+            return AudioSegment.from_file(audio_file).duration_seconds
+    frames, rate, _ = info
+    return frames / rate
+
+def file_size(path):
+    """Dimensione di un file in byte, None se non esiste (usata dagli span della traccia)."""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+def timeline_offset(start_time, sample_rate=24000):
+    """Campione della timeline in cui viene posizionato un segmento che inizia a start_time secondi."""
+    # Stesso arrotondamento del filtro adelay del mixer FFmpeg, che calcola il ritardo in precisione singola
+    delay_ms = int(start_time * 1000)
+    return int(np.float32(delay_ms) * np.float32(sample_rate) / np.float32(1000))
+
+def silence_end(start_time, duration, sample_rate=24000):
+    """Campione in cui finisce nella timeline una pausa di duration secondi, per essa non viene generato audio di silenzio.
+
+    Le pause non aggiungono nulla al mix, rendono solo la timeline piu' lunga. La lunghezza e' quella del
+    WAV di silenzio scritto prima: pydub lo creava a 11025 Hz e audioop.ratecv() trasformava i suoi N frame
+    in (N - 1) * 24000 // 11025 + 1 campioni.
+    """
+    frames = int(11025 * (duration * 1000 / 1000.0))
+    samples = (frames - 1) * sample_rate // 11025 + 1 if frames > 0 else 0
+    return timeline_offset(start_time, sample_rate) + samples
+
+def cue_windows(start, end, spoken, min_gap=0.1, tail=0.5):
+    """Restituisce i secondi per cui ogni sottotitolo puo' essere letto, fino a min_gap prima dell'inizio del successivo sottotitolo letto.
+
+    start e end sono gli array in millisecondi dei sottotitoli e spoken indica quelli con testo, cosi' le pause
+    e i sottotitoli vuoti dopo un sottotitolo sono liberi per lui. L'ultimo sottotitolo letto puo' durare tail secondi oltre la sua fine.
+    Una finestra non e' mai piu' corta del suo sottotitolo. Tutte le finestre vengono calcolate insieme, in tempo lineare.
+    """
+    start = np.asarray(start, dtype=np.int64)
+    end = np.asarray(end, dtype=np.int64)
+    spoken_index = np.flatnonzero(spoken)
+    if not len(spoken_index):
+        return (end - start) / 1000
+    # Posizione in spoken_index del successivo sottotitolo letto dopo ogni sottotitolo
+    following = np.searchsorted(spoken_index, np.arange(len(start)), side='right')
+    next_start = start[spoken_index[np.minimum(following, len(spoken_index) - 1)]] - int(round(min_gap * 1000))
+    limit = np.where(following == len(spoken_index), end + int(round(tail * 1000)), next_start)
+    return (np.maximum(limit, end) - start) / 1000
+
+def schedule_report(speeds, delays):
+    """Riassume i tempi di una conversione, speeds sono i cambi di lunghezza dei segmenti (1.0 quando non
+    adattati) e delays i secondi di cui ogni segmento e' stato spostato dopo il suo sottotitolo."""
+    changes = np.abs(np.asarray(speeds, dtype=np.float64) - 1)
+    stretched = changes[changes > 1e-9]
+    delays = np.asarray(delays, dtype=np.float64)
+    delayed = delays[delays > 1e-9]
+    return {
+        'segments': len(changes),
+        'stretched': len(stretched),
+        'shortened': int(np.count_nonzero(np.asarray(speeds) < 1 - 1e-9)),
+        'lengthened': int(np.count_nonzero(np.asarray(speeds) > 1 + 1e-9)),
+        'mean_change': round(float(stretched.mean()), 4) if len(stretched) else 0.0,
+        'max_change': round(float(stretched.max()), 4) if len(stretched) else 0.0,
+        'delayed': len(delayed),
+        'max_delay': round(float(delayed.max()), 3) if len(delayed) else 0.0,
+    }
+
+def normalize_audio(audio_segment, target_dbfs=-20.0):
+    """Normalizza l'audio a un livello costante in dBFS."""
+    change_in_dbfs = target_dbfs - audio_segment.dBFS
+    return audio_segment.apply_gain(change_in_dbfs)
+
+def compress_audio(audio_segment):
+    """Applica compressione dinamica per ridurre variazioni di volume."""
+    return compress_dynamic_range(
+        audio_segment,
+        threshold=-24.0,
+        ratio=4.0,
+        attack=5.0,
+        release=50.0
+    )
+
+def loudnorm_audio(input_file, output_file, cancel_event=None):
+    """Applica loudnorm con FFmpeg per normalizzazione avanzata, cancel_event lo ferma come run_subprocess()."""
+    with tracing.span('loudnorm', engine='ffmpeg'):
+        log(f"Applying loudnorm: {input_file} -> {output_file}")
+        # Primo passaggio: analisi
+        ffmpeg_cmd = [
+            get_ffmpeg_path(), '-i', input_file,
+            '-af', 'loudnorm=I=-23:TP=-1.5:LRA=11:print_format=json',
+            '-f', 'null', '-'
+        ]
+        try:
+            result = run_subprocess(ffmpeg_cmd, capture_output=True, text=True, check=True, cancel_event=cancel_event)
+            stats_output = result.stderr
+            json_start = stats_output.find('{')
+            json_end = stats_output.rfind('}') + 1
+            if json_start == -1 or json_end == -1:
+                raise ValueError("Impossibile trovare output JSON da loudnorm")
+            stats = json.loads(stats_output[json_start:json_end])
+            measured_I = float(stats['input_i'])
+            measured_TP = float(stats['input_tp'])
+            measured_LRA = float(stats['input_lra'])
+            measured_thresh = float(stats['input_thresh'])
+            # Secondo passaggio: normalizzazione
+            ffmpeg_cmd = [
+                get_ffmpeg_path(), '-i', input_file,
+                '-af', f'loudnorm=I=-23:TP=-1.5:LRA=11:measured_I={measured_I}:measured_TP={measured_TP}:measured_LRA={measured_LRA}:measured_thresh={measured_thresh}:linear=true',
+                '-ar', '24000', '-ac', '1', output_file, '-y'
+            ]
+            run_subprocess(ffmpeg_cmd, capture_output=True, text=True, check=True, cancel_event=cancel_event)
+            log(f"Applied loudnorm to {output_file}")
+        except PipelineCancelled:
+            raise
+        except Exception as e:
+            log(f"Error applying loudnorm: {e}. Falling back to pydub normalization.")
+            audio_segment = AudioSegment.from_file(input_file)
+            compressed_segment = compress_audio(audio_segment)
+            normalized_segment = normalize_audio(compressed_segment, target_dbfs=-20.0)
+            normalized_segment.export(output_file, format="wav")
+
+def loudnorm_samples(samples, sample_rate=24000, channels=1):
+    """Versione in memoria di loudnorm_audio: misura i campioni una volta e applica un solo guadagno."""
+    with tracing.span('loudnorm', engine='numpy', samples=len(samples)):
+        stats = measure_loudness(samples, sample_rate, channels)
+        return samples * 10 ** (loudnorm_gain(stats) / 20)
+
+def loudnorm_gain(stats):
+    """Guadagno in dB che porta l'audio misurato agli obiettivi di loudnorm (-23 LUFS, -1.5 dBTP)."""
+    gain = normalization_gain(stats, target_i=-23.0, target_tp=-1.5)
+    log(f"Loudness: {stats['integrated']:.2f} LUFS, true peak {stats['true_peak']:.2f} dBTP, "
+        f"LRA {stats['lra']:.2f} LU, gain {gain:.2f} dB")
+    return gain
+
+def read_wav_samples(input_file, sample_rate=24000):
+    """Legge un file audio come campioni float32 mono in [-1, 1] a sample_rate."""
+    try:
+        with wave.open(input_file, 'rb') as wav:
+            channels = wav.getnchannels()
+            sample_width = wav.getsampwidth()
+            rate = wav.getframerate()
+            data = wav.readframes(wav.getnframes())
+        if sample_width == 1:
+            samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128) / 128
+        elif sample_width == 2:
+            samples = np.frombuffer(data, dtype='<i2').astype(np.float32) / 32768
+        elif sample_width == 4:
+            samples = np.frombuffer(data, dtype='<i4').astype(np.float32) / 2147483648
+        else:
+            raise wave.Error(f"unsupported sample width {sample_width}")
+    except (wave.Error, EOFError):
+        # I formati non supportati dal modulo wave (ad es. WAV float) vengono decodificati da pydub
+        audio = AudioSegment.from_file(input_file).set_sample_width(2)
+        channels = audio.channels
+        rate = audio.frame_rate
+        samples = np.frombuffer(audio.raw_data, dtype='<i2').astype(np.float32) / 32768
+    return mono_samples(samples, rate, channels, sample_rate)
+
+def mono_samples(samples, rate, channels, sample_rate=24000):
+    """Converte in mono campioni float interleaved e li ricampiona a sample_rate."""
+    if channels > 1:
+        samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels).mean(axis=1)
+    return resample_audio(samples, rate, sample_rate)
+
+def segment_samples(segment, sample_rate=24000):
+    """Legge un segmento del mix, un file o uno StoredSegment, come campioni float32 mono a sample_rate."""
+    if isinstance(segment, StoredSegment):
+        samples = segment.samples().astype(np.float32) / 32768
+        return mono_samples(samples, segment.rate, segment.channels, sample_rate)
+    return read_wav_samples(segment, sample_rate)
+
+def fft_length(length, multiple):
+    """Il piu' piccolo multiplo di multiple >= length con solo 2, 3, 5 e 7 come fattori, le dimensioni con cui la FFT e' veloce.
+
+    Restituisce length quando multiple ha un fattore piu' grande.
+    """
+    def smooth(value):
+        for factor in (2, 3, 5, 7):
+            while value % factor == 0:
+                value //= factor
+        return value == 1
+
+    if not smooth(multiple):
+        return length
+    count = -(-length // multiple)
+    while not smooth(count):
+        count += 1
+    return count * multiple
+
+def resample_audio(samples, from_rate, to_rate):
+    """Ricampiona campioni mono con un ricampionatore FFT a banda limitata."""
+    if from_rate == to_rate or len(samples) == 0:
+        return samples
+    new_length = int(round(len(samples) * to_rate / from_rate))
+    # I campioni vengono completati con silenzio fino a una lunghezza con cui la FFT e' veloce (una lunghezza prima e' 10-20 volte piu' lenta)
+    padded_length = fft_length(len(samples), from_rate // math.gcd(from_rate, to_rate))
+    output_length = new_length
+    if padded_length != len(samples):
+        samples = np.concatenate([samples, np.zeros(padded_length - len(samples), dtype=samples.dtype)])
+        output_length = padded_length * to_rate // from_rate
+    spectrum = np.fft.rfft(samples)
+    bins = output_length // 2 + 1
+    if bins <= len(spectrum):
+        spectrum = spectrum[:bins]
+    else:
+        spectrum = np.concatenate([spectrum, np.zeros(bins - len(spectrum), dtype=spectrum.dtype)])
+    return (np.fft.irfft(spectrum, output_length) * (output_length / len(samples)))[:new_length].astype(np.float32)
+
+def read_pcm16(input_file):
+    """Legge un file audio come campioni interlacciati a 16 bit, restituisce (samples, frame_rate, channels)."""
+    try:
+        with wave.open(input_file, 'rb') as wav:
+            if wav.getsampwidth() != 2:
+                raise wave.Error("not a 16 bit WAV")
+            channels = wav.getnchannels()
+            frame_rate = wav.getframerate()
+            data = wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError):
+        audio = AudioSegment.from_file(input_file).set_sample_width(2)
+        channels = audio.channels
+        frame_rate = audio.frame_rate
+        data = audio.raw_data
+    samples = np.frombuffer(data[:len(data) - len(data) % (2 * channels)], dtype='<i2')
+    return samples, frame_rate, channels
+
+def write_pcm16(samples, output_file, frame_rate=24000, channels=1):
+    """Scrive campioni interlacciati a 16 bit come file WAV."""
+    with wave.open(output_file, 'wb') as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(frame_rate)
+        wav.writeframes(samples.astype('<i2').tobytes())
+
+def normalize_pcm16(samples, target_dbfs=-20.0):
+    """Stesso risultato di normalize_audio su campioni a 16 bit, senza creare un AudioSegment."""
+    if len(samples) == 0:
+        return samples
+    # pydub tronca l'RMS a un intero e audioop.mul arrotonda verso meno infinito
+    rms = int(np.sqrt(np.dot(samples.astype(np.int64), samples.astype(np.int64)) / len(samples)))
+    if rms == 0:
+        return samples
+    dbfs = 20 * math.log(rms / 32768, 10)
+    factor = 10 ** ((target_dbfs - dbfs) / 20)
+    scaled = samples.astype(np.float64) * factor
+    scaled = np.where(scaled > 32767, 32767, np.where(scaled < -32767, -32768, np.floor(scaled)))
+    return scaled.astype('<i2')
+
+def wsola_stretch(samples, atempo, frame_length=WSOLA_FRAME, tolerance=WSOLA_TOLERANCE):
+    """Cambia il tempo di campioni float mono mantenendo l'intonazione (WSOLA), restituisce round(len / atempo) campioni.
+
+    L'uscita e' composta da frame con finestra di Hann sovrapposti al 50%. Ogni frame viene letto vicino al suo posto
+    nell'ingresso, spostato al massimo di tolerance campioni nella posizione che continua meglio il precedente.
+    """
+    if len(samples) == 0:
+        return np.zeros(0, dtype=np.float32)
+    hop = frame_length // 2
+    output_length = int(round(len(samples) / atempo))
+    frames = output_length // hop + 2
+    window = np.hanning(frame_length + 1)[:frame_length].astype(np.float32)
+    # Posizione in ingresso di ogni frame, il padding tiene ogni lettura e ricerca dentro il buffer
+    positions = np.round(np.arange(frames) * hop * atempo).astype(np.int64)
+    padded = np.concatenate([
+        np.zeros(hop + tolerance, dtype=np.float32), samples.astype(np.float32),
+        np.zeros(int(positions[-1]) + frame_length + 2 * tolerance + hop, dtype=np.float32)
+    ])
+    output = np.zeros((frames + 1) * hop + frame_length, dtype=np.float32)
+    weights = np.zeros_like(output)
+    delta = 0
+    for k in range(frames):
+        position = int(positions[k]) + tolerance + delta
+        start = k * hop
+        output[start:start + frame_length] += padded[position:position + frame_length] * window
+        weights[start:start + frame_length] += window
+        if k + 1 < frames:
+            natural = padded[position + hop:position + hop + frame_length]
+            region = padded[positions[k + 1]:positions[k + 1] + frame_length + 2 * tolerance]
+            delta = int(np.argmax(np.correlate(region, natural, 'valid'))) - tolerance
+    output /= np.maximum(weights, 1e-3)
+    return output[hop:hop + output_length]
+
+def stretch_pcm16(samples, frame_rate, channels, atempo, engine=None):
+    """Cambia il tempo di campioni a 16 bit, restituisce campioni mono a 24000 Hz.
+
+    engine "ffmpeg" esegue atempo/rubberband in un processo FFmpeg, "wsola" adatta i campioni in memoria
+    con wsola_stretch(), None usa stretch_engine.
+    """
+    if (engine or stretch_engine).lower() == "wsola":
+        mono = samples.reshape(-1, channels).mean(axis=1) / 32768 if channels > 1 else samples / 32768
+        stretched = wsola_stretch(resample_audio(mono.astype(np.float32), frame_rate, 24000), atempo)
+        return np.clip(np.rint(stretched * 32768), -32768, 32767).astype('<i2')
+    ffmpeg_cmd = [
+        get_ffmpeg_path(), '-f', 's16le', '-ar', str(frame_rate), '-ac', str(channels), '-i', 'pipe:0',
+        '-filter:a', f'atempo={atempo},rubberband=pitch=1.0,volume=1.0',
+        '-ar', '24000', '-ac', '1', '-f', 's16le', 'pipe:1'
+    ]
+    result = run_subprocess(ffmpeg_cmd, capture_output=True, text=False, check=True, input=samples.astype('<i2').tobytes())
+    data = result.stdout
+    return np.frombuffer(data[:len(data) - len(data) % 2], dtype='<i2')
+
+def write_wav_samples(samples, output_file, sample_rate=24000):
+    """Scrive campioni float mono come file WAV PCM a 16 bit."""
+    pcm = np.clip(np.rint(samples * 32768), -32768, 32767).astype('<i2')
+    with wave.open(output_file, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm.tobytes())
+
+def compare_wav_files(file_a, file_b, sample_rate=24000):
+    """Restituisce la differenza di picco e RMS in dBFS tra due file audio (utile per confrontare i mixer)."""
+    a = read_wav_samples(file_a, sample_rate)
+    b = read_wav_samples(file_b, sample_rate)
+    length = max(len(a), len(b))
+    diff = np.zeros(length, dtype=np.float64)
+    diff[:len(a)] += a
+    diff[:len(b)] -= b
+    if length == 0 or not diff.any():
+        return float('-inf'), float('-inf')
+    peak = 20 * np.log10(np.max(np.abs(diff)))
+    rms = 10 * np.log10(np.mean(diff ** 2))
+    return peak, rms
+
+def mix_timeline_numpy(audio_files, output_file=None, sample_rate=24000, volume=0.25, length=0):
+    """Posiziona ogni segmento (file, inizio, fine) al suo offset in campioni in un unico buffer e lo scrive una volta.
+
+    Un segmento puo' anche essere uno StoredSegment invece di un file.
+    length e' il numero minimo di campioni della timeline (la fine della sua ultima pausa).
+    Restituisce i campioni mixati, con output_file None li restituisce soltanto.
+    """
+    segments = []
+    for audio_file, start_time, _ in audio_files:
+        offset = timeline_offset(start_time, sample_rate)
+        samples = segment_samples(audio_file, sample_rate)
+        segments.append((offset, samples))
+        length = max(length, offset + len(samples))
+    timeline = np.zeros(length, dtype=np.float32)
+    for offset, samples in segments:
+        timeline[offset:offset + len(samples)] += samples
+    timeline *= volume
+    if output_file is not None:
+        write_wav_samples(timeline, output_file, sample_rate)
+    log(f"Timeline mixed in memory: {len(audio_files)} segments, {length / sample_rate:.2f}s")
+    return timeline
+
+def mix_timeline_ffmpeg(audio_files, output_file, work_dir, length=0, index=None):
+    """Mixa i segmenti (file, start, end) con batch di filtri FFmpeg adelay/amix.
+
+    L'output viene completato con silenzio fino ad almeno length campioni (la fine dell'ultima pausa).
+    index associa ai file dei segmenti i loro (frames, rate, channels), vedi indexed_duration().
+    FFmpeg legge dei file, gli StoredSegment vengono scritti in file WAV in work_dir mentre vengono mixati.
+    """
+    if not audio_files:
+        write_wav_samples(np.zeros(length, dtype=np.float32), output_file)
+        return
+    exported = []
+    try:
+        segments = []
+        for n, (audio_file, start_time, end_time) in enumerate(audio_files):
+            if isinstance(audio_file, StoredSegment):
+                stored_file = os.path.join(work_dir, f'stored_{n}.wav')
+                exported.append(stored_file)
+                write_pcm16(audio_file.samples(), stored_file, audio_file.rate, audio_file.channels)
+                audio_file = stored_file
+            segments.append((audio_file, start_time, end_time))
+        mix_files_ffmpeg(segments, output_file, work_dir, length, index)
+    finally:
+        for stored_file in exported:
+            try:
+                os.remove(stored_file)
+            except OSError:
+                pass
+
+def mix_files_ffmpeg(audio_files, output_file, work_dir, length=0, index=None):
+    """Mixa i segmenti (file, inizio, fine) di mix_timeline_ffmpeg, i file sono gli input dei batch FFmpeg."""
+    batch_files = []
+    batch_size = MAX_INPUTS
+    # Il riempimento va nel filtro dell'ultimo mix, che e' quello del batch quando ce n'e' uno solo
+    pad = f",apad=whole_len={length}" if length else ""
+    single_batch = len(audio_files) <= batch_size
+
+    for batch_idx in range(0, len(audio_files), batch_size):
+        batch = audio_files[batch_idx:batch_idx + batch_size]
+        batch_output = os.path.join(work_dir, f'batch_{batch_idx // batch_size}.wav')
+        filter_complex_parts = []
+        ffmpeg_cmd = [get_ffmpeg_path()]
+
+        for i, (audio_file, start_time, end_time) in enumerate(batch):
+            segment_duration = end_time - start_time
+            audio_file = audio_file.replace('\\', '/')
+            ffmpeg_cmd.extend(['-i', audio_file])
+            delay_ms = int(start_time * 1000)
+            filter_complex_parts.append(f"[{i}:a]adelay={delay_ms}|{delay_ms}[a{i}];")
+            log(f"Batch {batch_idx // batch_size}, Input {i}: {audio_file}, start_time: {start_time}s, end_time: {end_time}s, duration: {segment_duration}s")
+
+        weights = ' '.join(['1'] * len(batch))
+        filter_complex = "".join(filter_complex_parts)
+        filter_complex += "".join(f"[a{i}]" for i in range(len(batch))) + f"amix=inputs={len(batch)}:duration=longest:dropout_transition=0:weights={weights}:normalize=0,volume=0.25{pad if single_batch else ''}[outa]"
+        ffmpeg_cmd.extend(['-filter_complex', filter_complex, '-map', '[outa]', '-ac', '1', '-ar', '24000', batch_output, '-y'])
+
+        log(f"Batch {batch_idx // batch_size} filter complex: {filter_complex}")
+        log(f"Batch {batch_idx // batch_size} FFmpeg command: {' '.join(ffmpeg_cmd)}")
+
+        run_subprocess(ffmpeg_cmd, capture_output=True, text=True, check=True)
+        if use_dynaudnorm_for_batches:
+            # Verifica che il file batch esista
+            if not os.path.exists(batch_output):
+                raise FileNotFoundError(f"Batch file {batch_output} not found after creation.")
+            # Applica dynaudnorm al batch
+            temp_batch = os.path.join(work_dir, f'temp_batch_{batch_idx // batch_size}.wav')
+            ffmpeg_cmd = [
+                get_ffmpeg_path(), '-i', batch_output,
+                '-filter:a', 'dynaudnorm', '-ar', '24000', '-ac', '1',
+                temp_batch, '-y'
+            ]
+            run_subprocess(ffmpeg_cmd, capture_output=True, text=True, check=True)
+            shutil.move(temp_batch, batch_output)
+            log(f"Batch {batch_idx // batch_size} normalized with dynaudnorm: {batch_output}")
+        batch_files.append(batch_output)
+        log(f"Batch {batch_idx // batch_size} generated: {batch_output}")
+
+    if len(batch_files) == 1:
+        ffmpeg_cmd = [get_ffmpeg_path(), '-i', batch_files[0], '-c:a', 'copy', output_file, '-y']
+        run_subprocess(ffmpeg_cmd, capture_output=True, text=True, check=True)
+        return
+
+    filter_complex_parts = []
+    ffmpeg_cmd = [get_ffmpeg_path()]
+    for i, batch_file in enumerate(batch_files):
+        batch_file = batch_file.replace('\\', '/')
+        ffmpeg_cmd.extend(['-i', batch_file])
+        filter_complex_parts.append(f"[{i}:a]adelay=0|0[a{i}];")
+    weights = ' '.join(['1'] * len(batch_files))
+    filter_complex = "".join(filter_complex_parts)
+    filter_complex += "".join(f"[a{i}]" for i in range(len(batch_files))) + f"amix=inputs={len(batch_files)}:duration=longest:dropout_transition=0:weights={weights}:normalize=0,volume=0.25{pad}[outa]"
+
+    total_duration = max(max(end_time for _, _, end_time in audio_files), length / 24000)
+    max_segment_duration = max(indexed_duration(af, index) for af, _, _ in audio_files)
+    total_duration = max(total_duration, total_duration + max_segment_duration)
+    total_duration = int(total_duration) + 1
+
+    ffmpeg_cmd.extend(['-filter_complex', filter_complex, '-map', '[outa]', '-ac', '1', '-ar', '24000', '-t', str(total_duration), output_file, '-y'])
+
+    log(f"Final filter complex: {filter_complex}")
+    log(f"Number of batch files: {len(batch_files)}")
+    log(f"Total duration: {total_duration}s")
+    log(f"Final FFmpeg command: {' '.join(ffmpeg_cmd)}")
+
+    run_subprocess(ffmpeg_cmd, capture_output=True, text=True, check=True)
+
+def mix_timeline(audio_files, output_file, work_dir, length=0, index=None):
+    """Mixa i segmenti (file o StoredSegment, inizio, fine) in output_file con il motore scelto in mixer_engine."""
+    with tracing.span('mix', engine=mixer_engine, segments=len(audio_files)):
+        if mixer_engine.lower() == "ffmpeg":
+            mix_timeline_ffmpeg(audio_files, output_file, work_dir, length, index)
+        else:
+            mix_timeline_numpy(audio_files, output_file, length=length)
+
+def mix_timeline_samples(audio_files, work_dir, length=0, index=None):
+    """Mixa i segmenti (file, inizio, fine) e restituisce i campioni a 24000 Hz invece di un file."""
+    with tracing.span('mix', engine=mixer_engine, segments=len(audio_files)):
+        if mixer_engine.lower() == "ffmpeg":
+            mixed_file = os.path.join(work_dir, 'timeline.wav')
+            mix_timeline_ffmpeg(audio_files, mixed_file, work_dir, length, index)
+            return read_wav_samples(mixed_file)
+        return mix_timeline_numpy(audio_files, length=length)
+
+def validate_srt(subs):
+    error = subs.first_error()
+    if error is not None:
+        log(error)
+        return False
+    return True
+
+class PipelineError(Exception):
+    """Errore che interrompe una fase, il messaggio e' destinato all'utente."""
+
+class PipelineCancelled(PipelineError):
+    """Sollevata quando l'utente annulla una fase."""
+
+    def __init__(self, message="Operazione annullata."):
+        super().__init__(message)
+
+def check_cancelled(cancel_event):
+    """Solleva PipelineCancelled se cancel_event (un threading.Event) e' impostato."""
+    if cancel_event is not None and cancel_event.is_set():
+        raise PipelineCancelled()
+
+def load_dictionary(dictionary_file, whole_words=False, ignore_case=False):
+    """Carica e compila un file dizionario parola=pronuncia, vuoto se non c'e' il file."""
+    with tracing.span('dictionary'):
+        if not dictionary_file or not os.path.exists(dictionary_file):
+            return Dictionary({})
+        try:
+            dictionary = Dictionary.load(dictionary_file, whole_words, ignore_case,
+                                         cache_dir=dictionary_cache_dir if use_dictionary_cache else None)
+        except Exception as e:
+            raise PipelineError(f"Errore nella lettura del file dizionario: {str(e)}")
+        log(f"Dictionary loaded: {len(dictionary)} words")
+        return dictionary
+
+def get_pyttsx3_engine():
+    """Restituisce un nuovo motore pyttsx3 per il thread chiamante, importato solo quando si usa il TTS offline.
+
+    pyttsx3.init() restituirebbe il motore gia' creato da qualsiasi altro thread, gli oggetti SAPI e NSSpeechSynthesizer
+    devono essere usati solo dal thread che li ha creati.
+    """
+    import pyttsx3
+    return pyttsx3.Engine()
+
+def pool_workers(configured, jobs):
+    """Numero di processi worker per jobs lavori, configured 0 significa uno per ogni core della CPU."""
+    workers = configured or os.cpu_count() or 1
+    if platform.system() == "Windows":
+        workers = min(workers, 61)  # Limite di ProcessPoolExecutor su Windows
+    return max(1, min(workers, jobs))
+
+_pyttsx3_worker = None  # (voice, rate, engine) di un processo worker pyttsx3, creato dal suo primo lavoro
+
+def worker_pyttsx3_engine(voice_id, rate, engine_factory=None):
+    """Restituisce il motore di questo processo worker, creato una volta e riusato."""
+    global _pyttsx3_worker
+    if _pyttsx3_worker is None:
+        _pyttsx3_worker = (None, None, (engine_factory or get_pyttsx3_engine)())
+    worker_voice, worker_rate, engine = _pyttsx3_worker
+    if (worker_voice, worker_rate) != (voice_id, rate):
+        engine.setProperty('voice', voice_id)
+        engine.setProperty('rate', rate)
+        _pyttsx3_worker = (voice_id, rate, engine)
+    return engine
+
+def queue_pyttsx3(engine, text, output_file, cue_rate, rate):
+    """Accoda un sottotitolo sul motore a cue_rate, restituisce la velocita' a cui resta il motore.
+
+    setProperty viene accodato da pyttsx3 come save_to_file, cosi' i sottotitoli di un runAndWait mantengono la loro velocita'.
+    """
+    if cue_rate != rate:
+        engine.setProperty('rate', cue_rate)
+    engine.save_to_file(text, output_file)
+    return cue_rate
+
+def synthesize_pyttsx3(i, text, output_file, voice_id, rate, engine=None, engine_factory=None, cue_rate=None):
+    """Genera un sottotitolo con pyttsx3, in un processo worker il motore viene creato una volta e riusato.
+
+    rate e' la velocita' normale del motore, cue_rate la velocita' di questo sottotitolo (None per quella normale).
+    """
+    if engine is None:
+        engine = worker_pyttsx3_engine(voice_id, rate, engine_factory)
+    cue_rate = rate if cue_rate is None else cue_rate
+    with tracing.span('tts', 'cue', cue=i, engine='pyttsx3', chars=len(text)) as span:
+        if queue_pyttsx3(engine, text, output_file, cue_rate, rate) != rate:
+            engine.setProperty('rate', rate)
+        engine.runAndWait()
+        if tracing.enabled():
+            span.set(bytes=file_size(output_file))
+
+def synthesize_pyttsx3_chunk(jobs, voice_id, rate, engine=None, engine_factory=None):
+    """Genera i lavori (i, text, output_file, cue_rate) con un solo runAndWait, restituisce i loro errori come generate_pyttsx3_batch.
+
+    Il ciclo di eventi del motore viene avviato una volta per tutto il blocco. Se fallisce, o un sottotitolo non ha audio,
+    quei sottotitoli vengono generati di nuovo uno alla volta cosi' l'errore viene segnalato solo per il sottotitolo che lo ha causato.
+    """
+    if engine is None:
+        engine = worker_pyttsx3_engine(voice_id, rate, engine_factory)
+    if len(jobs) == 1:
+        retry = list(range(len(jobs)))
+    else:
+        for _, _, output_file, _ in jobs:
+            # Un file lasciato da un'esecuzione interrotta nasconderebbe un sottotitolo non generato
+            if os.path.exists(output_file):
+                os.remove(output_file)
+        with tracing.span('tts_chunk', engine='pyttsx3', cues=len(jobs), first=jobs[0][0]) as span:
+            try:
+                current_rate = rate
+                for _, text, output_file, cue_rate in jobs:
+                    current_rate = queue_pyttsx3(engine, text, output_file, cue_rate, current_rate)
+                if current_rate != rate:
+                    engine.setProperty('rate', rate)
+                engine.runAndWait()
+                retry = [index for index, (_, _, output_file, _) in enumerate(jobs) if not file_size(output_file)]
+            except Exception as e:
+                log(f"pyttsx3 chunk starting at segment {jobs[0][0]} failed, retrying its cues one at a time: {str(e)}")
+                span.set(error=type(e).__name__)
+                retry = list(range(len(jobs)))
+            span.set(retried=len(retry))
+    errors = [None] * len(jobs)
+    for index in retry:
+        i, text, output_file, cue_rate = jobs[index]
+        try:
+            synthesize_pyttsx3(i, text, output_file, voice_id, rate, engine=engine, cue_rate=cue_rate)
+        except Exception as e:
+            errors[index] = e
+    return errors
+
+def pyttsx3_chunks(jobs, workers):
+    """Divide i lavori in blocchi di al massimo pyttsx3_chunk_size sottotitoli, almeno un blocco per ogni worker."""
+    size = max(1, min(pyttsx3_chunk_size, -(-len(jobs) // workers)))
+    return [jobs[start:start + size] for start in range(0, len(jobs), size)]
+
+def generate_pyttsx3_batch(jobs, voice_id, rate, engine=None, engine_factory=None, on_done=None, cancel_event=None):
+    """Genera i lavori (i, text, output_file, cue_rate) con pyttsx3 su un pool di processi, ognuno con il proprio motore.
+
+    Restituisce una lista nello stesso ordine di jobs con None per ogni successo o l'eccezione sollevata.
+    rate e' la velocita' normale dei motori, cue_rate la velocita' di ogni sottotitolo.
+    I lavori vengono inviati in blocchi di pyttsx3_chunk_size sottotitoli, ognuno generato con un solo runAndWait.
+    Con un solo worker i lavori girano qui con engine. engine_factory() crea il motore di ogni worker
+    (predefinito get_pyttsx3_engine), deve essere una funzione o classe di modulo per poter essere serializzata con pickle.
+    on_done() viene chiamata dopo ogni lavoro, i lavori non avviati dopo che cancel_event e' impostato restituiscono PipelineCancelled.
+    """
+    errors = []
+    workers = pool_workers(pyttsx3_workers, len(jobs))
+    chunks = pyttsx3_chunks(jobs, workers)
+    if workers == 1:
+        for chunk in chunks:
+            if cancel_event is not None and cancel_event.is_set():
+                errors.extend(PipelineCancelled() for _ in chunk)
+                continue
+            errors.extend(synthesize_pyttsx3_chunk(chunk, voice_id, rate, engine=engine, engine_factory=engine_factory))
+            if on_done is not None:
+                for _ in chunk:
+                    on_done()
+        return errors
+
+    log(f"Generating {len(jobs)} pyttsx3 segments in {len(chunks)} chunks with {workers} processes")
+    traced = tracing.enabled()
+    task = (tracing.call_traced, synthesize_pyttsx3_chunk) if traced else (synthesize_pyttsx3_chunk,)
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = {executor.submit(*task, chunk, voice_id, rate, None, engine_factory): chunk for chunk in chunks}
+        for future in as_completed(futures):
+            if on_done is not None:
+                for _ in futures[future]:
+                    on_done()
+            if cancel_event is not None and cancel_event.is_set():
+                # I blocchi in sintesi vengono completati, quelli in coda vengono scartati
+                for pending in futures:
+                    pending.cancel()
+                break
+        # I risultati vengono raccolti nell'ordine dei lavori, aspettando i blocchi ancora in corso
+        for future, chunk in futures.items():
+            if future.cancelled():
+                errors.extend(PipelineCancelled() for _ in chunk)
+                continue
+            try:
+                result = future.result()
+                if traced:
+                    tracing.add_events(result[1], result[2])
+                    result = result[0]
+                errors.extend(result)
+            except Exception as e:
+                # E' fallito il processo worker stesso (es. non e' stato possibile creare il motore)
+                errors.extend(e for _ in chunk)
+    finally:
+        executor.shutdown(wait=True)
+    return errors
+
+def process_segment(i, output_audio, duration, adjusted_file, auto_adjust, slowdown_threshold, speedup_threshold,
+                    stretch=None, factor=1.0, tolerance=0, schedule=False, to_store=False):
+    """Regola la velocita' di un segmento TTS e lo normalizza, viene eseguita in un processo separato.
+
+    Il file TTS viene decodificato una sola volta, i campioni passano in FFmpeg tramite pipe e viene scritto solo il risultato
+    in adjusted_file (o di nuovo in output_audio quando la velocita' non cambia). stretch e' il motore di
+    stretch_pcm16(), viene passato esplicitamente perche' i processi worker non vedono una configurazione modificata.
+    factor e' la velocita' a cui e' stato sintetizzato il sottotitolo (relativa a quella normale), le soglie limitano il
+    lunghezza del risultato rispetto alla sua lunghezza alla velocita' normale. Un segmento entro tolerance (ad es. 0.05)
+    dal suo obiettivo non viene adattato. Con schedule duration e' la finestra data da cue_windows(), il segmento
+    viene solo accorciato quando non ci sta.
+    Restituisce (audio_file, too_short, info, speed), too_short e' True quando il segmento e' stato lasciato invariato,
+    info sono i (frames, rate, channels) di audio_file per l'indice dei segmenti, None se non e' stato possibile leggerlo,
+    e speed e' la lunghezza del risultato divisa per la lunghezza dell'audio TTS (1.0 quando non e' adattato).
+    Con to_store non viene scritto nulla e audio_file e' sostituito dai campioni, il chiamante li aggiunge al
+    SegmentStore del lavoro. Quando non e' stato possibile leggere il file TTS viene restituito come audio_file in entrambi i casi.
+    """
+    with tracing.span('segment', 'cue', cue=i) as span:
+        try:
+            samples, frame_rate, channels = read_pcm16(output_audio)
+        except Exception as e:
+            log(f"Error reading segment {i}: {e}. Using original audio.")
+            return output_audio, False, None, 1.0
+
+        audio_file = output_audio
+        applied_speed = 1.0
+        if auto_adjust:
+            try:
+                audio_duration = len(samples) / channels / frame_rate
+                log(f"Segment {i} audio duration: {audio_duration}s")
+
+                min_duration = 0.1
+                if audio_duration < min_duration or duration <= 0:
+                    log(f"Skipping speed adjustment for segment {i} due to invalid duration")
+                    return (samples if to_store else output_audio), True, (len(samples) // channels, frame_rate, channels), 1.0
+
+                max_duration = duration if schedule else duration + 0.5
+                speed = max_duration / audio_duration if audio_duration > 0 else 1
+                if schedule:
+                    # La finestra e' un limite, non una lunghezza da riempire
+                    speed = min(speed, 1.0)
+                log(f"Segment {i} initial speed: {speed}")
+
+                if speedup_threshold is not None and speed / factor > (1 + speedup_threshold):
+                    speed = (1 + speedup_threshold) * factor
+                    log(f"Applied speedup threshold for segment {i}: speed adjusted to {speed}")
+                if slowdown_threshold is not None and speed / factor < (1 - slowdown_threshold):
+                    speed = (1 - slowdown_threshold) * factor
+                    log(f"Applied slowdown threshold for segment {i}: speed adjusted to {speed}")
+
+                target_duration = audio_duration * speed
+                log(f"Segment {i} target duration: {target_duration}s")
+                if target_duration < 0.5:
+                    speed = audio_duration / 0.5
+                    target_duration = 0.5
+                    log(f"Adjusted speed for segment {i} to ensure minimum duration of 0.5s")
+
+                span.set(speed=round(speed, 3))
+                if tolerance and abs(speed - 1) <= tolerance:
+                    # Sintetizzato alla velocita' giusta, il segmento entra gia' nella sua durata
+                    log(f"Segment {i} fits its duration, speed adjustment skipped")
+                else:
+                    with tracing.span('tempo', cue=i):
+                        samples = stretch_pcm16(samples, frame_rate, channels, 1 / speed, stretch)
+                    frame_rate, channels = 24000, 1
+                    audio_file = adjusted_file
+                    applied_speed = speed
+                    log(f"Segment {i} adjusted duration: {len(samples) / frame_rate}s")
+            except Exception as e:
+                log(f"Error adjusting speed for segment {i}: {e}. Using original audio.")
+
+        # Normalizza il segmento audio
+        try:
+            with tracing.span('normalize', cue=i):
+                samples = normalize_pcm16(samples, target_dbfs=-20.0)
+            log(f"Segment {i} normalized to -20 dBFS")
+        except Exception as e:
+            log(f"Error normalizing segment {i}: {e}. Using unnormalized audio.")
+        if to_store:
+            audio_file = samples
+        else:
+            write_pcm16(samples, audio_file, frame_rate, channels)
+        span.set(bytes=len(samples) * 2)
+        return audio_file, False, (len(samples) // channels, frame_rate, channels), applied_speed
+
+def process_segments(jobs, auto_adjust, slowdown_threshold, speedup_threshold, progress=None, cancel_event=None,
+                     stretch=None, tolerance=0, schedule=False, store=None):
+    """Esegue process_segment sui lavori (i, output_audio, duration, adjusted_file, factor) con un pool di processi.
+
+    Restituisce {i: (audio_file, too_short, info, speed)}. Ogni lavoro scrive solo i propri file, quindi il risultato non
+    dipende dal numero di processi ne' dall'ordine in cui terminano. Con un SegmentStore i processi restituiscono
+    i campioni invece di scriverli (vedi process_segment), ogni segmento viene aggiunto allo store appena
+    arriva e audio_file e' il suo StoredSegment, o il file TTS quando non e' stato possibile leggerlo.
+    """
+    if progress is None:
+        progress = lambda stage, done, total: None
+    workers = pool_workers(segment_workers, len(jobs))
+    to_store = store is not None
+    results = {}
+
+    def add_result(i, result):
+        samples, too_short, info, speed = result
+        if to_store and isinstance(samples, np.ndarray):
+            result = store.add(samples, info[1], info[2]), too_short, info, speed
+        results[i] = result
+        progress("segments", len(results), len(jobs))
+
+    progress("segments", 0, len(jobs))
+    if workers == 1:
+        for i, output_audio, duration, adjusted_file, factor in jobs:
+            check_cancelled(cancel_event)
+            add_result(i, process_segment(i, output_audio, duration, adjusted_file, auto_adjust, slowdown_threshold,
+                                          speedup_threshold, stretch, factor, tolerance, schedule, to_store))
+        return results
+
+    log(f"Processing {len(jobs)} segments with {workers} processes")
+    # Con la traccia attiva i worker rimandano i loro span insieme al risultato
+    traced = tracing.enabled()
+    task = (tracing.call_traced, process_segment) if traced else (process_segment,)
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = {
+            executor.submit(*task, i, output_audio, duration, adjusted_file, auto_adjust, slowdown_threshold,
+                            speedup_threshold, stretch, factor, tolerance, schedule, to_store): i
+            for i, output_audio, duration, adjusted_file, factor in jobs
+        }
+        for future in as_completed(futures):
+            result = future.result()
+            if traced:
+                result, events, threads = result
+                tracing.add_events(events, threads)
+            add_result(futures[future], result)
+            if cancel_event is not None and cancel_event.is_set():
+                # I segmenti in elaborazione vengono completati, quelli in coda vengono scartati
+                for pending in futures:
+                    pending.cancel()
+                raise PipelineCancelled()
+    finally:
+        executor.shutdown(wait=True)
+    return results
+
+def save_trace(tracer, name):
+    """Salva la traccia di una fase in traces_dir come JSON Chrome/Perfetto e come tabella riassuntiva."""
+    base = os.path.join(traces_dir, f"{name}_{time.strftime('%Y%m%d_%H%M%S')}")
+    try:
+        os.makedirs(traces_dir, exist_ok=True)
+        tracer.save(base + '.json')
+        with open(base + '.txt', 'w', encoding='utf-8') as file:
+            file.write(tracer.summary_table() + '\n')
+        log(f"Trace saved: {base}.json")
+    except OSError as e:
+        log(f"Warning: Could not save the trace {base}.json: {e}")
+
+def traced_phase(name):
+    """Decoratore che registra una fase in uno span. Con trace "on" una fase chiamata da sola salva la sua traccia."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            # Un chiamante che sta gia' registrando (es. la riga di comando con --trace) tiene gli span nella sua traccia
+            tracer = tracing.start() if trace.lower() == "on" and not tracing.enabled() else None
+            try:
+                with tracing.span(name, 'phase'):
+                    return function(*args, **kwargs)
+            finally:
+                if tracer is not None:
+                    tracing.stop()
+                    save_trace(tracer, name)
+        return wrapper
+    return decorator
+
+@traced_phase('phase1')
+def convert_srt(srt_file, voice_id, use_edge_tts=False, dictionary_file=None, auto_adjust=True,
+                slowdown_threshold=0.3, speedup_threshold=0.5, output_wav=None, output_mp3=None, engine=None,
+                progress=None, cancel_event=None, dictionary_whole_words=False, dictionary_ignore_case=False,
+                engine_factory=None, stretch=None, schedule=None, use_speech_model=None, work_dir=None,
+                notify=None):
+    """Fase I: genera l'audio doppiato di un file SRT e restituisce il percorso del WAV finale.
+
+    Una soglia impostata a None e' disattivata. engine e' un motore pyttsx3 esistente da riusare, viene usato per
+    la sintesi solo con un worker pyttsx3 e deve appartenere al thread chiamante (None ne crea uno con
+    get_pyttsx3_engine()). engine_factory crea i motori dei worker pyttsx3.
+    dictionary_whole_words e dictionary_ignore_case sono le opzioni di ricerca del dizionario.
+    stretch e' il motore che cambia la velocita' dei segmenti ("ffmpeg" o "wsola"), None usa stretch_engine.
+    schedule fa usare a ogni sottotitolo il silenzio dopo di esso prima di cambiarne la velocita', None usa timing_scheduler.
+    use_speech_model sintetizza ogni sottotitolo alla velocita' prevista dal suo testo, None usa l'impostazione use_speech_model.
+    progress(stage, done, total) viene chiamata dopo ogni sottotitolo delle fasi "tts" e "segments" e per la fase "mix".
+    Quando cancel_event e' impostato il lavoro si ferma dopo il sottotitolo corrente e viene sollevata PipelineCancelled.
+    work_dir e' la cartella del lavoro: i suoi segmenti, i file temporanei e gli output predefiniti vanno li' invece che nella
+    cartella dello script, cosi' lavori con work_dir diverse possono essere eseguiti contemporaneamente.
+    notify(message) riceve gli avvisi per l'utente, ad esempio come e' stato riparato un SRT non valido.
+    """
+    output_final = output_wav or os.path.join(work_dir or script_dir, 'final_output.wav')
+    output_mp3 = output_mp3 or os.path.join(work_dir or script_dir, 'final_output.mp3')
+    shift_delay = 0.5
+    if notify is None:
+        notify = lambda message: None
+
+    if not srt_file or not os.path.exists(srt_file):
+        raise PipelineError(f"File SRT non trovato: {srt_file}")
+
+    try:
+        with tracing.span('read_srt', file=os.path.basename(srt_file)) as span:
+            subs = Subtitles.load(srt_file)
+            span.set(cues=len(subs), encoding=subs.encoding)
+    except Exception as e:
+        raise PipelineError(f"Errore nella lettura del file SRT: {str(e)}")
+
+    repair = None
+    if auto_repair_srt and not validate_srt(subs):
+        with tracing.span('repair_srt', cues=len(subs)) as span:
+            subs, changes = subs.repair()
+            span.set(**changes)
+        log(f"SRT repaired: {format_changes(changes)}")
+        notify(f"Il file SRT e' stato riparato: {format_changes(changes)}.")
+        repair = changes
+    if not validate_srt(subs):
+        raise PipelineError("Il file SRT contiene errori nei timestamp.")
+    # Tempi dei sottotitoli in secondi, convertiti una volta dagli array in millisecondi
+    starts = (subs.start / 1000).tolist()
+    ends = (subs.end / 1000).tolist()
+    durations = ((subs.end - subs.start) / 1000).tolist()
+    stretch = (stretch or stretch_engine).lower()
+    # Con lo scheduler dei tempi un sottotitolo puo' usare anche il silenzio dopo di esso, la sua velocita' cambia solo quando non ci sta
+    schedule = auto_adjust and (timing_scheduler if schedule is None else schedule)
+    # Il parametro ha il nome dell'impostazione del modulo che sostituisce
+    use_speech_model = auto_adjust and (globals()['use_speech_model'] if use_speech_model is None else use_speech_model)
+    if schedule:
+        spoken = [duration > 0 and bool(text.strip()) for duration, text in zip(durations, subs.texts)]
+        windows = cue_windows(subs.start, subs.end, spoken, schedule_min_gap).tolist()
+    else:
+        windows = durations
+
+    log(f"Using TTS engine: {'edge-tts' if use_edge_tts else 'pyttsx3'} with voice: {voice_id}")
+
+    if not use_edge_tts:
+        engine = engine or get_pyttsx3_engine()
+        engine.setProperty('voice', voice_id)
+
+    dictionary = load_dictionary(dictionary_file, dictionary_whole_words, dictionary_ignore_case)
+    if progress is None:
+        progress = lambda stage, done, total: None
+
+    output_dir = os.path.join(work_dir or script_dir, 'audio_segments')
+    temp_dir = job_temp_dir(work_dir)
+    manifest = None
+    try:
+        audio_files = []
+        os.makedirs(output_dir, exist_ok=True)
+
+        engine_name = 'edge-tts' if use_edge_tts else 'pyttsx3'
+        engine_rate = '+0%' if use_edge_tts else engine.getProperty('rate')
+
+        # I sottotitoli generati dall'esecuzione precedente con stessi testo, tempi, voce e soglie vengono riusati
+        manifest = JobManifest(output_dir)
+        cue_keys = {}
+        cue_texts = {}
+        for i, content in enumerate(subs.texts):
+            if durations[i] <= 0 or not content.strip():
+                continue
+            text = cue_texts[i] = dictionary.apply(content)
+            cue_keys[i] = JobManifest.make_key(engine_name, voice_id, engine_rate, text, windows[i],
+                                               auto_adjust, slowdown_threshold, speedup_threshold, stretch, schedule)
+        # Lo store scarta i segmenti dell'esecuzione precedente non piu' usati prima che qualsiasi segmento venga letto
+        manifest.compact(set(cue_keys.values()))
+        rendered = {}
+        # Genera prima tutti i segmenti TTS, cosi' edge-tts puo' inviare le richieste in parallelo
+        tts_jobs = []
+        for i, key in cue_keys.items():
+            if key in rendered:
+                continue
+            # I sottotitoli identici a uno precedente vengono generati una volta sola
+            rendered[key] = manifest.get(key)
+            if rendered[key] is None:
+                tts_jobs.append((i, cue_texts[i], manifest.tts_file(key)))
+        log(f"Job manifest: {len(rendered) - len(tts_jobs)} segments reused, {len(tts_jobs)} to render")
+        render_jobs = tts_jobs
+
+        # Ogni sottotitolo viene sintetizzato alla velocita' prevista dal suo testo, cosi' quasi tutti entrano gia' nel loro tempo
+        speech_model = SpeechRateModel(speech_model_file) if use_speech_model else None
+        # Le velocita' previste dipendono da cio' che il modello ha imparato, il log e il manifest ne registrano lo stato
+        speech_state = None
+        if speech_model is not None:
+            speech_state = speech_model.state(engine_name, voice_id, engine_rate)
+            log(f"Speech rate model: {speech_state['samples']} cues measured for this voice, state {speech_state['digest']}")
+        cue_factors = {}
+        waves = [tts_jobs]
+        if speech_model is not None and speech_model.samples(engine_name, voice_id, engine_rate) < speech_model_min_samples:
+            # Una voce nuova viene calibrata sui suoi primi sottotitoli, generati alla velocita' normale
+            waves = [tts_jobs[:speech_model_min_samples], tts_jobs[speech_model_min_samples:]]
+
+        tts_cache = None
+        if use_tts_cache:
+            tts_cache = TTSCache(tts_cache_dir, tts_cache_max_mb * 1024 * 1024)
+        tts_errors = {}
+        tts_done = [0]
+        tts_total = [0]
+
+        def tts_progress():
+            tts_done[0] += 1
+            progress("tts", tts_done[0], tts_total[0])
+
+        for wave in waves:
+            if not wave or (cancel_event is not None and cancel_event.is_set()):
+                continue
+            wave_jobs = []
+            for i, text, output_audio in wave:
+                factor = 1.0
+                if speech_model is not None:
+                    target = windows[i] if schedule else durations[i] + 0.5
+                    factor = speech_model.rate_factor(engine_name, voice_id, engine_rate, text, target,
+                                                      slowdown_threshold, speedup_threshold)
+                    if schedule:
+                        # Lo scheduler non rallenta i sottotitoli che ci stanno, e nemmeno il motore
+                        factor = max(factor, 1.0)
+                cue_factors[i] = factor
+                rate = engine_rate if factor == 1 else engine_rate_for(engine_name, engine_rate, factor)
+                wave_jobs.append((i, text, output_audio, rate))
+            if speech_model is not None:
+                log(f"Speech rate model: {sum(cue_factors[job[0]] != 1 for job in wave_jobs)} of {len(wave_jobs)} cues "
+                    f"synthesized at a predicted rate")
+
+            if tts_cache is not None:
+                missing_jobs = []
+                with tracing.span('tts_cache') as span:
+                    for i, text, output_audio, rate in wave_jobs:
+                        if not tts_cache.get(TTSCache.make_key(engine_name, voice_id, rate, text), output_audio):
+                            missing_jobs.append((i, text, output_audio, rate))
+                    span.set(hits=len(wave_jobs) - len(missing_jobs), misses=len(missing_jobs))
+                log(f"TTS cache: {len(wave_jobs) - len(missing_jobs)} hits, {len(missing_jobs)} segments to generate")
+                wave_jobs = missing_jobs
+
+            tts_total[0] += len(wave_jobs)
+            progress("tts", tts_done[0], tts_total[0])
+            if use_edge_tts:
+                errors = generate_edge_tts_batch([(text, output_audio, rate) for _, text, output_audio, rate in wave_jobs],
+                                                 voice=voice_id, on_done=tts_progress, cancel_event=cancel_event,
+                                                 temp_dir=temp_dir)
+            else:
+                errors = generate_pyttsx3_batch(wave_jobs, voice_id, engine_rate, engine=engine, engine_factory=engine_factory,
+                                                on_done=tts_progress, cancel_event=cancel_event)
+            for (i, _, _, _), error in zip(wave_jobs, errors):
+                if error is not None:
+                    tts_errors[i] = error
+
+            for i, text, output_audio, rate in wave_jobs:
+                if i in tts_errors or not os.path.exists(output_audio):
+                    continue
+                if tts_cache is not None:
+                    tts_cache.put(TTSCache.make_key(engine_name, voice_id, rate, text), output_audio)
+                if speech_model is not None:
+                    try:
+                        frames, sample_rate, _ = wav_info(output_audio)
+                    except (OSError, ValueError, struct.error) as e:
+                        # Un file TTS che non e' un WAV leggibile non da' nessun campione, la conversione continua senza
+                        log(f"Skipping speech model sample for subtitle {i}: {e}")
+                        continue
+                    if frames:
+                        speech_model.add(engine_name, voice_id, engine_rate, text, frames / sample_rate, cue_factors[i])
+
+        if tts_cache is not None:
+            tts_cache.trim()
+        if speech_model is not None:
+            speech_model.save()
+        # I segmenti gia' generati restano in cache per la prossima esecuzione
+        check_cancelled(cancel_event)
+
+        last_end_time = 0
+        # Le pause e i sottotitoli vuoti sono solo offset, fissano la lunghezza minima della timeline
+        timeline_length = 0
+        # Frame, rate e canali dei segmenti del mix, letti dai mixer invece di decodificarli di nuovo
+        segment_index = {}
+
+        if len(subs) and starts[0] > 0:
+            silence_duration = starts[0]
+            timeline_length = max(timeline_length, silence_end(0, silence_duration))
+            log(f"Initial silence: {silence_duration}s")
+
+        # La regolazione della velocita' e la normalizzazione di ogni sottotitolo sono indipendenti, vengono eseguite in parallelo
+        segment_jobs = [
+            (i, output_audio, windows[i], manifest.adjusted_file(cue_keys[i]), cue_factors.get(i, 1.0))
+            for i, _, output_audio in render_jobs if i not in tts_errors
+        ]
+        with tracing.span('segments', segments=len(segment_jobs)):
+            segment_results = process_segments(segment_jobs, auto_adjust, slowdown_threshold, speedup_threshold,
+                                               progress=progress, cancel_event=cancel_event, stretch=stretch,
+                                               tolerance=stretch_tolerance if schedule or speech_model is not None else 0,
+                                               schedule=schedule, store=manifest.store if segment_store else None)
+        for i, (audio_file, too_short, info, speed) in segment_results.items():
+            rendered[cue_keys[i]] = (audio_file, too_short, info, speed)
+            manifest.put(cue_keys[i], audio_file, too_short, info, speed)
+        for i, error in tts_errors.items():
+            rendered[cue_keys[i]] = error
+
+        speeds = []
+        delays = []
+        placed_end = -math.inf  # Fine dell'ultimo segmento posizionato dallo scheduler dei tempi
+
+        for i, text in enumerate(subs.texts):
+            if durations[i] <= 0:
+                log(f"Skipping subtitle {i} due to invalid timing (start: {starts[i]}s, end: {ends[i]}s)")
+                last_end_time = ends[i]
+                continue
+
+            duration = durations[i]
+            log(f"Processing subtitle {i}: '{text}' (start: {starts[i]}s, end: {ends[i]}s, duration: {duration}s)")
+
+            if not text.strip():
+                log(f"Silence for empty subtitle {i} (duration: {duration}s)")
+                timeline_length = max(timeline_length, silence_end(starts[i], duration))
+                last_end_time = ends[i]
+                continue
+
+            if isinstance(rendered[cue_keys[i]], Exception):
+                log(f"Error generating TTS for subtitle {i}: {rendered[cue_keys[i]]}")
+                continue
+
+            audio_file, too_short, info, speed = rendered[cue_keys[i]]
+            if info is not None:
+                segment_index[audio_file] = info
+            speeds.append(1.0 if speed is None else speed)
+            if schedule:
+                # Un solo passaggio sui sottotitoli: un segmento inizia al suo sottotitolo o, quando il precedente lo supera, subito dopo
+                start_time = max(starts[i], placed_end + schedule_min_gap)
+                placed_end = start_time + indexed_duration(audio_file, segment_index)
+                delays.append(start_time - starts[i])
+                if start_time > starts[i]:
+                    log(f"Segment {i} moved by {start_time - starts[i]:.3f}s, the previous one runs past its start")
+                audio_files.append((audio_file, start_time, ends[i]))
+                if too_short:
+                    continue
+            elif too_short:
+                audio_files.append((audio_file, starts[i], ends[i]))
+                continue
+            else:
+                start_time = starts[i]
+                if i > 0 and (start_time - last_end_time) < 0.5:
+                    start_time += shift_delay
+                    log(f"Applied shift delay of {shift_delay}s for segment {i}: start_time adjusted to {start_time}s")
+                delays.append(start_time - starts[i])
+
+                audio_files.append((audio_file, start_time, ends[i]))
+
+            if i > 0:
+                silence_duration = starts[i] - last_end_time
+                if silence_duration > 0:
+                    timeline_length = max(timeline_length, silence_end(last_end_time, silence_duration))
+
+            last_end_time = ends[i]
+
+        with tracing.span('schedule') as span:
+            report = schedule_report(speeds, delays)
+            span.set(**report)
+        log(f"Timing: {report['stretched']} of {report['segments']} segments stretched ({report['shortened']} shortened, "
+            f"{report['lengthened']} lengthened, average {report['mean_change']:.1%}, max {report['max_change']:.1%}), "
+            f"{report['delayed']} moved after their cue (max {report['max_delay']:.3f}s)")
+        manifest.report = report
+        manifest.repair = repair
+        manifest.speech_model = speech_state
+        manifest.save(set(cue_keys.values()))
+        check_cancelled(cancel_event)
+
+        if not audio_files and not timeline_length:
+            raise PipelineError("Nessun file audio valido da concatenare.")
+
+        mixed_file = os.path.join(output_dir, 'timeline.wav')
+        progress("mix", 0, 1)
+        try:
+            # Normalizza e (opzionalmente) comprimi il file finale
+            if use_loudnorm and loudness_engine.lower() == "numpy":
+                # La timeline mixata viene misurata e normalizzata in memoria e scritta una sola volta
+                write_wav_samples(loudnorm_samples(mix_timeline_samples(audio_files, output_dir, timeline_length, segment_index)), output_final)
+            elif use_loudnorm:
+                mix_timeline(audio_files, mixed_file, output_dir, timeline_length, segment_index)
+                temp_final = os.path.join(temp_dir, f'temp_final_{os.urandom(8).hex()}.wav')
+                loudnorm_audio(mixed_file, temp_final)
+                shutil.move(temp_final, output_final)
+            else:
+                mix_timeline(audio_files, mixed_file, output_dir, timeline_length, segment_index)
+                final_segment = AudioSegment.from_file(mixed_file)
+                compressed_final = compress_audio(final_segment)
+                normalized_final = normalize_audio(compressed_final, target_dbfs=-20.0)
+                normalized_final.export(output_final, format="wav")
+            log(f"File finale generato e processato: {output_final}")
+        except subprocess.CalledProcessError as e:
+            error_msg = f"Errore FFmpeg durante l'unione dei batch: {e.stderr}"
+            log(error_msg)
+            raise PipelineError(error_msg)
+        except Exception as e:
+            error_msg = f"Errore durante il mix dei segmenti: {e}"
+            log(error_msg)
+            raise PipelineError(error_msg)
+
+        ffmpeg_cmd = [get_ffmpeg_path(), '-i', output_final, '-c:a', 'mp3', '-b:a', '192k', output_mp3, '-y']
+        try:
+            with tracing.span('encode', format='mp3'):
+                run_subprocess(ffmpeg_cmd, capture_output=True, text=True, check=True)
+            log(f"File MP3 generato: {output_mp3}")
+        except subprocess.CalledProcessError as e:
+            error_msg = f"Errore FFmpeg durante la conversione in MP3: {e.stderr}"
+            log(error_msg)
+            raise PipelineError(error_msg)
+        progress("mix", 1, 1)
+
+        return output_final
+
+    except PipelineCancelled:
+        # Il manifest elenca solo i segmenti completati prima, i file parziali vengono eliminati dalla prossima esecuzione
+        log("Conversion cancelled")
+        raise
+    finally:
+        if manifest is not None:
+            manifest.store.close()
+        cleanup_pytemp(temp_dir)
+
+def probe_audio(input_file):
+    """Restituisce (sample rate, canali) del primo flusso audio di un file, letti dalla lista dei flussi stampata da FFmpeg.
+
+    Conta solo il mono, ogni altra disposizione viene decodificata come stereo: channels vale 1 o 2.
+    """
+    result = run_subprocess([get_ffmpeg_path(), '-hide_banner', '-i', input_file], check=False)
+    match = re.search(r'Stream #.*?Audio:.*?(\d+) Hz, ([^,\n]+)', result.stderr or '')
+    if match is None:
+        raise PipelineError(f"Nessun flusso audio trovato in '{os.path.basename(input_file)}'.")
+    layout = match.group(2).strip()
+    return int(match.group(1)), 1 if layout == 'mono' or layout.startswith('1 channel') else 2
+
+def probe_duration(input_file):
+    """Durata in secondi di un file, letta dall'intestazione stampata da FFmpeg, None quando non e' nota."""
+    result = run_subprocess([get_ffmpeg_path(), '-hide_banner', '-i', input_file], check=False)
+    match = re.search(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)', result.stderr or '')
+    if match is None:
+        return None
+    return int(match.group(1)) * 3600 + int(match.group(2)) * 60 + float(match.group(3))
+
+def spill_fits(input_file, sample_rate, temp_dir, copies=1):
+    """True quando temp_dir ha spazio per copies file raw stereo a 16 bit dell'audio di input_file, con il 10% di margine."""
+    duration = probe_duration(input_file)
+    if duration is None:
+        return False
+    try:
+        free = shutil.disk_usage(temp_dir).free
+    except OSError:
+        return False
+    return free > duration * sample_rate * 4 * copies * 1.1
+
+def has_video_stream(input_file):
+    """True quando FFmpeg elenca un flusso video nel file."""
+    result = run_subprocess([get_ffmpeg_path(), '-hide_banner', '-i', input_file], check=False)
+    return re.search(r'Stream #.*?Video:', result.stderr or '') is not None
+
+def decode_pcm16_chunks(input_file, sample_rate, frames, channels=2):
+    """Decodifica l'audio di un file con FFmpeg e lo restituisce in blocchi stereo a 16 bit di (frames, 2) campioni.
+
+    In memoria c'e' un solo blocco alla volta. Con channels 1 l'audio viene decodificato mono e copiato
+    su entrambi i canali come AudioSegment.pan(), l'upmix di FFmpeg lo abbasserebbe di 3 dB.
+    """
+    ffmpeg_cmd = [
+        get_ffmpeg_path(), '-v', 'error', '-i', input_file, '-vn',
+        '-f', 's16le', '-ar', str(sample_rate), '-ac', str(channels), 'pipe:1'
+    ]
+    log(f"Executing FFmpeg command: {' '.join(ffmpeg_cmd)}")
+    with tempfile.TemporaryFile() as errors:
+        process = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=errors)
+        finished = False
+        try:
+            while True:
+                data = process.stdout.read(frames * 2 * channels)
+                if not data:
+                    break
+                samples = np.frombuffer(data, dtype='<i2').reshape(-1, channels)
+                yield np.repeat(samples, 2, axis=1) if channels == 1 else samples
+            finished = True
+        finally:
+            # Quando chi legge si ferma prima viene fermato anche FFmpeg
+            process.stdout.close()
+            if not finished:
+                process.kill()
+            returncode = process.wait()
+        if returncode != 0:
+            errors.seek(0)
+            message = errors.read().decode('utf-8', errors='replace')
+            raise PipelineError(f"Errore FFmpeg nella decodifica di '{os.path.basename(input_file)}': {message}")
+
+def encode_pcm16_chunks(chunks, sample_rate, channels, output_file, output_args):
+    """Codifica blocchi a 16 bit con FFmpeg mentre vengono prodotti, l'audio intero non e' mai in memoria."""
+    ffmpeg_cmd = [
+        get_ffmpeg_path(), '-v', 'error', '-f', 's16le', '-ar', str(sample_rate), '-ac', str(channels),
+        '-i', 'pipe:0'
+    ] + output_args + [output_file, '-y']
+    log(f"Executing FFmpeg command: {' '.join(ffmpeg_cmd)}")
+    with tempfile.TemporaryFile() as errors, \
+            tracing.span('ffmpeg', 'subprocess', command=' '.join(ffmpeg_cmd)[:300]) as span:
+        process = subprocess.Popen(ffmpeg_cmd, stdin=subprocess.PIPE, stderr=errors)
+        written = 0
+        broken = False
+        try:
+            for chunk in chunks:
+                data = chunk.tobytes()
+                process.stdin.write(data)
+                written += len(data)
+            process.stdin.close()
+        except BrokenPipeError:
+            # FFmpeg si e' fermato, il suo errore viene segnalato sotto (alcune versioni escono con 0 dopo un errore nelle opzioni)
+            broken = True
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+        returncode = process.wait()
+        span.set(returncode=returncode, input_bytes=written)
+        if returncode != 0 or broken:
+            errors.seek(0)
+            raise subprocess.CalledProcessError(returncode, ffmpeg_cmd, stderr=errors.read().decode('utf-8', errors='replace'))
+
+def cancellable_chunks(chunks, cancel_event=None):
+    """Restituisce i blocchi di un generatore, che viene chiuso e solleva PipelineCancelled quando cancel_event e' impostato."""
+    try:
+        for chunk in chunks:
+            check_cancelled(cancel_event)
+            yield chunk
+    finally:
+        chunks.close()
+
+def spill_pcm16_chunks(chunks, raw_file):
+    """Restituisce i blocchi a 16 bit mentre li scrive in raw_file, un passaggio successivo li rilegge con read_pcm16_raw()."""
+    with open(raw_file, 'wb') as file:
+        for chunk in chunks:
+            file.write(chunk.tobytes())
+            yield chunk
+
+def read_pcm16_raw(raw_file, frames, channels=2):
+    """Restituisce i blocchi (frames, channels) a 16 bit di un file scritto da spill_pcm16_chunks(), uno alla volta."""
+    with open(raw_file, 'rb') as file:
+        while True:
+            data = file.read(frames * 2 * channels)
+            if not data:
+                break
+            yield np.frombuffer(data, dtype='<i2').reshape(-1, channels)
+
+def stream_dbfs(chunks):
+    """Livello in dBFS di blocchi a 16 bit come AudioSegment.dBFS, misurato un blocco alla volta."""
+    total = 0.0
+    count = 0
+    for chunk in chunks:
+        samples = chunk.ravel().astype(np.float64)
+        total += float(np.dot(samples, samples))
+        count += len(samples)
+    rms = math.sqrt(total / count) if count else 0.0
+    return 20 * math.log10(rms / 32768) if rms > 0 else float('-inf')
+
+def stream_loudnorm_gain(chunks, sample_rate):
+    """Misura il downmix mono di blocchi stereo a 16 bit e restituisce il guadagno lineare di loudnorm_gain()."""
+    with tracing.span('loudnorm', engine='numpy'):
+        meter = LoudnessMeter(sample_rate)
+        for chunk in chunks:
+            meter.add(chunk.mean(axis=1) / 32768)
+        return 10 ** (loudnorm_gain(meter.result()) / 20)
+
+def pan_gains(pan_amount):
+    """Guadagni sinistro e destro in dB applicati da AudioSegment.pan(), pan_amount da -1 (sinistra) a 1 (destra)."""
+    max_boost_db = 20 * math.log10(2.0)
+    boost_db = abs(pan_amount) * max_boost_db
+    reduce_factor = 2.0 - 10 ** (boost_db / 20)
+    reduce_db = 20 * math.log10(reduce_factor) if reduce_factor > 0 else float('-inf')
+    # Come pydub, l'aumento viene dimezzato: due altoparlanti non sommano 6 dB pieni
+    boost_db = boost_db / 2.0
+    return (boost_db, reduce_db) if pan_amount < 0 else (reduce_db, boost_db)
+
+def mix_pcm16_chunks(original_chunks, dubbed, sample_rate, frames, original_gain, dubbed_gain):
+    """Restituisce i blocchi stereo a 16 bit di originale + doppiaggio, ognuno moltiplicato per i suoi guadagni lineari (sinistro, destro).
+
+    original_chunks sono i blocchi stereo dell'originale e dubbed e' (file, canali), decodificato mentre viene
+    mixato. Il doppiaggio viene tagliato o completato con silenzio alla lunghezza dell'originale.
+    """
+    original_gain = np.asarray(original_gain, dtype=np.float32)
+    dubbed_gain = np.asarray(dubbed_gain, dtype=np.float32)
+    dubbed_chunks = decode_pcm16_chunks(dubbed[0], sample_rate, frames, dubbed[1])
+    try:
+        for chunk in original_chunks:
+            mixed = chunk * original_gain
+            dub_chunk = next(dubbed_chunks, None)
+            if dub_chunk is not None:
+                length = min(len(dub_chunk), len(mixed))
+                mixed[:length] += dub_chunk[:length] * dubbed_gain
+            # Saturato come la sovrapposizione di due AudioSegment a 16 bit
+            np.rint(mixed, out=mixed)
+            yield np.clip(mixed, -32768, 32767, out=mixed).astype('<i2')
+    finally:
+        dubbed_chunks.close()
+
+def video_args(video_file):
+    """Argomenti di output di FFmpeg che aggiungono il primo flusso video di video_file, copiato senza codificarlo di nuovo."""
+    return ['-i', video_file, '-map', '1:v:0', '-map', '0:a:0', '-c:v', 'copy']
+
+def mix_to_file(original_audio, dubbed_audio, original_volume, dubbed_volume, balance, output_file,
+                codec_args=None, video_file=None, temp_dir=None, cancel_event=None):
+    """Mixa l'audio/video originale con l'audio doppiato e codifica il mix in output_file.
+
+    codec_args sono gli argomenti FFmpeg del codec audio, None mantiene l'MP3 della Fase II. Con
+    video_file il flusso video di quel file viene copiato accanto al mix, cosi' l'audio viene codificato una sola volta.
+    I file temporanei vanno in temp_dir (predefinita pytemp), che viene svuotata alla fine. Quando cancel_event e'
+    impostato il mix si ferma dopo il blocco o il comando FFmpeg corrente e l'output_file parziale viene eliminato.
+    Con phase2_spill l'originale viene decodificato una volta e tenuto in un file raw in temp_dir (4 byte per frame, il mix
+    con il loudnorm numpy ne occupa altrettanti), senza o senza lo spazio viene decodificato di nuovo a ogni passaggio.
+    """
+    temp_dir = temp_dir or pytemp_dir
+    try:
+        # Sample rate del mix, il piu' alto dei due come AudioSegment.overlay()
+        try:
+            original_rate, original_channels = probe_audio(original_audio)
+            dubbed_rate, dubbed_channels = probe_audio(dubbed_audio)
+        except subprocess.CalledProcessError as e:
+            raise PipelineError(f"Errore nel caricamento dei file audio: {e.stderr}")
+        sample_rate = max(original_rate, dubbed_rate)
+        frames = int(phase2_chunk_seconds * sample_rate)
+        extra_args = video_args(video_file) if video_file else []
+        encode_error = "Errore durante l'unione" if video_file else "Errore FFmpeg durante la conversione in MP3"
+
+        # L'originale viene decodificato una sola volta, nel passaggio del livello, e scritto in un file raw che il passaggio successivo rilegge,
+        # quando c'e' spazio per esso (e per il mix misurato dal loudnorm numpy)
+        numpy_loudnorm = use_loudnorm and loudness_engine.lower() == "numpy"
+        spill = phase2_spill and spill_fits(original_audio, sample_rate, temp_dir, 2 if numpy_loudnorm else 1)
+        if phase2_spill and not spill:
+            log(f"Not enough free space in {temp_dir} to keep the decoded original, it is decoded in each pass")
+        original_raw = os.path.join(temp_dir, f'temp_original_{os.urandom(8).hex()}.pcm')
+
+        def original_chunks():
+            if spill:
+                return cancellable_chunks(read_pcm16_raw(original_raw, frames), cancel_event)
+            return cancellable_chunks(decode_pcm16_chunks(original_audio, sample_rate, frames, original_channels), cancel_event)
+
+        original_gain_db = original_volume
+        with tracing.span('level', spill=spill):
+            chunks = cancellable_chunks(
+                decode_pcm16_chunks(original_audio, sample_rate, frames, original_channels), cancel_event)
+            original_dbfs = stream_dbfs(spill_pcm16_chunks(chunks, original_raw) if spill else chunks)
+        if math.isfinite(original_dbfs) and abs(original_dbfs - (-20.0)) > 3:
+            original_gain_db += -20.0 - original_dbfs
+            log("Normalized original_segment to -20 dBFS")
+
+        balance_value = balance / 100
+        original_pan = pan_gains(-balance_value)
+        dubbed_pan = pan_gains(balance_value)
+        original_gain = [10 ** ((original_gain_db + pan) / 20) for pan in original_pan]
+        dubbed_gain = [10 ** ((dubbed_volume + pan) / 20) for pan in dubbed_pan]
+
+        def mixed_chunks():
+            return mix_pcm16_chunks(original_chunks(), (dubbed_audio, dubbed_channels), sample_rate, frames,
+                                    original_gain, dubbed_gain)
+
+        if numpy_loudnorm:
+            # L'MP3 e' mono come l'output di loudnorm_audio, quindi viene misurato il downmix
+            # Con lo spill il mix viene misurato e scritto in un file raw nello stesso passaggio, la codifica lo rilegge
+            if spill:
+                mixed_raw = os.path.join(temp_dir, f'temp_mixed_{os.urandom(8).hex()}.pcm')
+                gain = stream_loudnorm_gain(spill_pcm16_chunks(mixed_chunks(), mixed_raw), sample_rate)
+                os.remove(original_raw)
+                mixed = cancellable_chunks(read_pcm16_raw(mixed_raw, frames), cancel_event)
+            else:
+                gain = stream_loudnorm_gain(mixed_chunks(), sample_rate)
+                mixed = mixed_chunks()
+            normalized = (
+                np.clip(np.rint(chunk.mean(axis=1) * gain), -32768, 32767).astype('<i2') for chunk in mixed
+            )
+            output_args = extra_args + ['-ar', '24000'] + (codec_args or [])
+            try:
+                with tracing.span('encode', format=os.path.splitext(output_file)[1][1:]):
+                    encode_pcm16_chunks(normalized, sample_rate, 1, output_file, output_args)
+            except subprocess.CalledProcessError as e:
+                raise PipelineError(f"{encode_error}: {e.stderr}")
+        elif use_loudnorm:
+            # I due passaggi di FFmpeg loudnorm leggono un file WAV, scritto un blocco alla volta
+            temp_wav = os.path.join(temp_dir, f'temp_mixed_{os.urandom(8).hex()}.wav')
+            with tracing.span('overlay'):
+                with wave.open(temp_wav, 'wb') as wav:
+                    wav.setnchannels(2)
+                    wav.setsampwidth(2)
+                    wav.setframerate(sample_rate)
+                    for chunk in mixed_chunks():
+                        wav.writeframes(chunk.tobytes())
+            if video_file:
+                # loudnorm scrive un WAV senza perdita, l'unica codifica con perdita e' quella accanto al video
+                temp_output = os.path.join(temp_dir, f'temp_loudnorm_{os.urandom(8).hex()}.wav')
+                loudnorm_audio(temp_wav, temp_output, cancel_event)
+                ffmpeg_cmd = [get_ffmpeg_path(), '-i', temp_output] + extra_args + codec_args + [output_file, '-y']
+                try:
+                    run_subprocess(ffmpeg_cmd, capture_output=True, text=True, check=True, cancel_event=cancel_event)
+                except subprocess.CalledProcessError as e:
+                    raise PipelineError(f"{encode_error}: {e.stderr}")
+            else:
+                temp_mp3 = os.path.join(temp_dir, f'temp_mp3_{os.urandom(8).hex()}.mp3')
+                loudnorm_audio(temp_wav, temp_mp3, cancel_event)
+                shutil.move(temp_mp3, output_file)
+            os.remove(temp_wav)
+        else:
+            output_args = extra_args + (codec_args or ['-c:a', 'mp3', '-b:a', '192k'])
+            try:
+                with tracing.span('encode', format=os.path.splitext(output_file)[1][1:]):
+                    encode_pcm16_chunks(mixed_chunks(), sample_rate, 2, output_file, output_args)
+            except subprocess.CalledProcessError as e:
+                raise PipelineError(f"{encode_error}: {e.stderr}")
+        return output_file
+
+    except PipelineCancelled:
+            # Un output scritto a meta' sembrerebbe completo
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        raise
+    finally:
+        cleanup_pytemp(temp_dir)
+
+@traced_phase('phase2')
+def mix_original_audio(original_audio, dubbed_audio=None, original_volume=-6, dubbed_volume=7, balance=0, output_mp3=None,
+                       work_dir=None, cancel_event=None):
+    """Fase II: mixa l'audio/video originale con l'audio doppiato e restituisce il percorso dell'MP3.
+
+    balance va da -100 (originale a destra, doppiaggio a sinistra) a 100.
+    work_dir e' la cartella del lavoro e cancel_event ferma il lavoro, vedi convert_srt().
+    """
+    dubbed_audio = dubbed_audio or os.path.join(work_dir or script_dir, 'final_output.wav')
+    output_mp3 = output_mp3 or os.path.join(work_dir or script_dir, 'final_mix.mp3')
+
+    if not original_audio or not os.path.exists(original_audio):
+        raise PipelineError("Seleziona un file audio/video originale valido.")
+    if not os.path.exists(dubbed_audio):
+        raise PipelineError(f"Il file audio doppiato '{os.path.basename(dubbed_audio)}' non esiste. Esegui prima la conversione.")
+
+    mix_to_file(original_audio, dubbed_audio, original_volume, dubbed_volume, balance, output_mp3,
+                temp_dir=job_temp_dir(work_dir), cancel_event=cancel_event)
+    log(f'File finale generato: {output_mp3}')
+    return output_mp3
+
+@traced_phase('phase3')
+def merge_audio_video(original_video, dubbed_audio=None, output_video=None, work_dir=None, cancel_event=None):
+    """Fase III: sostituisce la traccia audio del video originale e restituisce il percorso del nuovo video.
+
+    work_dir e' la cartella del lavoro e cancel_event ferma il lavoro, vedi convert_srt().
+    """
+    dubbed_audio = dubbed_audio or os.path.join(work_dir or script_dir, 'final_mix.mp3')
+    output_video = output_video or os.path.join(work_dir or script_dir, 'final_video.mp4')
+
+    if not original_video or not os.path.exists(dubbed_audio):
+        raise PipelineError("Seleziona il video originale e assicurati di aver generato l'audio doppiato.")
+
+    try:
+        ffmpeg_cmd = [
+            get_ffmpeg_path(), '-i', original_video, '-i', dubbed_audio,
+            '-c:v', 'copy', '-c:a', 'aac', '-b:a', '192k',
+            '-map', '0:v:0', '-map', '1:a:0', output_video, '-y'
+        ]
+        run_subprocess(ffmpeg_cmd, capture_output=True, text=True, check=True, cancel_event=cancel_event)
+        log(f'File video finale generato: {output_video}')
+        return output_video
+    except subprocess.CalledProcessError as e:
+        error_msg = f"Errore FFmpeg: {e.stderr}"
+        log(error_msg)
+        raise PipelineError(f"Errore durante l'unione: {error_msg}")
+    except PipelineCancelled:
+        # Un output scritto a meta' sembrerebbe completo
+        if os.path.exists(output_video):
+            os.remove(output_video)
+        raise
+    finally:
+        cleanup_pytemp(job_temp_dir(work_dir))
+
+@traced_phase('mixmerge')
+def mix_and_merge(original_video, dubbed_audio=None, original_volume=-6, dubbed_volume=7, balance=0, output_video=None,
+                  work_dir=None, cancel_event=None):
+    """Fase II e III in un solo passaggio: mixa l'audio e lo scrive accanto al flusso video non modificato.
+
+    Il mix viene codificato una volta, direttamente in AAC, invece di passare da final_mix.mp3.
+    work_dir e' la cartella del lavoro e cancel_event ferma il lavoro, vedi convert_srt().
+    """
+    dubbed_audio = dubbed_audio or os.path.join(work_dir or script_dir, 'final_output.wav')
+    output_video = output_video or os.path.join(work_dir or script_dir, 'final_video.mp4')
+
+    if not original_video or not os.path.exists(original_video):
+        raise PipelineError("Seleziona un file video originale valido.")
+    if not os.path.exists(dubbed_audio):
+        raise PipelineError(f"Il file audio doppiato '{os.path.basename(dubbed_audio)}' non esiste. Esegui prima la conversione.")
+    if not has_video_stream(original_video):
+        raise PipelineError(f"Nessun flusso video trovato in '{os.path.basename(original_video)}', usa la Fase II per un file audio.")
+
+    # Con loudnorm il mix e' mono come final_mix.mp3, senza e' stereo
+    channels = 1 if use_loudnorm else 2
+    codec_args = ['-c:a', 'aac', '-b:a', f'{mixmerge_kbps_per_channel * channels}k']
+    mix_to_file(original_video, dubbed_audio, original_volume, dubbed_volume, balance, output_video,
+                codec_args=codec_args, video_file=original_video, temp_dir=job_temp_dir(work_dir),
+                cancel_event=cancel_event)
+    log(f'File video finale generato: {output_video}')
+    return output_video
@@ -0,0 +1,217 @@
+# pySubTTS - versione a riga di comando, non richiede PyQt5 ne' un display
+# By MoonDragon (https://github.com/MoonDragon-MD/pySubTTS)
+# Esempi
+# python3 pySubTTS_cli.py convert input.srt --edge --voice it-IT-ElsaNeural
+# python3 pySubTTS_cli.py mix original.mp4
+# python3 pySubTTS_cli.py merge original.mp4
+# python3 pySubTTS_cli.py mixmerge original.mp4
+# python3 pySubTTS_cli.py voices
+# python3 pySubTTS_cli.py batch cartella_stagione --edge --voice it-IT-ElsaNeural -o cartella_doppiati
+# python3 pySubTTS_cli.py --trace trace.json convert input.srt --voice <id>
+
+import os
+import sys
+import argparse
+import pipeline
+import tracing
+import batch
+
+def threshold(value):
+    """Converte una soglia in percentuale, "off" la disattiva."""
+    if value.lower() == "off":
+        return None
+    return int(value) / 100
+
+def convert_options(args):
+    """Argomenti keyword di convert_srt dati dalle opzioni dei comandi convert e batch."""
+    return dict(
+        voice_id=args.voice,
+        use_edge_tts=args.edge,
+        dictionary_file=args.dictionary,
+        dictionary_whole_words=args.whole_words,
+        dictionary_ignore_case=args.ignore_case,
+        auto_adjust=not args.no_auto_adjust,
+        slowdown_threshold=args.slowdown,
+        speedup_threshold=args.speedup,
+        stretch=args.stretch,
+        schedule=False if args.no_scheduler else None,
+        use_speech_model=False if args.no_speech_model else None
+    )
+
+def run_convert(args):
+    output_final = pipeline.convert_srt(
+        args.srt,
+        output_wav=args.output_wav,
+        output_mp3=args.output_mp3,
+        notify=print,
+        **convert_options(args)
+    )
+    print(f"Conversione completata: {output_final}")
+
+def run_mix(args):
+    output_mp3 = pipeline.mix_original_audio(
+        args.original,
+        dubbed_audio=args.dubbed,
+        original_volume=args.original_volume,
+        dubbed_volume=args.dubbed_volume,
+        balance=args.balance,
+        output_mp3=args.output
+    )
+    print(f"File audio generato: {output_mp3}")
+
+def run_merge(args):
+    output_video = pipeline.merge_audio_video(args.original, dubbed_audio=args.dubbed, output_video=args.output)
+    print(f"File video generato: {output_video}")
+
+def run_mixmerge(args):
+    output_video = pipeline.mix_and_merge(
+        args.original,
+        dubbed_audio=args.dubbed,
+        original_volume=args.original_volume,
+        dubbed_volume=args.dubbed_volume,
+        balance=args.balance,
+        output_video=args.output
+    )
+    print(f"File video generato: {output_video}")
+
+def run_batch(args):
+    output_dir = args.output or batch.default_output_dir(args.source)
+    jobs = batch.load_jobs(args.source, output_dir)
+    if args.convert_jobs:
+        pipeline.batch_convert_jobs = args.convert_jobs
+    if args.mix_jobs:
+        pipeline.batch_mix_jobs = args.mix_jobs
+    os.makedirs(output_dir, exist_ok=True)
+    report_file = os.path.join(output_dir, 'batch.json')
+    print(f"{len(jobs)} lavori in {output_dir}")
+
+    def progress(job, stage, done, total):
+        # Solo le fasi del batch, non ogni sottotitolo
+        if stage not in ('convert', 'mixmerge'):
+            return
+        phase = 'Fase I' if stage == 'convert' else 'Fase II e III'
+        if not done:
+            print(f"[{job.name}] {phase} avviata")
+        elif job.status in ('failed', 'cancelled'):
+            print(f"[{job.name}] {phase} {'fallita' if job.status == 'failed' else 'annullata'}" + (f": {job.error}" if job.error else ""))
+        else:
+            print(f"[{job.name}] {phase} completata in {job.timings[stage]:.1f}s")
+            if stage == 'convert':
+                for notice in job.notices:
+                    print(f"[{job.name}] {notice}")
+
+    batch.run_batch(
+        jobs,
+        convert_options(args),
+        mix_options=dict(original_volume=args.original_volume, dubbed_volume=args.dubbed_volume, balance=args.balance),
+        one_pass=not args.two_pass,
+        progress=progress,
+        report_file=report_file
+    )
+    failed = [job for job in jobs if job.status != 'done']
+    print(f"{len(jobs) - len(failed)} di {len(jobs)} lavori completati, resoconto salvato: {report_file}")
+    for job in failed:
+        print(f"  {job.name}: {job.status}" + (f" ({job.error})" if job.error else ""), file=sys.stderr)
+    if failed:
+        raise pipeline.PipelineError(f"{len(failed)} lavori non completati")
+
+def add_convert_arguments(parser):
+    """Opzioni della Fase I, condivise dai comandi convert e batch."""
+    parser.add_argument('--voice', required=True, help='Id della voce (nome edge-tts o id pyttsx3, vedi il comando voices)')
+    parser.add_argument('--edge', action='store_true', help='Usa Edge TTS (online) invece di pyttsx3 (offline)')
+    parser.add_argument('--dictionary', help='Percorso del file dizionario TXT (parola=pronuncia)')
+    parser.add_argument('--whole-words', action='store_true', help='Sostituisce le parole del dizionario solo quando sono parole intere')
+    parser.add_argument('--ignore-case', action='store_true', help='Cerca le parole del dizionario ignorando maiuscole/minuscole')
+    parser.add_argument('--no-auto-adjust', action='store_true', help='Non accelerare/rallentare i segmenti')
+    parser.add_argument('--slowdown', type=threshold, default=0.3, help='Soglia di rallentamento in percentuale o "off" (predefinita 30)')
+    parser.add_argument('--speedup', type=threshold, default=0.5, help='Soglia di accelerazione in percentuale o "off" (predefinita 50)')
+    parser.add_argument('--stretch', choices=['ffmpeg', 'wsola'],
+                        help=f'Motore che cambia la velocita\' dei segmenti, wsola lavora in memoria (predefinito {pipeline.stretch_engine})')
+    parser.add_argument('--no-scheduler', action='store_true',
+                        help='Adatta ogni segmento alla sua durata + 0.5s invece di usare prima il silenzio dopo di esso')
+    parser.add_argument('--no-speech-model', action='store_true',
+                        help='Sintetizza ogni sottotitolo alla velocita\' normale invece che a quella prevista dal suo testo')
+
+def add_mix_arguments(parser):
+    """Opzioni della Fase II, condivise dai comandi mix, mixmerge e batch."""
+    parser.add_argument('--original-volume', type=int, default=-6, help='Volume audio originale in dB (predefinito -6)')
+    parser.add_argument('--dubbed-volume', type=int, default=7, help='Volume audio doppiato in dB (predefinito 7)')
+    parser.add_argument('--balance', type=int, default=0, help='Bilanciamento audio L/R da -100 a 100 (predefinito 0)')
+
+def run_voices(args):
+    engine = pipeline.get_pyttsx3_engine()
+    for voice in engine.getProperty('voices'):
+        print(f"{voice.id}\t{voice.name}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Doppiaggio con TTS da sottotitoli SRT, senza GUI.")
+    parser.add_argument('--log', action='store_true', help='Stampa i messaggi di debug')
+    parser.add_argument('--trace', metavar='FILE', help='Salva in FILE una traccia Chrome/Perfetto dei tempi e stampa un riassunto')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    convert_parser = subparsers.add_parser('convert', help="Fase I: genera l'audio doppiato da un file SRT")
+    convert_parser.add_argument('srt', help='Percorso del file sottotitolo SRT')
+    add_convert_arguments(convert_parser)
+    convert_parser.add_argument('--output-wav', help='Percorso del WAV finale (predefinito final_output.wav)')
+    convert_parser.add_argument('--output-mp3', help="Percorso dell'MP3 finale (predefinito final_output.mp3)")
+    convert_parser.set_defaults(func=run_convert)
+
+    mix_parser = subparsers.add_parser('mix', help="Fase II: mixa l'audio/video originale con l'audio doppiato")
+    mix_parser.add_argument('original', help='Percorso del video/audio originale')
+    mix_parser.add_argument('--dubbed', help='Percorso del WAV doppiato (predefinito final_output.wav)')
+    add_mix_arguments(mix_parser)
+    mix_parser.add_argument('-o', '--output', help="Percorso dell'MP3 mixato (predefinito final_mix.mp3)")
+    mix_parser.set_defaults(func=run_mix)
+
+    merge_parser = subparsers.add_parser('merge', help="Fase III: unisce l'audio mixato con il video originale")
+    merge_parser.add_argument('original', help='Percorso del video originale')
+    merge_parser.add_argument('--dubbed', help="Percorso dell'audio mixato (predefinito final_mix.mp3)")
+    merge_parser.add_argument('-o', '--output', help='Percorso del video finale (predefinito final_video.mp4)')
+    merge_parser.set_defaults(func=run_merge)
+
+    mixmerge_parser = subparsers.add_parser('mixmerge', help="Fase II e III in un solo passaggio: mixa l'audio e lo unisce al video, codificandolo una sola volta")
+    mixmerge_parser.add_argument('original', help='Percorso del video originale')
+    mixmerge_parser.add_argument('--dubbed', help='Percorso del WAV doppiato (predefinito final_output.wav)')
+    add_mix_arguments(mixmerge_parser)
+    mixmerge_parser.add_argument('-o', '--output', help='Percorso del video finale (predefinito final_video.mp4)')
+    mixmerge_parser.set_defaults(func=run_mixmerge)
+
+    batch_parser = subparsers.add_parser('batch', help='Fase I, II e III di molte coppie SRT/video, ad esempio una stagione intera')
+    batch_parser.add_argument('source', help='Cartella di file SRT con i video dello stesso nome, o un manifest JSON '
+                                             '([{"srt": ..., "original": ..., "name": ...}])')
+    batch_parser.add_argument('-o', '--output', help='Cartella dei lavori, una sottocartella ciascuno (predefinita la cartella dubbed accanto alla sorgente)')
+    add_convert_arguments(batch_parser)
+    add_mix_arguments(batch_parser)
+    batch_parser.add_argument('--two-pass', action='store_true',
+                              help='Scrive final_mix.mp3 e poi lo unisce al video invece di mixare e unire in un solo passaggio')
+    batch_parser.add_argument('--convert-jobs', type=int,
+                              help=f'Lavori nella Fase I contemporaneamente, solo con --edge (predefinito {pipeline.batch_convert_jobs})')
+    batch_parser.add_argument('--mix-jobs', type=int,
+                              help=f'Lavori mixati e uniti contemporaneamente (predefinito {pipeline.batch_mix_jobs})')
+    batch_parser.set_defaults(func=run_batch)
+
+    voices_parser = subparsers.add_parser('voices', help='Elenca le voci pyttsx3 (offline)')
+    voices_parser.set_defaults(func=run_voices)
+
+    args = parser.parse_args()
+    if args.log:
+        pipeline.logging = "on"
+
+    if args.trace:
+        tracing.start()
+    try:
+        args.func(args)
+    except pipeline.PipelineError as e:
+        print(f"Errore: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if args.trace:
+            tracer = tracing.stop()
+            tracer.save(args.trace)
+            print(tracer.summary_table())
+            print(f"Traccia salvata: {args.trace}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+# pySubTTS - lettore SRT veloce, i sottotitoli sono tenuti in array di millisecondi e in una tabella dei testi
+# By MoonDragon (https://github.com/MoonDragon-MD/pySubTTS)
+# Usato da pipeline.py
+
+import re
+import codecs
+import chardet
+import numpy as np
+
+MIN_DURATION_MS = 500  # Durata data da repair() ai sottotitoli troppo corti, quando il successivo lascia spazio
+SAMPLE_SIZE = 64 * 1024  # Byte passati a chardet dall'inizio, dal centro e dalla fine del file
+BOMS = [  # Prima UTF-32, il suo BOM little endian inizia come quello UTF-16
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+# Stessi separatori del modulo srt, anche quelli a larghezza piena di alcuni sottotitoli asiatici
+SEPARATOR = '[,.:\uff0c\uff0e\u3002\uff1a]'
+TIMESTAMP = rf'(\d+){SEPARATOR}(\d+){SEPARATOR}(\d+)(?:{SEPARATOR}(\d*))?'
+# Riga dell'indice opzionale e riga dei tempi di un sottotitolo, il suo testo va dalla fine della corrispondenza al sottotitolo successivo
+CUE_REGEX = re.compile(
+    rf'^(?:[ \t]*-?\d+(?:\.\d*)?[ \t]*\r?\n)?[ \t]*{TIMESTAMP} *-[ -] *> *{TIMESTAMP}[^\r\n]*(?:\r?\n|\Z)',
+    re.MULTILINE
+)
+
+def detect_encoding(data):
+    """Restituisce la codifica dei byte di un file SRT, dal BOM, UTF-8 o chardet su un campione."""
+    for bom, encoding in BOMS:
+        if data.startswith(bom):
+            return encoding
+    try:
+        data.decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    if len(data) > 3 * SAMPLE_SIZE:
+        middle = len(data) // 2
+        data = data[:SAMPLE_SIZE] + data[middle:middle + SAMPLE_SIZE] + data[-SAMPLE_SIZE:]
+    return chardet.detect(data)['encoding']
+
+def decode(data):
+    """Decodifica i byte di un file SRT, restituisce (text, encoding)."""
+    encoding = detect_encoding(data)
+    if encoding is not None:
+        try:
+            return data.decode(encoding), encoding
+        except (UnicodeDecodeError, LookupError):
+            pass
+    # Il campione non e' bastato, chardet legge tutto il file come prima
+    encoding = chardet.detect(data)['encoding'] or 'latin-1'
+    return data.decode(encoding, errors='replace'), encoding
+
+def milliseconds(hours, minutes, seconds, millis):
+    return ((int(hours) * 60 + int(minutes)) * 60 + int(seconds)) * 1000 + (int(millis) if millis else 0)
+
+def format_timestamp(ms):
+    """Restituisce il timestamp SRT (HH:MM:SS,mmm) di un tempo in millisecondi."""
+    ms = int(ms)
+    return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d},{ms % 1000:03d}"
+
+def format_changes(changes):
+    """Descrive in una riga le modifiche restituite da Subtitles.repair()."""
+    parts = [
+        f"{changes['sorted']} sottotitoli spostati dall'ordinamento",
+        f"{changes['merged']} uniti a un sottotitolo con lo stesso inizio",
+        f"{changes['clipped']} tagliati all'inizio del sottotitolo successivo",
+        f"{changes['extended']} allungati verso la durata minima",
+    ]
+    return ', '.join(part for part, key in zip(parts, ('sorted', 'merged', 'clipped', 'extended')) if changes[key]) or "nessuna modifica"
+
+class Subtitles:
+    """Sottotitoli di un file SRT: inizio e fine in millisecondi (array int64) e il testo di ogni sottotitolo.
+
+    Non viene creato un oggetto per ogni sottotitolo, la pipeline legge direttamente gli array.
+    """
+
+    def __init__(self, start, end, texts, encoding=None):
+        self.start = np.asarray(start, dtype=np.int64)
+        self.end = np.asarray(end, dtype=np.int64)
+        self.texts = texts
+        self.encoding = encoding
+
+    def __len__(self):
+        return len(self.texts)
+
+    @classmethod
+    def parse(cls, text, encoding=None):
+        """Analizza il testo di un file SRT, i sottotitoli vengono letti uno dopo l'altro dalle righe dei tempi."""
+        starts = []
+        ends = []
+        texts = []
+        text_start = None
+        for match in CUE_REGEX.finditer(text):
+            if text_start is not None:
+                texts.append(text[text_start:match.start()])
+            starts.append(milliseconds(*match.group(1, 2, 3, 4)))
+            ends.append(milliseconds(*match.group(5, 6, 7, 8)))
+            text_start = match.end()
+        if text_start is None:
+            if text.strip():
+                raise ValueError("No subtitle found, the file is not in SRT format")
+        else:
+            texts.append(text[text_start:])
+        # I fine riga di Windows diventano \n e le righe vuote dopo il testo vengono rimosse
+        texts = [cue.replace('\r\n', '\n').rstrip('\n') for cue in texts]
+        return cls(starts, ends, texts, encoding)
+
+    @classmethod
+    def load(cls, srt_file):
+        """Legge un file SRT in qualsiasi codifica."""
+        with open(srt_file, 'rb') as file:
+            text, encoding = decode(file.read())
+        return cls.parse(text, encoding)
+
+    def first_error(self):
+        """Descrive il primo sottotitolo che finisce prima di iniziare o si sovrappone al precedente, None se sono tutti validi."""
+        invalid = np.flatnonzero(self.end <= self.start)
+        overlapping = np.flatnonzero(self.start[1:] < self.end[:-1]) + 1
+        if len(invalid) and (not len(overlapping) or invalid[0] <= overlapping[0]):
+            i = int(invalid[0])
+            return f"Invalid subtitle {i}: end ({format_timestamp(self.end[i])}) <= start ({format_timestamp(self.start[i])})"
+        if len(overlapping):
+            i = int(overlapping[0])
+            return (f"Overlapping subtitle {i}: start ({format_timestamp(self.start[i])}) "
+                    f"< previous end ({format_timestamp(self.end[i - 1])})")
+        return None
+
+    def repair(self, min_duration=MIN_DURATION_MS):
+        """Ordina i sottotitoli per inizio, unisce quelli con lo stesso inizio, taglia le sovrapposizioni e allunga quelli corti.
+
+        Restituisce (Subtitles, changes), changes conta i sottotitoli 'sorted', 'merged', 'clipped' e 'extended'.
+        I sottotitoli corti vengono allungati fino a min_duration millisecondi ma mai oltre il successivo, cosi' il
+        risultato supera sempre first_error(). Tutto lavora sugli array, i testi vengono solo riordinati.
+        """
+        order = np.argsort(self.start, kind='stable')
+        start = self.start[order]
+        end = self.end[order]
+        texts = [self.texts[i] for i in order.tolist()]
+        changes = {'sorted': int(np.count_nonzero(order != np.arange(len(order))))}
+
+        # I sottotitoli con lo stesso inizio (due tracce nello stesso momento) diventano uno, con la fine piu' tarda
+        first = np.flatnonzero(np.r_[True, start[1:] != start[:-1]]) if len(start) else np.zeros(0, dtype=np.int64)
+        changes['merged'] = len(start) - len(first)
+        if changes['merged']:
+            end = np.maximum.reduceat(end, first)
+            start = start[first]
+            bounds = np.r_[first, len(texts)].tolist()
+            # Le righe identiche (ripetute da alcuni sottotitoli automatici) vengono tenute una volta
+            texts = ['\n'.join(dict.fromkeys(texts[a:b])) for a, b in zip(bounds[:-1], bounds[1:])]
+
+        # Ogni sottotitolo finisce al massimo quando inizia il successivo
+        next_start = np.r_[start[1:], np.iinfo(np.int64).max]
+        clipped = end > next_start
+        changes['clipped'] = int(np.count_nonzero(clipped))
+        end = np.where(clipped, next_start, end)
+
+        target = np.minimum(start + min_duration, next_start)
+        extended = end < target
+        changes['extended'] = int(np.count_nonzero(extended))
+        end = np.where(extended, target, end)
+        return Subtitles(start, end, texts, self.encoding), changes
+
+    def to_srt(self):
+        """Restituisce i sottotitoli in formato SRT, numerati di nuovo da 1."""
+        return ''.join(
+            f"{index}\n{format_timestamp(start)} --> {format_timestamp(end)}\n{text}\n\n"
+            for index, (start, end, text) in enumerate(zip(self.start.tolist(), self.end.tolist(), self.texts), 1)
+        )
+
+    def save(self, srt_file):
+        """Scrive i sottotitoli in un file SRT in UTF-8."""
+        with open(srt_file, 'w', encoding='utf-8') as file:
+            file.write(self.to_srt())
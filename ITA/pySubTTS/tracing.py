@@ -0,0 +1,175 @@
+# pySubTTS - span di temporizzazione della pipeline, esportati come traccia Chrome/Perfetto e come tabella riassuntiva
+# By MoonDragon (https://github.com/MoonDragon-MD/pySubTTS)
+# Usato da pipeline.py e pySubTTS_cli.py
+# La traccia si apre in chrome://tracing o https://ui.perfetto.dev
+
+import os
+import json
+import time
+import threading
+
+_tracer = None  # Active Tracer, None when tracing is off
+
+class NullSpan:
+    """Span restituito quando la traccia e' disattivata, non fa nulla."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **args):
+        pass
+
+NULL_SPAN = NullSpan()
+
+class Span:
+    """Misura il blocco che racchiude, set() aggiunge argomenti noti solo alla fine (es. i byte scritti)."""
+
+    def __init__(self, tracer, name, category, lane, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.lane = lane
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.add(self.name, self.category, self.start, duration, self.args, self.lane)
+        return False
+
+    def set(self, **args):
+        self.args.update(args)
+
+class Tracer:
+    """Raccoglie gli span di un processo come eventi di traccia Chrome (eventi completi, tempi in microsecondi)."""
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.events = []
+        self.threads = {}
+        self.lanes = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, category, start, duration, args, lane=None):
+        with self.lock:
+            if lane is None:
+                tid = threading.get_ident()
+                if tid not in self.threads:
+                    self.threads[tid] = threading.current_thread().name
+            else:
+                # Gli span che si sovrappongono nello stesso thread (es. le richieste edge-tts) hanno una riga propria
+                tid = self.lanes.get(lane)
+                if tid is None:
+                    tid = self.lanes[lane] = len(self.lanes) + 1
+                    self.threads[tid] = lane
+            self.events.append({
+                'name': name, 'cat': category, 'ph': 'X', 'pid': self.pid, 'tid': tid,
+                'ts': round(start * 1e6, 1), 'dur': round(duration * 1e6, 1), 'args': args
+            })
+
+    def extend(self, events, threads=None):
+        """Aggiunge gli eventi registrati da un altro processo (vedi call_traced)."""
+        with self.lock:
+            self.events.extend(events)
+            for (pid, tid), thread_name in (threads or {}).items():
+                self.threads[(pid, tid)] = thread_name
+
+    def thread_names(self):
+        names = {}
+        for key, thread_name in self.threads.items():
+            pid, tid = key if isinstance(key, tuple) else (self.pid, key)
+            names[(pid, tid)] = thread_name
+        return names
+
+    def chrome_trace(self):
+        """Restituisce la traccia nel formato degli eventi di traccia Chrome, letto anche da Perfetto."""
+        metadata = []
+        pids = sorted({event['pid'] for event in self.events} | {self.pid})
+        for pid in pids:
+            process_name = 'pySubTTS' if pid == self.pid else f'worker {pid}'
+            metadata.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0, 'args': {'name': process_name}})
+        for (pid, tid), thread_name in self.thread_names().items():
+            metadata.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread_name}})
+        return {'traceEvents': metadata + sorted(self.events, key=lambda event: event['ts']), 'displayTimeUnit': 'ms'}
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.chrome_trace(), file, ensure_ascii=False)
+
+    def summary(self):
+        """Restituisce [(name, count, total, maximum)] in secondi, ordinati per tempo totale."""
+        totals = {}
+        for event in self.events:
+            count, total, maximum = totals.get(event['name'], (0, 0.0, 0.0))
+            duration = event['dur'] / 1e6
+            totals[event['name']] = (count + 1, total + duration, max(maximum, duration))
+        return sorted(((name,) + values for name, values in totals.items()), key=lambda row: -row[2])
+
+    def summary_table(self, slowest=10):
+        """Tabella di testo del riassunto seguita dai sottotitoli e dai sottoprocessi piu' lenti."""
+        lines = [f"{'span':<20}{'count':>8}{'total s':>11}{'mean ms':>11}{'max ms':>11}"]
+        for name, count, total, maximum in self.summary():
+            lines.append(f"{name:<20}{count:>8}{total:>11.3f}{total / count * 1000:>11.1f}{maximum * 1000:>11.1f}")
+        detailed = [event for event in self.events if event['cat'] in ('cue', 'subprocess')]
+        if detailed and slowest:
+            lines.append("")
+            lines.append(f"Slowest {min(slowest, len(detailed))} cues and subprocesses")
+            for event in sorted(detailed, key=lambda event: -event['dur'])[:slowest]:
+                # Il comando va per ultimo, e' l'argomento piu' lungo
+                args = sorted(event['args'].items(), key=lambda item: item[0] == 'command')
+                args = ', '.join(f'{key}={value}' for key, value in args)
+                lines.append(f"{event['dur'] / 1000:>11.1f} ms  {event['name']:<12}{args[:160]}")
+        return '\n'.join(lines)
+
+def enabled():
+    """True quando gli span vengono registrati."""
+    return _tracer is not None
+
+def start():
+    """Avvia la registrazione degli span di questo processo e restituisce il Tracer."""
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+def stop():
+    """Ferma la registrazione e restituisce il Tracer con gli span, None se la traccia era disattivata."""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+def span(name, category='stage', lane=None, **args):
+    """Restituisce un context manager che registra uno span, quasi gratuito quando la traccia e' disattivata.
+
+    category e' "phase", "stage", "cue" (un sottotitolo) o "subprocess". lane mette lo span su una riga propria.
+    """
+    tracer = _tracer
+    if tracer is None:
+        return NULL_SPAN
+    return Span(tracer, name, category, lane, args)
+
+def add_events(events, threads=None):
+    """Aggiunge alla traccia attiva gli span restituiti da call_traced."""
+    tracer = _tracer
+    if tracer is not None:
+        tracer.extend(events, threads)
+
+def call_traced(function, *args):
+    """Esegue function(*args) in un processo worker registrandone gli span, restituisce (result, events, threads)."""
+    global _tracer
+    previous = _tracer
+    # Un worker creato con fork eredita il tracer del padre, gli span vengono invece rimandati con il risultato
+    tracer = _tracer = Tracer()
+    try:
+        result = function(*args)
+    finally:
+        _tracer = previous
+    threads = {(tracer.pid, tid): thread_name for tid, thread_name in tracer.threads.items()}
+    return result, tracer.events, threads